@@ -0,0 +1,55 @@
+/**
+ * 分词计数性能对比：旧的按字符估算、整体分词计数、流式增量计数
+ *
+ * 运行：npm run bench:tokenizer（默认使用 BPE 词表，tokenizerVocab 置空时使用估算）
+ */
+import tokenizer from "@/lib/tokenizer.ts";
+
+// 旧版估算（中文 2 token/字符，其他 0.5 token/字符），仅用于对比
+function legacyEstimate(text: string) {
+    let tokens = 0;
+    for (let i = 0; i < text.length; i++) tokens += text.charCodeAt(i) > 255 ? 2 : 0.5;
+    return Math.ceil(tokens);
+}
+
+const SAMPLE = [
+    "豆包是字节跳动推出的大模型助手，可以回答问题、写作、翻译和编程。",
+    "The quick brown fox jumps over the lazy dog; it's 2025 and tokens cost money.\n",
+    "```ts\nconst total = items.reduce((sum, item) => sum + item.price * 1.08, 0);\n```\n",
+    "在流式输出中，每个分片只有几个字符，逐片计数需要处理片段跨分片的情况。",
+    "  - 列表项 one\n  - 列表项 two：包含 mixed 中英文 content。\n\n"
+].join("");
+const TEXT = SAMPLE.repeat(Math.ceil(2 * 1024 * 1024 / SAMPLE.length));
+const BYTES = Buffer.byteLength(TEXT);
+// 模拟上游 SSE 分片大小（字符）
+const CHUNK_SIZE = 6;
+const ROUNDS = 3;
+
+function bench(name: string, fn: () => number) {
+    fn();
+    let best = Infinity;
+    let tokens = 0;
+    for (let i = 0; i < ROUNDS; i++) {
+        const started = performance.now();
+        tokens = fn();
+        best = Math.min(best, performance.now() - started);
+    }
+    console.log(`${name.padEnd(14)} ${(BYTES / 1048576 / (best / 1000)).toFixed(1).padStart(8)} MB/s ${String(tokens).padStart(10)} tokens`);
+}
+
+await tokenizer.init();
+console.log(`text: ${(BYTES / 1048576).toFixed(2)} MB, ${TEXT.length} chars, chunk: ${CHUNK_SIZE} chars`);
+bench("legacy", () => legacyEstimate(TEXT));
+bench("count", () => tokenizer.count(TEXT));
+bench("streaming", () => {
+    const counter = tokenizer.createCounter();
+    for (let i = 0; i < TEXT.length; i += CHUNK_SIZE) counter.push(TEXT.slice(i, i + CHUNK_SIZE));
+    return counter.finish();
+});
+// 旧实现在流结束时对累积的全文整体估算，流式场景下等价于累积字符串 + 一次 legacy
+bench("legacy+concat", () => {
+    let text = "";
+    for (let i = 0; i < TEXT.length; i += CHUNK_SIZE) text += TEXT.slice(i, i + CHUNK_SIZE);
+    return legacyEstimate(text);
+});
+process.exit(0);
@@ -13,6 +13,9 @@ import util from "@/lib/util.ts";
 import { logRequest } from "@/lib/debug-logger.ts";
 import AccountManager from "@/lib/account-manager.ts";
 import TokenCounter from "@/lib/token-counter.ts";
+import metrics from "@/lib/metrics.ts";
+import tracing from "@/lib/tracing.ts";
+import tokenizer from "@/lib/tokenizer.ts";
 
 
 // 模型名称
@@ -250,9 +253,7 @@ async function request(method: string, uri: string, context: AccountContext, opt
         ..._.omit(options, "params", "headers"),
     };
 
-    logRequest(requestConfig.method || method, requestConfig.url || uri, requestConfig.params, requestConfig.headers, requestConfig.data);
-
-    const response = await axios.request(requestConfig);
+    const response = await tracing.span("upstream", () => logRequest(requestConfig, metrics.trackUpstream(uri, axios.request(requestConfig))), { uri: metrics.endpointLabel(uri) });
     // 流式响应直接返回response
     if (options.responseType == "stream")
         return response;
@@ -405,7 +406,7 @@ async function createCompletion(
         }
 
         const streamStartTime = util.timestamp();
-        const answer = await receiveStream(response.data, modelId);
+        const answer = await tracing.span("completion", () => receiveStream(response.data, modelId));
         logger.success(
             `Stream has completed transfer ${util.timestamp() - streamStartTime}ms`
         );
@@ -424,7 +425,7 @@ async function createCompletion(
 
         if (account && account.id) {
             AccountManager.updateAccountUsage(account.id, "chat", promptTokens, completionTokens);
-            TokenCounter.recordUsage(account.id, promptTokens, completionTokens);
+            TokenCounter.recordUsage(account.id, promptTokens, completionTokens, { type: "chat", model: modelId });
         }
 
         if (autoDelete) {
@@ -1286,6 +1287,8 @@ async function uploadFile(
     const isImage = /^image\//.test(mimeType);
     const ext = (extFromMime || path.extname(filename).replace(/^\./, "") || (mime.getExtension(mimeType) || "bin")).toLowerCase();
 
+    const observeUpload = metrics.uploadDuration.startTimer();
+    const endSpan = tracing.startSpan("upload", { bytes: fileData.length });
     try {
         const auth = await acquireUploadAuth(ctx, isImage ? 2 : 1);
         logger.info(`STS acquired for ${isImage ? "image" : "file"}`);
@@ -1332,8 +1335,12 @@ async function uploadFile(
             kind: isImage ? "image" : "file",
             ...(isImage ? {width: (size?.width || 1), height: (size?.height || 1)} : {}),
         };
+        observeUpload({ outcome: "ok" });
+        endSpan();
         return ref;
     } catch (e: any) {
+        observeUpload({ outcome: "error" });
+        endSpan({ error: e?.message || String(e) });
         const msg = (e && e.message) ? e.message : String(e || "");
         try {
             // @ts-ignore
@@ -1522,7 +1529,8 @@ function createTransStream(
     const transStream = new PassThrough();
     // 当有 tools 时，缓冲所有文本以在结束时检测 tool_call
     let toolBuffer = "";
-    let completionText = "";
+    // 补全 token 随输出增量计数，不再在结束时整体重新分词
+    const completionCounter = tokenizer.createCounter();
     const isBuffering = hasTools;
 
     !transStream.closed &&
@@ -1544,9 +1552,8 @@ function createTransStream(
 
     // 流结束时的统一处理函数
     const flushToolBuffer = () => {
-        let finalCompletionText = completionText;
+        const completionTokens = completionCounter.finish();
         if (isBuffering && toolBuffer) {
-            finalCompletionText = toolBuffer; // 如果缓冲了，则用缓冲的内容
             const toolResult = parseToolCalls(toolBuffer);
             if (toolResult) {
                 // 检测到工具调用，发送 tool_calls 格式的 chunk
@@ -1584,10 +1591,9 @@ function createTransStream(
                 
                 // 记录用量并发送 usage
                 const promptTokens = TokenCounter.estimateTokens(promptText);
-                const completionTokens = TokenCounter.estimateTokens(finalCompletionText);
                 if (account && account.id) {
                     AccountManager.updateAccountUsage(account.id, "chat", promptTokens, completionTokens);
-                    TokenCounter.recordUsage(account.id, promptTokens, completionTokens);
+                    TokenCounter.recordUsage(account.id, promptTokens, completionTokens, { type: "chat", model: finalModelName });
                 }
 
                 // 发送结束 chunk，finish_reason 为 tool_calls，包含 usage
@@ -1628,10 +1634,9 @@ function createTransStream(
         
         // 记录用量
         const promptTokens = TokenCounter.estimateTokens(promptText);
-        const completionTokens = TokenCounter.estimateTokens(finalCompletionText);
         if (account && account.id) {
             AccountManager.updateAccountUsage(account.id, "chat", promptTokens, completionTokens);
-            TokenCounter.recordUsage(account.id, promptTokens, completionTokens);
+            TokenCounter.recordUsage(account.id, promptTokens, completionTokens, { type: "chat", model: finalModelName });
         }
 
         // 常规结束，带上 usage
@@ -1750,7 +1755,7 @@ function createTransStream(
                 text = message.content;
             }
             if (text) {
-                completionText += text;
+                completionCounter.push(text);
                 if (isBuffering) {
 
                     // 有 tools 时缓冲文本，等待流结束后统一处理
@@ -12,6 +12,8 @@ import logger from "@/lib/logger.ts";
 import util from "@/lib/util.ts";
 import { logRequest } from "@/lib/debug-logger.ts";
 import TokenCounter from "@/lib/token-counter.ts";
+import metrics from "@/lib/metrics.ts";
+import tracing from "@/lib/tracing.ts";
 import AccountManager from "@/lib/account-manager.ts";
 
 // 模型名称
@@ -164,9 +166,7 @@ async function request(method: string, uri: string, context: AccountContext, opt
     };
 
     logger.info(`[Image Request] DeviceID: ${context.deviceId} | WebID: ${context.webId}`);
-    logRequest(requestConfig.method || method, requestConfig.url || uri, requestConfig.params, requestConfig.headers, requestConfig.data);
-
-    const response = await axios.request(requestConfig);
+    const response = await tracing.span("upstream", () => logRequest(requestConfig, metrics.trackUpstream(uri, axios.request(requestConfig))), { uri: metrics.endpointLabel(uri) });
     // 流式响应直接返回response
     if (options.responseType == "stream")
         return response;
@@ -274,13 +274,23 @@ function getConfiguredImageGenerationDelayMs() {
     return Math.max(0, delayMs);
 }
 
-async function waitBeforeImageGenerationIfNeeded() {
-    const delayMs = getConfiguredImageGenerationDelayMs();
-    if (delayMs <= 0) {
+/**
+ * 按账号令牌桶限速（配置了限速间隔时生效）：账号空闲时立即发起，仅在超出配置速率时等待；
+ * 带参考图时与参考图就绪等待同时计时，只等待两者中较长的一个
+ *
+ * @param account 账号
+ * @param hasAttachments 是否上传了参考图
+ */
+async function waitForImageGenerationSlot(account: any, hasAttachments = false) {
+    const rateWaitMs = await AccountManager.reserveImageGeneration(account);
+    const settleMs = hasAttachments ? getConfiguredImageGenerationDelayMs() : 0;
+    const waitMs = Math.max(rateWaitMs, settleMs);
+    if (waitMs <= 0) {
         return;
     }
-    logger.info(`参考图已就绪，等待 ${delayMs}ms 后再发起图片生成`);
-    await new Promise(resolve => setTimeout(resolve, delayMs));
+    if (rateWaitMs >= settleMs) logger.info(`账号图片生成速率已达上限，等待 ${waitMs}ms 后再发起图片生成`);
+    else logger.info(`参考图已就绪，等待 ${waitMs}ms 后再发起图片生成`);
+    await new Promise(resolve => setTimeout(resolve, waitMs));
 }
 
 function extractConversationId(raw: string) {
@@ -312,6 +322,8 @@ async function pollForImageResult(convId: string, context: AccountContext, timeo
     const startTime = Date.now();
     const emittedImageKeys = new Set<string>();
     let retryCount = 0;
+    const observePoll = metrics.pollDuration.startTimer({ type: "image" });
+    const endSpan = tracing.startSpan("poll");
 
     while (Date.now() - startTime < finalTimeout) {
         try {
@@ -389,6 +401,8 @@ async function pollForImageResult(convId: string, context: AccountContext, timeo
 
                 if (imageUrls.length > 0) {
                     logger.success(`轮询成功，获取到 ${imageUrls.length} 张图片`);
+                    observePoll({ outcome: "ok" });
+                    endSpan({ attempts: retryCount + 1 });
                     return imageUrls;
                 }
             }
@@ -399,6 +413,8 @@ async function pollForImageResult(convId: string, context: AccountContext, timeo
         }
     }
 
+    observePoll({ outcome: "timeout" });
+    endSpan({ attempts: retryCount, timeout: true });
     return [];
 }
 
@@ -468,9 +484,7 @@ async function createImageCompletion(
         }
         if (!ratio) ratio = "1:1";
 
-        if (attachments.length > 0) {
-            await waitBeforeImageGenerationIfNeeded();
-        }
+        await waitForImageGenerationSlot(account, attachments.length > 0);
 
         const contentJson = JSON.stringify({
             text: `帮我生成图片：${prompt}\n风格：${style}\n比例：${ratio}`,
@@ -540,7 +554,7 @@ async function createImageCompletion(
         }
 
         const streamStartTime = util.timestamp();
-        const answer = await receiveStream(response.data);
+        const answer = await tracing.span("completion", () => receiveStream(response.data));
         if (!answer.id) {
             logger.warn(`图片生成流提前结束，未获取到会话 ID，耗时 ${util.timestamp() - streamStartTime}ms`);
             throw createRetryGenerationEmpty("会话 ID 为空，说明生成失败需重试");
@@ -561,7 +575,7 @@ async function createImageCompletion(
         const accountId = (account as any).id;
         if (accountId) {
             AccountManager.updateAccountUsage(accountId, 'image', 0, 0);
-            TokenCounter.recordUsage(accountId, 0, 0);
+            TokenCounter.recordUsage(accountId, 0, 0, { type: "image", model });
         }
         answer.usage = {
             prompt_tokens: 0,
@@ -642,9 +656,7 @@ async function createImageCompletionStream(
         }
         if (!ratio) ratio = "1:1"; // 最终默认值
 
-        if (attachments.length > 0) {
-            await waitBeforeImageGenerationIfNeeded();
-        }
+        await waitForImageGenerationSlot(account, attachments.length > 0);
 
         const imageMessage = [
             {
@@ -724,7 +736,7 @@ async function createImageCompletionStream(
                 const accountId = (account as any).id;
                 if (accountId) {
                     AccountManager.updateAccountUsage(accountId, 'image', 0, 0);
-                    TokenCounter.recordUsage(accountId, 0, 0);
+                    TokenCounter.recordUsage(accountId, 0, 0, { type: "image", model });
                 }
                 if (autoDelete) {
                     removeConversation(convId, context).catch(
@@ -1212,6 +1224,8 @@ async function uploadFile(
     const isImage = /^image\//.test(mimeType);
     const ext = (extFromMime || path.extname(filename).replace(/^\./, "") || (mime.getExtension(mimeType) || "bin")).toLowerCase();
 
+    const observeUpload = metrics.uploadDuration.startTimer();
+    const endSpan = tracing.startSpan("upload", { bytes: fileData.length });
     try {
         const auth = await acquireUploadAuth(context, isImage ? 2 : 1);
         logger.info(`STS acquired for ${isImage ? "image" : "file"}`);
@@ -1258,8 +1272,12 @@ async function uploadFile(
             kind: isImage ? "image" : "file",
             ...(isImage ? {width: (size?.width || 1), height: (size?.height || 1)} : {}),
         };
+        observeUpload({ outcome: "ok" });
+        endSpan();
         return ref;
     } catch (e: any) {
+        observeUpload({ outcome: "error" });
+        endSpan({ error: e?.message || String(e) });
         const msg = (e && e.message) ? e.message : String(e || "");
         try {
             // @ts-ignore
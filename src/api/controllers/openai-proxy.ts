@@ -1,10 +1,136 @@
+import http from "http";
+import https from "https";
+import { Transform, TransformCallback, pipeline } from "stream";
 import axios from "axios";
 import AccountManager, { Account } from "@/lib/account-manager.ts";
 import Response from "@/lib/response/Response.ts";
 import TokenCounter from "@/lib/token-counter.ts";
-import { PassThrough } from "stream";
-import { createParser } from "eventsource-parser";
+import metrics from "@/lib/metrics.ts";
+import logger from "@/lib/logger.ts";
+import tokenizer, { StreamingTokenCounter } from "@/lib/tokenizer.ts";
 
+// 上游请求超时（毫秒）：发出请求到收到响应头的最长等待时间（axios timeout 不限制之后的流式响应体）
+const TIMEOUT = 300000;
+// 流式响应两次数据之间的最长等待时间，超过后中止上游请求
+const STREAM_IDLE_TIMEOUT = 300000;
+// 流结束时用于查找 usage 的尾部字节数（usage 位于最后的数据块中）
+const TAIL_BYTES = 16384;
+const EVENT_SEPARATOR = /\r?\n\r?\n/;
+const USAGE_PATTERN = /"usage"\s*:\s*\{/;
+
+// 所有第三方渠道共用长连接，避免每次请求重新建立 TCP/TLS 连接
+const client = axios.create({
+  httpAgent: new http.Agent({ keepAlive: true }),
+  httpsAgent: new https.Agent({ keepAlive: true }),
+  timeout: TIMEOUT
+});
+
+type Usage = { prompt_tokens?: number; completion_tokens?: number };
+
+// 已提示过流式未返回用量的渠道，每个账号只警告一次
+const missingUsageWarned = new Set<string>();
+
+/**
+ * 解析 SSE 事件中的 JSON 数据，[DONE] 或非 data 事件返回 null
+ */
+function parseEventData(event: string) {
+  const data = event.split(/\r?\n/)
+    .filter(line => line.startsWith("data:"))
+    .map(line => line.slice(5).trim())
+    .join("\n");
+  if (!data || data === "[DONE]") return null;
+  try {
+    return JSON.parse(data);
+  } catch (e) {
+    return null;
+  }
+}
+
+/**
+ * 流式透传
+ *
+ * 默认模式下上游数据块原样转发（不解码、不复制），只保留尾部若干数据块的引用，结束后从尾部解析 usage。
+ * 只有渠道需要时才按完整事件转发：剔除服务端附加请求的 usage 事件（dropUsage），或渠道开启逐块计数（counter）。
+ * 此时不完整的事件暂存到下一个数据块，只解码包含 usage 的事件（计数模式下解析全部事件的增量内容）。
+ */
+export class SSEPassThrough extends Transform {
+
+  private tail: Buffer[] = [];
+  private tailBytes = 0;
+  private pending: Buffer | null = null;
+  private usage: Usage | null = null;
+
+  constructor(private options: { dropUsage?: boolean; counter?: StreamingTokenCounter } = {}) {
+    super();
+  }
+
+  _transform(chunk: Buffer, _encoding: BufferEncoding, callback: TransformCallback) {
+    if (!this.options.dropUsage && !this.options.counter) {
+      this.tail.push(chunk);
+      this.tailBytes += chunk.length;
+      while (this.tail.length > 1 && this.tailBytes - this.tail[0].length >= TAIL_BYTES)
+        this.tailBytes -= this.tail.shift()!.length;
+      return callback(null, chunk);
+    }
+    const data = this.pending ? Buffer.concat([this.pending, chunk]) : chunk;
+    // 最后一个事件分隔符之后的内容为不完整事件
+    const lf = data.lastIndexOf("\n\n");
+    const crlf = data.lastIndexOf("\r\n\r\n");
+    const end = Math.max(lf === -1 ? 0 : lf + 2, crlf === -1 ? 0 : crlf + 4);
+    this.pending = end < data.length ? data.subarray(end) : null;
+    if (end > 0) this.processEvents(data.subarray(0, end));
+    callback();
+  }
+
+  _flush(callback: TransformCallback) {
+    if (this.pending) this.processEvents(this.pending);
+    this.pending = null;
+    callback();
+  }
+
+  private processEvents(data: Buffer) {
+    const { dropUsage, counter } = this.options;
+    // 不含 usage 且无需计数时整段转发，不解码
+    if (!counter && !data.includes('"usage"')) {
+      this.push(data);
+      return;
+    }
+    const text = data.toString("utf8");
+    const events = text.split(EVENT_SEPARATOR);
+    let dropped = false;
+    const kept = events.filter(event => {
+      const hasUsage = USAGE_PATTERN.test(event);
+      if (!counter && !hasUsage) return true;
+      const json = parseEventData(event);
+      if (!json) return true;
+      counter?.push(json.choices?.[0]?.delta?.content || "");
+      if (!hasUsage || !json.usage) return true;
+      this.usage = json.usage;
+      // 客户端未请求 usage 时剔除只含 usage 的事件（choices 为空）
+      if (dropUsage && !json.choices?.length) {
+        dropped = true;
+        return false;
+      }
+      return true;
+    });
+    this.push(dropped ? kept.join("\n\n") : data);
+  }
+
+  /**
+   * 上游返回的 usage：事件模式下为转发过程中记录的值，透传模式下从尾部查找最后一个带 usage 的事件
+   */
+  getUsage(): Usage | null {
+    if (this.usage || this.tail.length === 0) return this.usage;
+    const events = Buffer.concat(this.tail).toString("utf8").split(EVENT_SEPARATOR);
+    for (let i = events.length - 1; i >= 0; i--) {
+      if (!USAGE_PATTERN.test(events[i])) continue;
+      const usage = parseEventData(events[i])?.usage;
+      if (usage) return usage;
+    }
+    return null;
+  }
+
+}
 
 class OpenAIProxy {
   /**
@@ -22,71 +148,84 @@ class OpenAIProxy {
     const data = { ...body };
     if (modelName) data.model = modelName;
 
-    if (body.stream) {
-      const response = await axios({
-        method: "POST",
-        url,
-        data,
-        headers,
-        responseType: "stream",
-      });
-
-      // 实时计算流式 Token
-      let completionText = "";
-      const transStream = new PassThrough();
-      const parser = createParser((event) => {
-        if (event.type === "event") {
-          try {
-            const data = JSON.parse(event.data);
-            const content = data.choices?.[0]?.delta?.content || "";
-            completionText += content;
-            if (data.usage) {
-               // 如果 API 直接返回了 usage，我们可以使用它（有些 API 会在最后一个 chunk 返回）
-               AccountManager.updateAccountUsage(account.id, "chat", data.usage.prompt_tokens, data.usage.completion_tokens);
-               TokenCounter.recordUsage(account.id, data.usage.prompt_tokens, data.usage.completion_tokens);
-            }
-          } catch (e) {}
-        }
-      });
-
-      response.data.on("data", (chunk: Buffer) => {
-        transStream.write(chunk);
-        parser.feed(chunk.toString());
-      });
-
-      response.data.on("end", () => {
-        transStream.end();
-        // 如果 API 没有返回 usage，则自行估算
-        const promptText = body.messages?.map((m: any) => m.content).join("") || "";
-        const promptTokens = TokenCounter.estimateTokens(promptText);
-        const completionTokens = TokenCounter.estimateTokens(completionText);
-        
-        // 注意：这里可能需要防重记录，如果上面 data.usage 已经记录过了
-        // 为了简单，我们这里只在没返回 usage 时记录
-        AccountManager.updateAccountUsage(account.id, "chat", promptTokens, completionTokens);
-        TokenCounter.recordUsage(account.id, promptTokens, completionTokens);
-      });
-
-      return new Response(transStream, {
-        type: "text/event-stream",
-        headers: {
-            "Cache-Control": "no-cache, no-transform",
-            "Connection": "keep-alive",
-            "X-Accel-Buffering": "no"
-        }
-      });
-    } else {
-      const response = await axios.post(url, data, { headers });
-      const usage = response.data.usage || {};
-      const promptTokens = usage.prompt_tokens || TokenCounter.estimateTokens(body.messages?.map((m: any) => m.content).join("") || "");
-      const completionTokens = usage.completion_tokens || TokenCounter.estimateTokens(response.data.choices?.[0]?.message?.content || "");
-      
+    if (body.stream) return this.proxyChatStream(body, data, url, headers, account);
+
+    const response = await metrics.trackUpstream("/openai/chat/completions", client.post(url, data, { headers }));
+    const usage = response.data.usage || {};
+    const promptTokens = usage.prompt_tokens || TokenCounter.estimateTokens(body.messages?.map((m: any) => m.content).join("") || "");
+    const completionTokens = usage.completion_tokens || TokenCounter.estimateTokens(response.data.choices?.[0]?.message?.content || "");
+
+    AccountManager.updateAccountUsage(account.id, "chat", promptTokens, completionTokens);
+    TokenCounter.recordUsage(account.id, promptTokens, completionTokens, { type: "chat", model: body.model });
+
+    return response.data;
+  }
+
+  /**
+   * 流式聊天透传
+   *
+   * 默认原样转发上游字节，结束时从尾部读取 usage（客户端请求了 include_usage 或上游默认返回时可得）。
+   * 渠道开启“流式返回用量”（streamUsage）且客户端未指定 stream_options 时，请求上游在最后返回 usage，
+   * 并在转发时剔除该事件，客户端收到的内容与未附加时一致；渠道开启“逐块计数”（streamCount）时按增量内容自行计数。
+   * 用量在流关闭时记录一次，客户端提前断开或上游长时间无数据时中止上游请求。
+   */
+  private async proxyChatStream(body: any, data: any, url: string, headers: any, account: Account) {
+    const clientUsage = body.stream_options?.include_usage === true;
+    const injectUsage = !!account.streamUsage && !data.stream_options;
+    if (injectUsage) data.stream_options = { include_usage: true };
+    const counter = !clientUsage && !injectUsage && account.streamCount ? tokenizer.createCounter() : undefined;
+    const controller = new AbortController();
+    const response = await metrics.trackUpstream("/openai/chat/completions", client.request({
+      method: "POST",
+      url,
+      data,
+      headers,
+      responseType: "stream",
+      signal: controller.signal
+    }));
+
+    const upstream = response.data;
+    const transStream = new SSEPassThrough({ dropUsage: injectUsage, counter });
+    // 两次数据之间超时则中止，每个数据块只刷新计时器
+    let idle = false;
+    const idleTimer = setTimeout(() => {
+      idle = true;
+      controller.abort();
+    }, STREAM_IDLE_TIMEOUT);
+    let clientClosed = false;
+    // 先于 pipeline 注册，pipeline 回调执行时已能区分客户端断开
+    transStream.once("close", () => {
+      clearTimeout(idleTimer);
+      // 客户端断开时响应流被销毁（无错误），上游仍未结束则中止；上游出错时响应流带有错误
+      if (!upstream.readableEnded) {
+        clientClosed = !transStream.errored;
+        controller.abort();
+      }
+      const usage = transStream.getUsage();
+      if (!usage && !counter && !missingUsageWarned.has(account.id)) {
+        missingUsageWarned.add(account.id);
+        logger.warn(`[OpenAIProxy] ${account.name} stream returned no usage, completion tokens not counted; enable streamUsage or streamCount for this channel`);
+      }
+      const promptTokens = usage?.prompt_tokens ?? TokenCounter.estimateTokens(body.messages?.map((m: any) => m.content).join("") || "");
+      const completionTokens = usage?.completion_tokens ?? (counter ? counter.finish() : 0);
       AccountManager.updateAccountUsage(account.id, "chat", promptTokens, completionTokens);
-      TokenCounter.recordUsage(account.id, promptTokens, completionTokens);
-      
-      return response.data;
-    }
+      TokenCounter.recordUsage(account.id, promptTokens, completionTokens, { type: "chat", model: body.model });
+    });
+    pipeline(upstream, transStream, err => {
+      clearTimeout(idleTimer);
+      if (!err || clientClosed) return;
+      logger.warn(`[OpenAIProxy] ${account.name} stream ${idle ? `idle for ${STREAM_IDLE_TIMEOUT}ms, aborted` : `failed: ${err.code || err.message}`}`);
+    });
+    upstream.on("data", () => idleTimer.refresh());
 
+    return new Response(transStream, {
+      type: "text/event-stream",
+      headers: {
+          "Cache-Control": "no-cache, no-transform",
+          "Connection": "keep-alive",
+          "X-Accel-Buffering": "no"
+      }
+    });
   }
 
   /**
@@ -104,11 +243,11 @@ class OpenAIProxy {
     const data = { ...body };
     if (modelName) data.model = modelName;
 
-    const response = await axios.post(url, data, { headers });
+    const response = await metrics.trackUpstream("/openai/images/generations", client.post(url, data, { headers }));
     
     // 图片目前按次数计费，Token 设为 0
     AccountManager.updateAccountUsage(account.id, "image", 0, 0);
-    TokenCounter.recordUsage(account.id, 0, 0);
+    TokenCounter.recordUsage(account.id, 0, 0, { type: "image", model: body.model });
     
     return response.data;
   }
@@ -132,11 +271,11 @@ class OpenAIProxy {
     const data = { ...body };
     if (modelName) data.model = modelName;
 
-    const response = await axios.post(url, data, { headers });
+    const response = await metrics.trackUpstream("/openai/video/generations", client.post(url, data, { headers }));
     
     // 视频目前按次数计费，Token 设为 0
     AccountManager.updateAccountUsage(account.id, "video", 0, 0);
-    TokenCounter.recordUsage(account.id, 0, 0);
+    TokenCounter.recordUsage(account.id, 0, 0, { type: "video", model: body.model });
     
     return response.data;
 
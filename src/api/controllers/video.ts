@@ -15,6 +15,8 @@ import { logRequest } from "@/lib/debug-logger.ts";
 import { appendDumpText, dumpObject } from "@/lib/debug-dumper.ts";
 import images from "@/api/controllers/images.ts";
 import TokenCounter from "@/lib/token-counter.ts";
+import metrics from "@/lib/metrics.ts";
+import tracing from "@/lib/tracing.ts";
 import AccountManager from "@/lib/account-manager.ts";
 
 // 模型名称
@@ -40,6 +42,21 @@ type VideoReferenceImage = string | string[];
 const MAX_RETRY_COUNT = 0; // 调试阶段关闭重试，避免浪费额度
 // 重试延迟
 const RETRY_DELAY = 5000;
+// 无水印地址解析并发上限
+const PLAY_INFO_CONCURRENCY = 4;
+// 无水印地址缓存条目上限
+const PLAY_URL_CACHE_LIMIT = 500;
+// 签名地址无法解析过期时间时的默认有效期
+const PLAY_URL_DEFAULT_TTL = 10 * 60 * 1000;
+// 提前失效的安全余量，避免返回即将过期的地址
+const PLAY_URL_EXPIRY_MARGIN = 60 * 1000;
+// vid -> 无水印地址缓存
+const playUrlCache = new Map<string, { url: string; expiresAt: number }>();
+// 正在解析中的 vid，避免重复请求
+const playUrlPending = new Map<string, Promise<string | null>>();
+// 无水印地址解析并发控制
+let playInfoActive = 0;
+const playInfoWaiters: Array<() => void> = [];
 // 伪装headers
 const FAKE_HEADERS = {
     Accept: "*/*",
@@ -190,9 +207,7 @@ async function request(method: string, uri: string, context: AccountContext, opt
     };
 
     logger.info(`[Video Request] DeviceID: ${context.deviceId} | WebID: ${context.webId}`);
-    logRequest(requestConfig.method || method, requestConfig.url || uri, requestConfig.params, requestConfig.headers, requestConfig.data);
-
-    const response = await axios.request(requestConfig);
+    const response = await tracing.span("upstream", () => logRequest(requestConfig, metrics.trackUpstream(uri, axios.request(requestConfig))), { uri: metrics.endpointLabel(uri) });
     if (options.responseType == "stream")
         return response;
     return checkResult(response);
@@ -225,6 +240,73 @@ async function getVideoPlayInfo(vid: string, context: AccountContext) {
     return null;
 }
 
+/**
+ * 从签名地址中解析过期时间（毫秒时间戳），解析失败时使用默认有效期
+ */
+function getSignedUrlExpiry(url: string) {
+    try {
+        const { searchParams } = new URL(url);
+        for (const key of ["x-expires", "expires", "Expires"]) {
+            const value = Number(searchParams.get(key));
+            if (value > 0) return value < 1e12 ? value * 1000 : value;
+        }
+    } catch {
+        // 非标准 URL 直接使用默认有效期
+    }
+    return Date.now() + PLAY_URL_DEFAULT_TTL;
+}
+
+function acquirePlayInfoSlot(): Promise<void> {
+    if (playInfoActive < PLAY_INFO_CONCURRENCY) {
+        playInfoActive++;
+        return Promise.resolve();
+    }
+    return new Promise(resolve => playInfoWaiters.push(resolve));
+}
+
+function releasePlayInfoSlot() {
+    const next = playInfoWaiters.shift();
+    if (next) next();
+    else playInfoActive--;
+}
+
+/**
+ * 解析无水印地址（带缓存、并发去重与全局并发上限）
+ */
+async function resolveVideoPlayUrl(vid: string, context: AccountContext): Promise<string | null> {
+    const cached = playUrlCache.get(vid);
+    if (cached && cached.expiresAt - PLAY_URL_EXPIRY_MARGIN > Date.now()) return cached.url;
+    if (cached) playUrlCache.delete(vid);
+
+    const pending = playUrlPending.get(vid);
+    if (pending) return pending;
+
+    const task = (async () => {
+        await acquirePlayInfoSlot();
+        try {
+            const url = await getVideoPlayInfo(vid, context);
+            if (url) {
+                if (playUrlCache.size >= PLAY_URL_CACHE_LIMIT) {
+                    const now = Date.now();
+                    for (const [key, entry] of playUrlCache) {
+                        if (entry.expiresAt - PLAY_URL_EXPIRY_MARGIN <= now) playUrlCache.delete(key);
+                    }
+                    // 仍然超限则淘汰最早写入的条目
+                    if (playUrlCache.size >= PLAY_URL_CACHE_LIMIT)
+                        playUrlCache.delete(playUrlCache.keys().next().value);
+                }
+                playUrlCache.set(vid, { url, expiresAt: getSignedUrlExpiry(url) });
+            }
+            return url;
+        } finally {
+            releasePlayInfoSlot();
+            playUrlPending.delete(vid);
+        }
+    })();
+    playUrlPending.set(vid, task);
+    return task;
+}
+
 /**
  * 轮询会话获取视频结果
  * @param convId 会话ID
@@ -236,6 +318,8 @@ async function pollForVideoResult(convId: string, context: AccountContext, timeo
     const finalTimeout = timeoutMs > 0 ? timeoutMs : defaultTimeout;
     const startTime = Date.now();
     let retryCount = 0;
+    const observePoll = metrics.pollDuration.startTimer({ type: "video" });
+    const endSpan = tracing.startSpan("poll");
 
     while (Date.now() - startTime < finalTimeout) {
         try {
@@ -317,19 +401,10 @@ async function pollForVideoResult(convId: string, context: AccountContext, timeo
                                         const vid = vidObj.vid;
                                         if (vid && !emittedKeys.has(vid)) {
                                             emittedKeys.add(vid);
-                                            
-                                            // 尝试获取无水印地址
-                                            let finalUrl = vidObj.download_url || vidObj.video_url;
-                                            const noWatermarkUrl = await getVideoPlayInfo(vid, context);
-                                            if (noWatermarkUrl) {
-                                                finalUrl = noWatermarkUrl;
-                                                logger.success(`[Video] 成功获取无水印地址: ${vid}`);
-                                            }
-
                                             videos.push({
                                                 vid,
                                                 cover: vidObj.cover?.image_preview?.url || vidObj.cover?.image_thumb?.url || vidObj.cover?.key,
-                                                url: finalUrl
+                                                url: vidObj.download_url || vidObj.video_url
                                             });
                                         }
                                     }
@@ -340,7 +415,17 @@ async function pollForVideoResult(convId: string, context: AccountContext, timeo
                 }
 
                 if (videos.length > 0) {
+                    // 并发获取无水印地址
+                    await Promise.all(videos.map(async (video) => {
+                        const noWatermarkUrl = await resolveVideoPlayUrl(video.vid, context);
+                        if (noWatermarkUrl) {
+                            video.url = noWatermarkUrl;
+                            logger.success(`[Video] 成功获取无水印地址: ${video.vid}`);
+                        }
+                    }));
                     logger.success(`轮询成功，获取到 ${videos.length} 个视频`);
+                    observePoll({ outcome: "ok" });
+                    endSpan({ attempts: retryCount + 1 });
                     return videos;
                 }
             }
@@ -350,6 +435,8 @@ async function pollForVideoResult(convId: string, context: AccountContext, timeo
             logger.error(`[轮询视频] 出错:`, err);
         }
     }
+    observePoll({ outcome: "timeout" });
+    endSpan({ attempts: retryCount, timeout: true });
     return [];
 }
 
@@ -451,7 +538,7 @@ async function createVideoCompletion(
 
         const streamStartTime = util.timestamp();
         // 1. 先通过流式接口获取会话ID
-        const initialAnswer = await receiveStream(response.data);
+        const initialAnswer = await tracing.span("completion", () => receiveStream(response.data));
         const convId = initialAnswer.id;
         
         logger.info(`视频生成会话创建成功 ID=${convId}，开始轮询结果...`);
@@ -464,7 +551,7 @@ async function createVideoCompletion(
         const accountId = (account as any).id;
         if (accountId) {
              AccountManager.updateAccountUsage(accountId, 'video', 0, 0);
-             TokenCounter.recordUsage(accountId, 0, 0);
+             TokenCounter.recordUsage(accountId, 0, 0, { type: "video", model: videoParams.model });
         }
         
         // 3. 更新返回结果
@@ -623,7 +710,7 @@ async function createVideoCompletionStream(
             const accountId = (account as any).id;
             if (accountId) {
                  AccountManager.updateAccountUsage(accountId, 'video', 0, 0);
-                 TokenCounter.recordUsage(accountId, 0, 0);
+                 TokenCounter.recordUsage(accountId, 0, 0, { type: "video", model: videoParams.model });
             }
             if (autoDelete) {
                 removeConversation(convId, context).catch(
@@ -937,7 +1024,7 @@ function createTransStream(stream: any, endCallback?: Function, context?: any, a
                             const task = (async () => {
                                 let finalUrl = url || `(ID: ${vid})`;
                                 if (context) {
-                                    const noWatermark = await getVideoPlayInfo(vid, context);
+                                    const noWatermark = await resolveVideoPlayUrl(vid, context);
                                     if (noWatermark) finalUrl = noWatermark;
                                 }
                                 
@@ -7,7 +7,13 @@ import environment from "@/lib/environment.ts";
 import ResponsePolicyManager from "@/lib/response-policy.ts";
 import ModelManager from "@/lib/model-manager.ts";
 import TokenCounter from "@/lib/token-counter.ts";
+import { DIMENSIONS, Dimension } from "@/lib/usage-series.ts";
 import mediaTaskManager from "@/lib/media-task-manager.ts";
+import mediaStore from "@/lib/media-store.ts";
+import staticAssets from "@/lib/static-assets.ts";
+import lifecycle from "@/lib/lifecycle.ts";
+import metrics from "@/lib/metrics.ts";
+import cluster from "@/lib/cluster.ts";
 
 // 读取版本号
 const getVersion = async () => {
@@ -20,6 +26,21 @@ const getVersion = async () => {
     }
 };
 
+// 集群 worker：向主进程提供本进程的指标快照
+if (cluster.isWorker()) cluster.handle("metrics", () => metrics.snapshot());
+
+/**
+ * 导出 Prometheus 指标，集群模式下汇总主进程与各 worker 的指标并以 process 标签区分
+ */
+const renderMetrics = async () => {
+    if (!cluster.isCoordinator()) return metrics.render([{ metrics: metrics.snapshot() }]);
+    const workers = await cluster.callWorkers("metrics", "snapshot");
+    return metrics.render([
+        { labels: { process: "primary" }, metrics: metrics.snapshot() },
+        ...workers.map(({ workerId, result }) => ({ labels: { process: `worker-${workerId}` }, metrics: result }))
+    ]);
+};
+
 /**
  * 验证管理权限
  * @param req 请求对象
@@ -47,17 +68,9 @@ const withAuth = (fn: Function) => {
 
 export default {
     get: {
-        '/admin': async () => {
-            // ... (同前，不保护页面本身以便加载登录逻辑)
-            let filePath = 'public/admin.html';
-            if (!await fs.pathExists(filePath)) filePath = path.join(process.cwd(), 'admin.html');
-            if (!await fs.pathExists(filePath)) filePath = path.join(process.cwd(), 'public', 'admin.html');
-
-            if (await fs.pathExists(filePath)) {
-                const content = await fs.readFile(filePath);
-                return new Response(content, { type: 'html', headers: { 'Content-Type': 'text/html; charset=utf-8', Expires: '-1' } });
-            }
-            return new Response("Admin page not found.", { statusCode: 404 });
+        '/admin': async (req: any) => {
+            // 不保护页面本身以便加载登录逻辑
+            return staticAssets.createResponse(req, '/admin.html') || new Response("Admin page not found.", { statusCode: 404 });
         },
         '/admin/accounts': withAuth(async () => {
             const accounts = AccountManager.getAccountsData();
@@ -65,12 +78,16 @@ export default {
         }),
         '/admin/stats': withAuth(async () => {
             const stats = AccountManager.getStats();
-            return new SuccessfulBody(stats);
+            await mediaStore.ensureReady();
+            return new SuccessfulBody({ ...stats, media: mediaStore.getUsage() });
         }),
         '/admin/settings': withAuth(async () => {
             const settings = AccountManager.getSettings();
             return new SuccessfulBody(settings);
         }),
+        '/metrics': withAuth(async () => {
+            return new Response(await renderMetrics(), { type: "text/plain; version=0.0.4; charset=utf-8" });
+        }),
         '/admin/version': async () => { // 版本号允许公开查看
             const version = await getVersion();
             return new SuccessfulBody({ version });
@@ -87,8 +104,35 @@ export default {
             const stats = TokenCounter.getStats();
             return new SuccessfulBody({
                 hourly: stats.hourly,
-                daily: stats.daily
+                daily: stats.daily,
+                timezone: stats.timezone
             });
+        }),
+        '/admin/stats/series': withAuth(async (req: any) => {
+            const { from, to, resolution, group_by, type, model, channel, account } = req.query || {};
+            const parseTime = (value: any) => {
+                if (value === undefined || value === "") return undefined;
+                const time = /^\d+$/.test(String(value)) ? Number(value) : Date.parse(String(value));
+                if (!Number.isFinite(time)) throw new Error(`Invalid time: ${value}`);
+                return time;
+            };
+            try {
+                if (resolution && !["minute", "hour", "day"].includes(resolution))
+                    throw new Error("resolution must be minute, hour or day");
+                const groupBy = String(group_by || "").split(",").map((name: string) => name.trim()).filter(Boolean);
+                const invalid = groupBy.find((name: string) => !DIMENSIONS.includes(name as Dimension));
+                if (invalid) throw new Error(`Unknown dimension: ${invalid}`);
+                const result = TokenCounter.querySeries({
+                    from: parseTime(from),
+                    to: parseTime(to),
+                    resolution,
+                    groupBy: groupBy as Dimension[],
+                    filter: { type, model, channel, account }
+                });
+                return new SuccessfulBody(result);
+            } catch (err: any) {
+                return new Response({ code: 400, message: err.message, data: null }, { statusCode: 400 });
+            }
         })
     },
     post: {
@@ -164,11 +208,9 @@ export default {
             return new SuccessfulBody({ message: `Toggled ${updatedCount} keys for channel ${decodedName}` });
         }),
         '/admin/restart': withAuth(async () => {
-            // Delay exit slightly to allow the response to return
-            setTimeout(() => {
-                process.exit(0);
-            }, 1000);
-            return new SuccessfulBody({ message: "Restarting service..." });
+            // 排空进行中的请求后重启，集群模式下为滚动重启 worker
+            const mode = lifecycle.restart();
+            return new SuccessfulBody({ message: mode === "reload" ? "Reloading workers..." : "Restarting service...", mode });
         }),
         '/admin/media/clear': withAuth(async () => {
             const paths = await mediaTaskManager.clearLocalMedia();
@@ -7,8 +7,22 @@ import openaiProxy from '@/api/controllers/openai-proxy.ts';
 import AccountManager from '@/lib/account-manager.ts';
 import APIException from '@/lib/exceptions/APIException.ts';
 import FailureBody from '@/lib/response/FailureBody.ts';
+import util from '@/lib/util.ts';
 
 
+// n > 1 扇出时的最大并发生成数
+const MAX_FAN_OUT = 10;
+
+/**
+ * 将单次生成结果展开为 OpenAI images data[] 条目
+ */
+function extractImageData(result: any): any[] {
+    if (Array.isArray(result?.data)) return result.data;
+    const imageUrls = result?.choices?.[0]?.message?.images;
+    if (!Array.isArray(imageUrls)) return [];
+    return imageUrls.filter(Boolean).map((url: string) => ({ url }));
+}
+
 // 定义图片生成请求体的类型（可选，增强类型提示）
 interface ImageCompletionRequestBody {
     model: string;
@@ -74,6 +88,8 @@ export default {
             } = request.body as ImageCompletionRequestBody & { image?: string | string[] };
 
             const autoDelete = _.isBoolean(auto_delete) ? auto_delete : true; // Determine autoDelete value
+            const count = Math.min(Math.max(parseInt(n as any) || 1, 1), MAX_FAN_OUT);
+            const fanOut = !stream && count > 1;
             let assistantId = model && /^[a-z0-9]{24,}$/.test(model) ? model : undefined;
             if (!assistantId && account) {
                 const mapped = AccountManager.getMappedModel(account.id, model);
@@ -94,81 +110,120 @@ export default {
             };
 
             const maxRetries = 3;
-            let attempt = 0;
-            let lastError: any;
-
-            while (attempt < maxRetries) {
-                attempt++;
-                try {
-                    if (isPooled) {
-                        account = await AccountManager.acquireToken('image', model);
-                    }
-                    if (isPooled && account.type === 'openai') {
-                        const result = await openaiProxy.proxyImage(request.body, account);
-                        if (isPooled) AccountManager.releaseToken(account.token);
-                        return result;
-                    }
 
-                    if (stream) {
-                        const s = await images.createImageCompletionStream({
-                            model,
-                            prompt,
-                            ratio: size || ratio, // 不设默认值，由 controller 根据参考图尺寸决定
-                            style: style || "auto",
-                            referenceImage
-                        }, account, assistantId, 0, autoDelete);
+            // 单次生成（含换号重试），fan-out 模式下每个子任务独立调用
+            const generateOnce = async (fixedAccount?: any) => {
+                let account = fixedAccount;
+                let attempt = 0;
+                let lastError: any;
+
+                while (attempt < maxRetries) {
+                    attempt++;
+                    try {
                         if (isPooled) {
-                            const token = account.token;
-                            s.on('end', () => AccountManager.releaseToken(token));
-                            s.on('error', () => AccountManager.releaseToken(token));
+                            account = await AccountManager.acquireToken('image', model);
                         }
-                        return new Response(s, {
-                            type: "text/event-stream",
-                            headers: {
-                                "Cache-Control": "no-cache, no-transform",
-                                "Connection": "keep-alive",
-                                "X-Accel-Buffering": "no"
+                        if (isPooled && account.type === 'openai') {
+                            const result = await openaiProxy.proxyImage(fanOut ? { ...request.body, n: 1 } : request.body, account);
+                            if (isPooled) AccountManager.releaseToken(account.token);
+                            return result;
+                        }
+
+                        if (stream) {
+                            const s = await images.createImageCompletionStream({
+                                model,
+                                prompt,
+                                ratio: size || ratio, // 不设默认值，由 controller 根据参考图尺寸决定
+                                style: style || "auto",
+                                referenceImage
+                            }, account, assistantId, 0, autoDelete);
+                            if (isPooled) {
+                                const token = account.token;
+                                s.on('end', () => AccountManager.releaseToken(token));
+                                s.on('error', () => AccountManager.releaseToken(token));
                             }
-                        });
-                    } else {
-                        const result = await images.createImageCompletion({
-                            model,
-                            prompt,
-                            ratio: size || ratio, // 不设默认值，由 controller 根据参考图尺寸决定
-                            style: style || "auto",
-                            referenceImage
-                        }, account, assistantId, 0, autoDelete);
-                        if (isPooled) AccountManager.releaseToken(account.token);
-                        return result;
-                    }
-                } catch (err: any) {
-                    lastError = err;
-                    let policyAction = 'error';
-                    const statusCode = err.errcode || err.status || err.statusCode || err.response?.status;
-                    
-                    if (isPooled && account) {
-                        if (statusCode) {
-                            policyAction = AccountManager.applyResponsePolicy(account.id, statusCode);
+                            return new Response(s, {
+                                type: "text/event-stream",
+                                headers: {
+                                    "Cache-Control": "no-cache, no-transform",
+                                    "Connection": "keep-alive",
+                                    "X-Accel-Buffering": "no"
+                                }
+                            });
+                        } else {
+                            const result = await images.createImageCompletion({
+                                model,
+                                prompt,
+                                ratio: size || ratio, // 不设默认值，由 controller 根据参考图尺寸决定
+                                style: style || "auto",
+                                referenceImage
+                            }, account, assistantId, 0, autoDelete);
+                            if (isPooled) AccountManager.releaseToken(account.token);
+                            return result;
+                        }
+                    } catch (err: any) {
+                        lastError = err;
+                        let policyAction = 'error';
+                        const statusCode = err.errcode || err.status || err.statusCode || err.response?.status;
+                        
+                        if (isPooled && account) {
+                            if (statusCode) {
+                                policyAction = AccountManager.applyResponsePolicy(account.id, statusCode);
+                            }
+                            AccountManager.releaseToken(account.token);
+                        }
+
+                        if (err.message && err.message.includes('RETRY_GENERATION_EMPTY')) {
+                            policyAction = 'retry';
                         }
-                        AccountManager.releaseToken(account.token);
-                    }
 
-                    if (err.message && err.message.includes('RETRY_GENERATION_EMPTY')) {
-                        policyAction = 'retry';
+                        if (policyAction === 'retry' && attempt < maxRetries) {
+                            const l = require('@/lib/logger.ts').default;
+                            l.warn(`[API] 策略触发重图试 (第 ${attempt}/${maxRetries} 次): ${statusCode || err.message}`);
+                            continue;
+                        }
+                        throw err;
                     }
+                }
+                throw lastError;
+            };
 
-                    if (policyAction === 'retry' && attempt < maxRetries) {
-                        const l = require('@/lib/logger.ts').default;
-                        l.warn(`[API] 策略触发重图试 (第 ${attempt}/${maxRetries} 次): ${statusCode || err.message}`);
-                        continue;
+            // 6. n > 1 时并发扇出到多个账号，n 为生成次数（每次生成可返回多张图片），
+            // data[] 与 errors[] 中的 index 均为生成序号，按生成顺序合并结果
+            if (fanOut) {
+                const tokens = isPooled ? [] : images.tokenSplit(authHeader).filter(Boolean);
+                const settled = await Promise.allSettled(
+                    _.range(count).map(index => generateOnce(isPooled ? undefined : tokens[index % tokens.length]))
+                );
+                const data: any[] = [];
+                const errors: any[] = [];
+                settled.forEach((item, index) => {
+                    if (item.status === 'rejected') {
+                        const err = item.reason;
+                        errors.push({
+                            index,
+                            code: err instanceof APIException ? err.errcode : -1,
+                            message: err?.message || String(err)
+                        });
+                        return;
+                    }
+                    data.push(...extractImageData(item.value).map(image => ({ ...image, index })));
+                });
+                if (data.length === 0 && errors.length > 0) {
+                    const firstError = (settled.find(item => item.status === 'rejected') as PromiseRejectedResult).reason;
+                    if (firstError instanceof APIException) {
+                        return new Response(new FailureBody(firstError), { statusCode: firstError.httpStatusCode });
                     }
-                    throw err;
+                    throw firstError;
                 }
+                return {
+                    created: util.unixTimestamp(),
+                    data,
+                    ...(errors.length > 0 ? { errors } : {})
+                };
             }
-            if (lastError instanceof APIException) {
-                return new Response(new FailureBody(lastError), { statusCode: lastError.httpStatusCode });
-            }
-            throw lastError;
+
+            return await generateOnce(account);
         }
     }
 };
@@ -1,11 +1,12 @@
-import fs from 'fs-extra';
-
+import Request from '@/lib/request/Request.ts';
 import Response from '@/lib/response/Response.ts';
+import staticAssets from '@/lib/static-assets.ts';
 import chat from "./chat.ts";
 import images from "./images.ts"
 import video from "./video.ts";
 import media from "./media.ts";
 import ping from "./ping.ts";
+import ready from "./ready.ts";
 import token from './token.js';
 import models from './models.ts';
 import admin from './admin.ts';
@@ -13,14 +14,8 @@ import admin from './admin.ts';
 export default [
     {
         get: {
-            '/': async () => {
-                const content = await fs.readFile('public/welcome.html');
-                return new Response(content, {
-                    type: 'html',
-                    headers: {
-                        Expires: '-1'
-                    }
-                });
+            '/': async (request: Request) => {
+                return staticAssets.createResponse(request, '/welcome.html') || new Response("Not Found", { statusCode: 404 });
             }
         }
     },
@@ -29,6 +24,7 @@ export default [
     video,
     media,
     ping,
+    ready,
     token,
     models,
     admin
@@ -1,13 +1,22 @@
 import _ from "lodash";
+import path from "path";
+import fs from "fs-extra";
+import mime from "mime";
 
 import Request from "@/lib/request/Request.ts";
 import Response from "@/lib/response/Response.ts";
 import SuccessfulBody from "@/lib/response/SuccessfulBody.ts";
 import mediaTaskManager from "@/lib/media-task-manager.ts";
+import mediaBatchManager from "@/lib/media-batch-manager.ts";
+import mediaStore from "@/lib/media-store.ts";
+import mediaTaskNotifier from "@/lib/media-task-notifier.ts";
 import images from "@/api/controllers/images.ts";
 import video from "@/api/controllers/video.ts";
 import openaiProxy from "@/api/controllers/openai-proxy.ts";
 import AccountManager from "@/lib/account-manager.ts";
+import environment from "@/lib/environment.ts";
+import APIException from "@/lib/exceptions/APIException.ts";
+import EX from "@/api/consts/exceptions.ts";
 
 async function getImageAccount(authHeader: string, model: string) {
     if (authHeader.includes("pooled") || authHeader.length < 20) {
@@ -67,6 +76,175 @@ async function runWithRetries(executor: () => Promise<any>, maxRetries = 3) {
     throw lastError;
 }
 
+/**
+ * 创建图片生成执行器（含账号获取、释放与重试）
+ */
+function createImageExecutor(body: any, authHeader: string, onAccount?: (accountId: string) => void) {
+    return async () => {
+        return runWithRetries(async () => {
+            const { account, pooled } = await getImageAccount(authHeader, body.model);
+            if (pooled && account?.id) onAccount?.(account.id);
+            try {
+                if (pooled && account.type === "openai") {
+                    return await openaiProxy.proxyImage(body, account);
+                }
+                const assistantId = getAssistantId(account, body.model);
+                return await images.createImageCompletion({
+                    model: body.model,
+                    prompt: body.prompt,
+                    ratio: body.size || body.ratio,
+                    style: body.style || "auto",
+                    referenceImage: body.image
+                }, account, assistantId, 0, _.isBoolean(body.auto_delete) ? body.auto_delete : true);
+            } finally {
+                if (pooled && account?.token) AccountManager.releaseToken(account.token);
+            }
+        });
+    };
+}
+
+/**
+ * 创建视频生成执行器（含账号获取、释放与重试）
+ */
+function createVideoExecutor(body: any, authHeader: string, onAccount?: (accountId: string) => void) {
+    const model = body.model || "doubao-video";
+    return async () => {
+        return runWithRetries(async () => {
+            const { account, pooled } = await getVideoAccount(authHeader, model);
+            if (pooled && account?.id) onAccount?.(account.id);
+            try {
+                if (pooled && account.type === "openai") {
+                    return await openaiProxy.proxyVideo(body, account);
+                }
+                const assistantId = getAssistantId(account, model);
+                return await video.createVideoCompletion({
+                    model,
+                    prompt: body.prompt,
+                    ratio: body.ratio || "16:9",
+                    image: body.image
+                }, account, assistantId, 0, _.isBoolean(body.auto_delete) ? body.auto_delete : false);
+            } finally {
+                if (pooled && account?.token) AccountManager.releaseToken(account.token);
+            }
+        });
+    };
+}
+
+/**
+ * 提取任务调度参数：优先级与客户端标识（OpenAI user 字段优先，其次为客户端 IP）
+ */
+function getTaskOptions(request: Request, body: any = request.body) {
+    const authHeader = request.headers.authorization || "";
+    const pooled = authHeader.includes("pooled") || authHeader.length < 20;
+    return {
+        priority: body?.priority,
+        client: _.isString(body?.user) && body.user ? body.user : (request.remoteIP || "anonymous"),
+        pooled,
+        // 指定 Token 时凭据只保存在任务管理器的内存中
+        auth: pooled ? undefined : authHeader,
+        callback_url: body?.callback_url
+    };
+}
+
+// 记录执行任务的账号池账号，用于按账号查询任务
+mediaTaskManager.registerExecutor("image", (task, body, auth) => createImageExecutor(body, task.pooled ? "pooled" : auth || "", accountId => mediaTaskManager.assignAccount(task.id, accountId)));
+mediaTaskManager.registerExecutor("video", (task, body, auth) => createVideoExecutor(body, task.pooled ? "pooled" : auth || "", accountId => mediaTaskManager.assignAccount(task.id, accountId)));
+
+/**
+ * 是否为管理员请求（设置了管理密码且 Authorization 与之一致）
+ */
+function isAdminRequest(request: Request) {
+    const password = environment.adminPassword;
+    return !!password && (request.headers.authorization || "").replace("Bearer ", "") === password;
+}
+
+/**
+ * 解析查询时间：ISO 字符串或 Unix 秒，无效时返回 null
+ */
+function toISOTime(value?: string) {
+    if (!value) return undefined;
+    const date = /^\d+$/.test(value) ? new Date(Number(value) * 1000) : new Date(value);
+    return isNaN(date.getTime()) ? null : date.toISOString();
+}
+
+/**
+ * 解析回调地址的域名，拒绝指向内网、本机或链路本地地址的回调
+ */
+async function assertCallbackUrl(callbackUrl: any) {
+    if (_.isUndefined(callbackUrl)) return;
+    const reason = await mediaTaskNotifier.checkCallbackUrl(callbackUrl);
+    if (reason) throw new APIException(EX.API_REQUEST_PARAMS_INVALID, `Params body.callback_url invalid: ${reason}`).setHTTPStatusCode(400);
+}
+
+/**
+ * 读取批量条目：JSON 的 items 数组、text/plain 的 JSONL 文本或 multipart 上传的 JSONL 文件
+ */
+async function readBatchSpecs(request: Request) {
+    const file = _.castArray(request.files?.file || [])[0];
+    if (file) {
+        const content = await fs.readFile(file.filepath || file.path, "utf8");
+        return mediaBatchManager.parseSpecs(content);
+    }
+    if (_.isString(request.body)) return mediaBatchManager.parseSpecs(request.body);
+    return mediaBatchManager.parseSpecs(request.body?.items);
+}
+
+/**
+ * 查找媒体文件：优先内容寻址存储，其次旧版本按任务 ID 命名的文件
+ */
+async function resolveMediaFile(filename: string) {
+    if (!/^[\w-]+\.\w+$/.test(filename)) return null;
+    await mediaStore.ensureReady();
+    const stored = mediaStore.resolve(filename);
+    if (stored) return stored;
+    for (const dir of [mediaTaskManager.paths.imageDir, mediaTaskManager.paths.videoDir]) {
+        const filePath = path.join(dir, filename);
+        const stat = await fs.stat(filePath).catch(() => null);
+        if (stat?.isFile()) {
+            return {
+                path: filePath,
+                size: stat.size,
+                mime_type: undefined as string | undefined,
+                etag: `"${stat.size.toString(16)}-${Math.floor(stat.mtimeMs).toString(16)}"`,
+                immutable: false
+            };
+        }
+    }
+    return null;
+}
+
+/**
+ * 解析单段 Range，返回 undefined 表示忽略（格式不支持或多段，按完整内容响应），null 表示无法满足
+ */
+function parseByteRange(header: string, size: number) {
+    const match = /^bytes=(\d*)-(\d*)$/.exec(header.trim());
+    if (!match || (!match[1] && !match[2])) return undefined;
+    let start: number, end: number;
+    if (!match[1]) {
+        const suffix = Number(match[2]);
+        if (suffix === 0) return null;
+        start = Math.max(0, size - suffix);
+        end = size - 1;
+    } else {
+        start = Number(match[1]);
+        end = match[2] ? Math.min(Number(match[2]), size - 1) : size - 1;
+    }
+    if (start > end || start >= size) return null;
+    return { start, end };
+}
+
+async function createTaskEventResponse(ids: string[]) {
+    const stream = await mediaTaskNotifier.createEventStream(ids);
+    return new Response(stream, {
+        type: "text/event-stream",
+        headers: {
+            "Cache-Control": "no-cache, no-transform",
+            "Connection": "keep-alive",
+            "X-Accel-Buffering": "no"
+        }
+    });
+}
+
 export default {
     prefix: "/v1",
     post: {
@@ -78,35 +256,48 @@ export default {
                 .validate("body.size", (v) => _.isUndefined(v) || _.isString(v))
                 .validate("body.style", (v) => _.isUndefined(v) || _.isString(v))
                 .validate("body.image", (v) => _.isUndefined(v) || _.isString(v) || (_.isArray(v) && v.every(_.isString)))
+                .validate("body.callback_url", (v) => _.isUndefined(v) || mediaTaskNotifier.isValidCallbackUrl(v))
                 .validate("headers.authorization", _.isString);
 
+            await assertCallbackUrl(request.body.callback_url);
             const body = { ...request.body, stream: false };
-            const task = await mediaTaskManager.createTask("image", body, async () => {
-                return runWithRetries(async () => {
-                    const authHeader = request.headers.authorization || "";
-                    const { account, pooled } = await getImageAccount(authHeader, body.model);
-                    try {
-                        if (pooled && account.type === "openai") {
-                            return await openaiProxy.proxyImage(body, account);
-                        }
-                        const assistantId = getAssistantId(account, body.model);
-                        return await images.createImageCompletion({
-                            model: body.model,
-                            prompt: body.prompt,
-                            ratio: body.size || body.ratio,
-                            style: body.style || "auto",
-                            referenceImage: body.image
-                        }, account, assistantId, 0, _.isBoolean(body.auto_delete) ? body.auto_delete : true);
-                    } finally {
-                        if (pooled && account?.token) AccountManager.releaseToken(account.token);
-                    }
-                });
-            });
+            const task = await mediaTaskManager.createTask("image", body, getTaskOptions(request));
 
             return new SuccessfulBody({
                 task_id: task.id,
                 status: task.status,
-                query_url: `/v1/generations/tasks/${task.id}`
+                queue_position: task.queue_position,
+                query_url: `/v1/generations/tasks/${task.id}`,
+                events_url: `/v1/generations/tasks/${task.id}/events`
+            });
+        },
+        "/images/generations/batch": async (request: Request) => {
+            request.validate("headers.authorization", _.isString);
+
+            const authHeader = request.headers.authorization || "";
+            const defaults = _.isPlainObject(request.body) ? _.pick(request.body, ["model", "ratio", "size", "style", "auto_delete", "priority", "user"]) : {};
+            const specs = (await readBatchSpecs(request)).map(spec => ({ ...defaults, ...spec, stream: false }));
+            specs.forEach((spec, index) => {
+                const invalid = [
+                    !_.isString(spec.model) && "model",
+                    !_.isString(spec.prompt) && "prompt",
+                    ["ratio", "size", "style", "custom_id"].find(key => !_.isUndefined(spec[key]) && !_.isString(spec[key])),
+                    !_.isUndefined(spec.image) && !_.isString(spec.image) && !(_.isArray(spec.image) && spec.image.every(_.isString)) && "image"
+                ].find(Boolean);
+                if (invalid) throw new APIException(EX.API_REQUEST_PARAMS_INVALID, `Params items[${index}].${invalid} invalid`).setHTTPStatusCode(400);
+            });
+
+            const pooled = authHeader.includes("pooled") || authHeader.length < 20;
+            const tokenCount = pooled ? 0 : images.tokenSplit(authHeader).filter(Boolean).length;
+            const progress = mediaBatchManager.createBatch(specs, {
+                // 账号池模式按条目模型的可用图片账号数并发，指定 Token 模式按 Token 数并发
+                getConcurrency: spec => pooled ? AccountManager.getCapableAccountCount("image", spec.model) : tokenCount,
+                // 条目自身的 priority / user 优先于批次默认值；批量条目不支持回调
+                getTaskOptions: spec => ({ ...getTaskOptions(request, spec), callback_url: undefined })
+            });
+            return new SuccessfulBody({
+                ...progress,
+                query_url: `/v1/images/generations/batch/${progress.batch_id}`
             });
         },
         "/video/generations/async": async (request: Request) => {
@@ -115,41 +306,132 @@ export default {
                 .validate("body.ratio", (v) => _.isUndefined(v) || _.isString(v))
                 .validate("body.model", (v) => _.isUndefined(v) || _.isString(v))
                 .validate("body.image", (v) => _.isUndefined(v) || _.isString(v) || (_.isArray(v) && v.every(_.isString)))
+                .validate("body.callback_url", (v) => _.isUndefined(v) || mediaTaskNotifier.isValidCallbackUrl(v))
                 .validate("headers.authorization", _.isString);
 
+            await assertCallbackUrl(request.body.callback_url);
             const body = { ...request.body, stream: false };
-            const model = body.model || "doubao-video";
-            const task = await mediaTaskManager.createTask("video", body, async () => {
-                return runWithRetries(async () => {
-                    const authHeader = request.headers.authorization || "";
-                    const { account, pooled } = await getVideoAccount(authHeader, model);
-                    try {
-                        if (pooled && account.type === "openai") {
-                            return await openaiProxy.proxyVideo(body, account);
-                        }
-                        const assistantId = getAssistantId(account, model);
-                        return await video.createVideoCompletion({
-                            model,
-                            prompt: body.prompt,
-                            ratio: body.ratio || "16:9",
-                            image: body.image
-                        }, account, assistantId, 0, _.isBoolean(body.auto_delete) ? body.auto_delete : false);
-                    } finally {
-                        if (pooled && account?.token) AccountManager.releaseToken(account.token);
-                    }
-                });
-            });
+            const task = await mediaTaskManager.createTask("video", body, getTaskOptions(request));
 
             return new SuccessfulBody({
                 task_id: task.id,
                 status: task.status,
-                query_url: `/v1/generations/tasks/${task.id}`
+                queue_position: task.queue_position,
+                query_url: `/v1/generations/tasks/${task.id}`,
+                events_url: `/v1/generations/tasks/${task.id}/events`
             });
         }
     },
     get: {
+        "/images/generations/batch/:batch_id": async (request: Request) => {
+            const progress = mediaBatchManager.getProgress(request.params.batch_id);
+            if (!progress) {
+                return new Response({ code: 404, message: "Batch not found", data: null }, { statusCode: 404 });
+            }
+            return new SuccessfulBody(progress);
+        },
+        "/images/generations/batch/:batch_id/results": async (request: Request) => {
+            const stream = mediaBatchManager.createResultStream(request.params.batch_id);
+            if (!stream) {
+                return new Response({ code: 404, message: "Batch not found", data: null }, { statusCode: 404 });
+            }
+            return new Response(stream, {
+                type: "application/x-ndjson",
+                headers: {
+                    "Cache-Control": "no-cache, no-transform",
+                    "X-Accel-Buffering": "no"
+                }
+            });
+        },
+        "/media/files/:filename": async (request: Request) => {
+            const filename = String(request.params.filename || "");
+            const file = await resolveMediaFile(filename);
+            if (!file) {
+                return new Response({ code: 404, message: "Media file not found", data: null }, { statusCode: 404 });
+            }
+            const headers: Record<string, any> = {
+                "ETag": file.etag,
+                "Accept-Ranges": "bytes",
+                // 存储文件按内容命名，内容不会变化
+                "Cache-Control": file.immutable ? "public, max-age=31536000, immutable" : "public, max-age=86400"
+            };
+            const ifNoneMatch = request.headers["if-none-match"];
+            if (_.isString(ifNoneMatch) && ifNoneMatch.split(",").some(tag => ["*", file.etag].includes(tag.trim().replace(/^W\//, "")))) {
+                return new Response(null, { statusCode: 304, headers });
+            }
+
+            const type = file.mime_type || mime.getType(filename) || "application/octet-stream";
+            const ifRange = request.headers["if-range"];
+            const rangeHeader = request.headers.range;
+            const range = _.isString(rangeHeader) && (!ifRange || ifRange.trim() === file.etag)
+                ? parseByteRange(rangeHeader, file.size)
+                : undefined;
+            if (range === null) {
+                return new Response("Range Not Satisfiable", {
+                    statusCode: 416,
+                    headers: { ...headers, "Content-Range": `bytes */${file.size}` }
+                });
+            }
+            if (range) {
+                return new Response(fs.createReadStream(file.path, { start: range.start, end: range.end }), {
+                    statusCode: 206,
+                    type,
+                    headers: {
+                        ...headers,
+                        "Content-Range": `bytes ${range.start}-${range.end}/${file.size}`,
+                        "Content-Length": range.end - range.start + 1
+                    }
+                });
+            }
+            return new Response(fs.createReadStream(file.path), {
+                type,
+                headers: { ...headers, "Content-Length": file.size }
+            });
+        },
+        "/generations/tasks": async (request: Request) => {
+            request.validate("headers.authorization", _.isString);
+            const { status, type, client, account, user, created_after, created_before, limit, cursor } = request.query;
+            if (status && !["queued", "running", "succeeded", "failed"].includes(status))
+                return new Response({ code: 400, message: "Invalid status", data: null }, { statusCode: 400 });
+            if (type && !["image", "video"].includes(type))
+                return new Response({ code: 400, message: "Invalid type", data: null }, { statusCode: 400 });
+            const createdAfter = toISOTime(created_after);
+            const createdBefore = toISOTime(created_before);
+            if (createdAfter === null || createdBefore === null)
+                return new Response({ code: 400, message: "Invalid time range", data: null }, { statusCode: 400 });
+            // 非管理员只能查询自己提交的任务（与提交时相同的客户端标识：user 参数，缺省为客户端 IP）
+            const scopedClient = isAdminRequest(request)
+                ? client
+                : (_.isString(user) && user ? user : (request.remoteIP || "anonymous"));
+            try {
+                const result = await mediaTaskManager.listTasks({
+                    status,
+                    type,
+                    client: scopedClient,
+                    account,
+                    created_after: createdAfter,
+                    created_before: createdBefore,
+                    limit: Number(limit) || undefined,
+                    cursor
+                });
+                return new SuccessfulBody(result);
+            } catch (err: any) {
+                return new Response({ code: 400, message: err.message, data: null }, { statusCode: 400 });
+            }
+        },
+        "/generations/tasks/events": async (request: Request) => {
+            const ids = _.isString(request.query.ids) ? request.query.ids.split(",").map(id => id.trim()).filter(Boolean) : [];
+            if (ids.length === 0) {
+                return new Response({ code: 400, message: "ids is required", data: null }, { statusCode: 400 });
+            }
+            return createTaskEventResponse(ids);
+        },
+        "/generations/tasks/:task_id/events": async (request: Request) => {
+            return createTaskEventResponse([request.params.task_id]);
+        },
         "/generations/tasks/:task_id": async (request: Request) => {
-            const task = await mediaTaskManager.getTask(request.params.task_id);
+            const include = _.isString(request.query.include) ? request.query.include.split(",").map(item => item.trim()) : [];
+            const task = await mediaTaskManager.getTask(request.params.task_id, include);
             if (!task) {
                 return new Response({ code: 404, message: "Task not found", data: null }, { statusCode: 404 });
             }
@@ -0,0 +1,13 @@
+import Response from '@/lib/response/Response.ts';
+import lifecycle from '@/lib/lifecycle.ts';
+
+export default {
+  prefix: '/ready',
+  get: {
+    // 状态加载完成前或排空期间返回 503，供负载均衡/自动扩缩容探测
+    '': async () => {
+      const status = lifecycle.getStatus();
+      return new Response(status, { statusCode: status.ready ? 200 : 503 });
+    }
+  }
+}
@@ -15,6 +15,7 @@ const CRASH_RESTART_DELAY = 5000;  //进程崩溃重启延迟
 const LOG_PATH = path.resolve("./logs/daemon.log");  //守护进程日志路径
 let crashCount = 0;  //进程崩溃次数
 let currentProcess;  //当前运行进程
+let stopping = false;  //守护进程是否正在停止
 
 /**
  * 写入守护进程日志
@@ -42,7 +43,9 @@ function createProcess() {
     daemonLog(`process(${childProcess.pid}) has started`);
     childProcess.on("error", err => daemonLog(`process(${childProcess.pid}) error: ${err.stack}`, "red"));
     childProcess.on("close", code => {
-        if(code === 0)  //进程正常退出
+        if(stopping)  //守护进程停止中，子进程排空后退出
+            process.exit(2);
+        else if(code === 0)  //进程正常退出
             daemonLog(`process(${childProcess.pid}) has exited`);
         else if(code === 2)  //进程已被杀死
             daemonLog(`process(${childProcess.pid}) has been killed!`, "bgYellow");
@@ -70,8 +73,10 @@ process.on("exit", code => {
 
 process.on("SIGTERM", () => {
     daemonLog("received kill signal", "yellow");
-    currentProcess && currentProcess.kill("SIGINT");
-    process.exit(2);
+    if(!currentProcess || currentProcess.exitCode !== null)
+        process.exit(2);
+    stopping = true;
+    currentProcess.kill("SIGTERM");  //子进程排空进行中的请求后退出
 });  //kill退出守护进程
 
 process.on("SIGINT", () => {
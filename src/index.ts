@@ -6,6 +6,8 @@ import "@/lib/initialize.ts";
 import server from "@/lib/server.ts";
 import routes from "@/api/routes/index.ts";
 import logger from "@/lib/logger.ts";
+import cluster from "@/lib/cluster.ts";
+import lifecycle from "@/lib/lifecycle.ts";
 
 const startupTime = performance.now();
 
@@ -19,7 +21,18 @@ const startupTime = performance.now();
   logger.info("Service name:", config.service.name);
 
   server.attachRoutes(routes);
-  await server.listen();
+  if (cluster.isCoordinator()) {
+    // 集群模式：主进程持有账号池与媒体任务状态，加载完成后再启动 worker，由 worker 共享端口处理请求
+    await lifecycle.initialize();
+    await server.listenCoordinator();
+    cluster.start();
+    return;
+  }
+  // 先监听端口再加载状态：加载完成前 /ready 返回 503，其他请求等待加载完成后处理
+  const initializing = lifecycle.initialize();
+  server.holdUntil(initializing);
+  await Promise.all([server.listen(), initializing]);
+  if (cluster.isWorker()) cluster.markReady();
 
   config.service.bindAddress &&
     logger.success("Service bind address:", config.service.bindAddress);
@@ -29,4 +42,8 @@ const startupTime = performance.now();
       `Service startup completed (${Math.floor(performance.now() - startupTime)}ms)`
     )
   )
-  .catch((err) => console.error(err));
+  .catch((err) => {
+    // 启动失败时退出，由守护进程或集群主进程重新拉起
+    console.error(err);
+    process.exit(1);
+  });
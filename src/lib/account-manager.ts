@@ -8,11 +8,19 @@ import { EventEmitter } from "events";
 import ResponsePolicyManager, { PolicyAction } from "./response-policy.ts";
 import ModelManager from "./model-manager.ts";
 import APIException from './exceptions/APIException.ts';
+import storage from "./storage.ts";
+import cluster from "./cluster.ts";
+import metrics from "./metrics.ts";
+import tracing from "./tracing.ts";
 
 
 const DATA_DIR = path.join(process.cwd(), "data");
-const ACCOUNTS_FILE = path.join(DATA_DIR, "accounts.json");
-const SETTINGS_FILE = path.join(DATA_DIR, "settings.json");
+// 集群模式下 worker 可调用的账号池方法，其余状态变更均经由主进程的后台路由
+const REMOTE_METHODS = ["acquireToken", "releaseToken", "reserveImageGeneration", "applyResponsePolicy", "updateAccountUsage", "saveSettings"];
+// 账号状态广播的合并间隔
+const SYNC_DELAY = 50;
+// 用量计数等高频变更的落盘合并间隔
+const SAVE_DELAY = 5000;
 
 export enum AccountStatus {
   IDLE = "idle",
@@ -39,6 +47,10 @@ export interface Account {
   apiKey?: string;
   capability?: AccountCapability;
   modelName?: string;
+  /** 上游支持 stream_options.include_usage（在流的最后返回用量） */
+  streamUsage?: boolean;
+  /** 上游流式不返回用量时，逐个解析增量内容计算补全 token（默认只从流的尾部读取用量） */
+  streamCount?: boolean;
 
   // 设备信息指纹
   deviceId?: string;
@@ -92,7 +104,17 @@ export interface Settings {
   defaultModel: string;
   enableHealthCheck?: boolean; // 新增：是否开启全局健康检查
   videoTimeout?: number; // 毫秒
-  imageGenerationDelayMs?: number; // 毫秒
+  imageGenerationDelayMs?: number; // 毫秒，参考图上传完成后等待资源稳定再发起生图
+  imageRateIntervalMs?: number; // 毫秒，同一账号两次图片生成的最小平均间隔（令牌补充周期），0 为不限速
+  imageGenerationBurst?: number; // 令牌桶容量，允许空闲账号连续发起的图片生成次数
+  imageRateScope?: "account" | "channel"; // 限速维度：按账号或按渠道共享
+  mediaImageWorkers?: number; // 异步图片任务并发执行数
+  mediaVideoWorkers?: number; // 异步视频任务并发执行数
+  mediaDownloadConnections?: number; // 媒体文件下载的全局并发连接数
+  mediaDownloadBandwidthKB?: number; // 媒体文件下载的全局带宽上限 (KB/s)，0 表示不限
+  mediaStoreQuotaMB?: number; // 本地媒体存储配额 (MB)，超出后按 LRU 淘汰，0 表示不限
+  mediaStoreMaxAgeDays?: number; // 本地媒体文件最长保留天数（按最近访问时间），0 表示不限
+  mediaWebhookSecret?: string; // 异步任务回调签名密钥，为空时首次投递自动生成
 }
 
 export type RequestType = "chat" | "image" | "video";
@@ -104,9 +126,31 @@ class AccountManager extends EventEmitter {
     cooldownTime: 10000,
     defaultModel: "doubao-lite-4k",
     videoTimeout: 180000,
-    imageGenerationDelayMs: 3000
+    imageGenerationDelayMs: 3000,
+    imageRateIntervalMs: 0,
+    imageGenerationBurst: 1,
+    imageRateScope: "account",
+    mediaImageWorkers: 4,
+    mediaVideoWorkers: 2,
+    mediaDownloadConnections: 4,
+    mediaDownloadBandwidthKB: 0,
+    mediaStoreQuotaMB: 10240,
+    mediaStoreMaxAgeDays: 0
   };
 
+  // 图片生成令牌桶 (key -> 剩余令牌与上次补充时间)，令牌可为负数表示已被预约的等待
+  private imageBuckets = new Map<string, { tokens: number; updatedAt: number }>();
+
+  private initialized: Promise<void> | null = null;
+  // 集群主进程：各 worker 当前占用的账号 token，worker 退出时回收
+  private leases = new Map<number, Set<string>>();
+  private syncTimer: NodeJS.Timeout | null = null;
+  private saveTimer: NodeJS.Timeout | null = null;
+  // 等待按行写入的账号（用量、锁定计数等高频变更）
+  private dirtyAccounts = new Set<string>();
+  // 集群 worker：主进程的排队数
+  private remoteQueueLength = 0;
+
   
   // 队列需要记录请求类型
   private queue: Array<{ 
@@ -144,10 +188,44 @@ class AccountManager extends EventEmitter {
 
   constructor() {
     super();
-    this.init();
+    if (cluster.isCoordinator()) this.serveWorkers();
+    // 账号池状态只存在于单进程或集群主进程
+    if (!cluster.isWorker()) this.registerMetrics();
+  }
+
+  /**
+   * 账号池指标：排队数、各账号占用与冷却状态（抓取时按当前状态生成）
+   */
+  private registerMetrics() {
+    new metrics.Gauge("account_pool_queue_depth", "Requests waiting for an idle account", gauge => gauge.set({}, this.queue.length));
+    new metrics.Gauge("account_in_flight", "Whether the account is serving a request", gauge => {
+      for (const account of this.accounts)
+        gauge.set({ account: account.id, channel: account.name }, account.status === AccountStatus.BUSY ? 1 : 0);
+    });
+    new metrics.Gauge("account_cooldown", "Whether the account is cooling down (including policy cooldowns)", gauge => {
+      const now = Date.now();
+      for (const account of this.accounts) {
+        const cooling = account.status === AccountStatus.COOLDOWN || (account.cooldownUntil || 0) > now;
+        gauge.set({ account: account.id, channel: account.name }, cooling ? 1 : 0);
+      }
+    });
+  }
+
+  /**
+   * 加载账号与设置并启动定时任务，由启动阶段调用（重复调用只加载一次）
+   */
+  public init() {
+    if (!this.initialized) this.initialized = this.load();
+    return this.initialized;
   }
 
-  private async init() {
+  private async load() {
+    if (cluster.isWorker()) {
+      // worker 只保留主进程广播的只读副本，账号的获取与释放均由主进程协调
+      cluster.subscribe("accounts", state => this.applyState(state));
+      this.applyState(await cluster.call("accounts", "getState"));
+      return;
+    }
     await fs.ensureDir(DATA_DIR);
     await this.loadAccounts();
     await this.loadSettings();
@@ -174,10 +252,61 @@ class AccountManager extends EventEmitter {
     logger.info(`[AccountManager] 系统初始化完成，共加载 ${this.accounts.length} 个账号。`);
   }
 
+  /**
+   * 集群主进程：处理 worker 的账号池调用，并回收已退出 worker 占用的账号
+   */
+  private serveWorkers() {
+    cluster.handle("accounts", async (method, args, workerId) => {
+      await this.init();
+      if (method === "getState") return this.getState();
+      if (!REMOTE_METHODS.includes(method)) throw new Error(`Method ${method} is not callable from workers`);
+      const result = await (this as any)[method](...args);
+      if (method === "acquireToken") {
+        // 排队期间 worker 已退出，直接归还
+        if (!cluster.isWorkerAlive(workerId)) {
+          this.releaseToken(result.token);
+          return null;
+        }
+        if (!this.leases.has(workerId)) this.leases.set(workerId, new Set());
+        this.leases.get(workerId)!.add(result.token);
+      }
+      if (method === "releaseToken") this.leases.get(workerId)?.delete(args[0]);
+      return result;
+    });
+    cluster.onWorkerExit(workerId => {
+      const tokens = this.leases.get(workerId);
+      this.leases.delete(workerId);
+      if (!tokens || tokens.size === 0) return;
+      logger.warn(`[AccountManager] worker 已退出，回收其占用的 ${tokens.size} 个账号`);
+      tokens.forEach(token => this.releaseToken(token));
+    });
+  }
+
+  private getState() {
+    return { accounts: this.accounts, settings: this.settings, queue: this.queue.length };
+  }
+
+  private applyState(state: any) {
+    this.accounts = state.accounts;
+    this.settings = state.settings;
+    this.remoteQueueLength = state.queue;
+  }
+
+  /**
+   * 集群主进程：合并短时间内的状态变化，向 worker 广播账号与设置副本
+   */
+  private publish() {
+    if (!cluster.isCoordinator() || this.syncTimer) return;
+    this.syncTimer = setTimeout(() => {
+      this.syncTimer = null;
+      cluster.broadcast("accounts", this.getState());
+    }, SYNC_DELAY);
+  }
+
   private async loadAccounts() {
     try {
-      if (await fs.pathExists(ACCOUNTS_FILE)) {
-        const stored = await fs.readJson(ACCOUNTS_FILE);
+      const stored = await (await storage.getStorage()).loadCollection("accounts");
+      if (stored) {
         this.accounts = stored.map((s: any) => ({
             ...s,
             status: AccountStatus.IDLE,
@@ -209,13 +338,54 @@ class AccountManager extends EventEmitter {
     }
   }
 
-  private async saveAccounts() {
+  /**
+   * 请求路径上的高频变更（锁定计数、用量统计）立即广播，合并后延迟写入存储
+   */
+  private scheduleSave(account: Account) {
+    this.publish();
+    this.dirtyAccounts.add(account.id);
+    if (this.saveTimer) return;
+    this.saveTimer = setTimeout(() => {
+      this.saveTimer = null;
+      this.saveDirtyAccounts();
+    }, SAVE_DELAY);
+    this.saveTimer.unref();
+  }
+
+  /**
+   * 写入尚未落盘的账号变更（优雅停止时调用）
+   */
+  public async flush() {
+    if (!this.saveTimer) return;
+    clearTimeout(this.saveTimer);
+    this.saveTimer = null;
+    await this.saveDirtyAccounts();
+  }
+
+  /**
+   * 只写入发生变更的账号行，不序列化与比对整个账号集合
+   */
+  private async saveDirtyAccounts() {
+    const rows = [...this.dirtyAccounts].map(id => {
+      const account = this.accounts.find(a => a.id === id);
+      return [id, account ? this.toStoredAccount(account) : null] as [string, any];
+    });
+    this.dirtyAccounts.clear();
+    if (rows.length === 0) return;
     try {
-      // 仅保存必要字段，清理旧字段
-      const toSave = this.accounts.map(a => ({
+      await (await storage.getStorage()).putRows("accounts", rows);
+    } catch (e) {
+      rows.forEach(([id]) => this.dirtyAccounts.add(id));
+      logger.error("保存账号文件失败:", e);
+    }
+  }
+
+  // 仅保存必要字段，清理旧字段
+  private toStoredAccount(a: Account) {
+    return {
         id: a.id, token: a.token, name: a.name, enabled: a.enabled,
         type: a.type, weight: a.weight,
-        baseUrl: a.baseUrl, apiKey: a.apiKey, capability: a.capability, modelName: a.modelName,
+        baseUrl: a.baseUrl, apiKey: a.apiKey, capability: a.capability, modelName: a.modelName, streamUsage: a.streamUsage, streamCount: a.streamCount,
         models: a.models, modelMapping: a.modelMapping, mergePolicy: a.mergePolicy || "merge",
         remark: a.remark,
         deviceId: a.deviceId, webId: a.webId, userId: a.userId,
@@ -226,9 +396,16 @@ class AccountManager extends EventEmitter {
         totalCompletionTokens: a.totalCompletionTokens,
         cooldownUntil: a.cooldownUntil,
         cooldownReason: a.cooldownReason
-      }));
+    };
+  }
 
-      await fs.writeJson(ACCOUNTS_FILE, toSave, { spaces: 2 });
+  private async saveAccounts() {
+    this.publish();
+    // 整体保存已包含待写入的行
+    this.dirtyAccounts.clear();
+    try {
+      const toSave = this.accounts.map(a => this.toStoredAccount(a));
+      await (await storage.getStorage()).saveCollection("accounts", toSave, a => a.id);
     } catch (e) {
       logger.error("保存账号文件失败:", e);
     }
@@ -236,8 +413,8 @@ class AccountManager extends EventEmitter {
 
   private async loadSettings() {
     try {
-      if (await fs.pathExists(SETTINGS_FILE)) {
-        const loaded = await fs.readJson(SETTINGS_FILE);
+      const loaded = await (await storage.getStorage()).loadDocument("settings");
+      if (loaded) {
         // 兼容旧的或由于误解产生的 videoPollingTimeout 字段
         if (loaded.videoPollingTimeout !== undefined && loaded.videoTimeout === undefined) {
              loaded.videoTimeout = loaded.videoPollingTimeout;
@@ -250,9 +427,11 @@ class AccountManager extends EventEmitter {
   }
 
   public async saveSettings(newSettings: Partial<Settings>) {
+    if (cluster.isWorker()) return cluster.call("accounts", "saveSettings", [newSettings]);
     this.settings = { ...this.settings, ...newSettings };
     try {
-      await fs.writeJson(SETTINGS_FILE, this.settings, { spaces: 2 });
+      this.publish();
+      await (await storage.getStorage()).saveDocument("settings", this.settings);
     } catch (e) {
       logger.error("保存设置失败:", e);
     }
@@ -278,6 +457,77 @@ class AccountManager extends EventEmitter {
           }, 0);
   }
 
+  /**
+   * 统计当前可承接某类请求的账号数量（启用、未冷却、能力匹配且仍有额度），用于批量任务调度的并发上限
+   */
+  public getCapableAccountCount(type: RequestType = 'chat', modelId?: string): number {
+      const now = Date.now();
+      return this.accounts.filter(a => {
+          if (!a.enabled) return false;
+          if (a.cooldownUntil && a.cooldownUntil > now) return false;
+          if (modelId && a.models && a.models.trim().length > 0) {
+              const supportedModels = a.models.split(/[,，]/).map(m => m.trim());
+              if (!supportedModels.includes(modelId)) return false;
+          }
+          if (a.type === 'openai' && a.capability && a.capability !== type) return false;
+          if (type === 'chat') return a.limitChat === -1 || a.usageChat < a.limitChat;
+          if (type === 'image') return a.usageImage < a.limitImage;
+          if (type === 'video') return a.usageVideo < a.limitVideo;
+          return true;
+      }).length;
+  }
+
+  private getImageGenerationInterval(): number {
+    const interval = Number(this.settings.imageRateIntervalMs);
+    return Number.isFinite(interval) ? Math.max(0, interval) : 0;
+  }
+
+  private getImageBucketKey(account: Account | string) {
+    if (typeof account === 'string') return `token:${account}`;
+    return this.settings.imageRateScope === 'channel' ? `channel:${account.name}` : `account:${account.id}`;
+  }
+
+  private refillImageBucket(key: string) {
+    const now = Date.now();
+    const interval = this.getImageGenerationInterval();
+    const capacity = Math.max(1, Number(this.settings.imageGenerationBurst) || 1);
+    let bucket = this.imageBuckets.get(key);
+    if (!bucket) {
+      // 清理已回满的令牌桶，避免直连 Token 无限增长
+      if (this.imageBuckets.size >= 1000) {
+        for (const [k, b] of this.imageBuckets) {
+          if (b.tokens + (now - b.updatedAt) / (interval || 1) >= capacity) this.imageBuckets.delete(k);
+        }
+      }
+      bucket = { tokens: capacity, updatedAt: now };
+      this.imageBuckets.set(key, bucket);
+      return bucket;
+    }
+    bucket.tokens = interval > 0 ? Math.min(capacity, bucket.tokens + (now - bucket.updatedAt) / interval) : capacity;
+    bucket.updatedAt = now;
+    return bucket;
+  }
+
+  /**
+   * 账号当前是否有可用的图片生成令牌
+   */
+  public hasImageGenerationToken(account: Account | string): boolean {
+    if (this.getImageGenerationInterval() <= 0) return true;
+    return this.refillImageBucket(this.getImageBucketKey(account)).tokens >= 1;
+  }
+
+  /**
+   * 预占一次图片生成令牌，返回需要等待的毫秒数（令牌充足时为 0）
+   */
+  public async reserveImageGeneration(account: Account | string): Promise<number> {
+    if (cluster.isWorker()) return cluster.call("accounts", "reserveImageGeneration", [account]);
+    const interval = this.getImageGenerationInterval();
+    if (interval <= 0) return 0;
+    const bucket = this.refillImageBucket(this.getImageBucketKey(account));
+    bucket.tokens -= 1;
+    return bucket.tokens >= 0 ? 0 : Math.ceil(-bucket.tokens * interval);
+  }
+
   private tryGetAvailableAccount(type: RequestType, modelId?: string): Account | null {
     const total = this.accounts.length;
     if (total === 0) return null;
@@ -319,12 +569,19 @@ class AccountManager extends EventEmitter {
 
     if (availableAccounts.length === 0) return null;
 
+    // 图片请求优先选择仍有生成令牌的账号，全部耗尽时再回退到需要等待的账号
+    let candidates = availableAccounts;
+    if (type === 'image') {
+        const ready = availableAccounts.filter(a => this.hasImageGenerationToken(a));
+        if (ready.length > 0) candidates = ready;
+    }
+
     // 第二步：按权重降序排序
-    availableAccounts.sort((a, b) => (b.weight || 1) - (a.weight || 1));
+    candidates.sort((a, b) => (b.weight || 1) - (a.weight || 1));
 
     // 第三步：取出所有最高权重的账号
-    const highestWeight = availableAccounts[0].weight || 1;
-    const topWeightAccounts = availableAccounts.filter(a => (a.weight || 1) === highestWeight);
+    const highestWeight = candidates[0].weight || 1;
+    const topWeightAccounts = candidates.filter(a => (a.weight || 1) === highestWeight);
 
     // 第四步：在最高权重的账号池中进行轮询，以分散请求压力
     // 这里借用并更新 lastRoundRobinIndex 实现简单的伪轮询选择
@@ -334,7 +591,10 @@ class AccountManager extends EventEmitter {
 
 
   public acquireToken(type: RequestType = 'chat', modelId?: string): Promise<Account> {
-    return new Promise((resolve, reject) => {
+    if (cluster.isWorker()) return tracing.span("pool", () => cluster.call("accounts", "acquireToken", [type, modelId]), { type });
+    const endSpan = tracing.startSpan("pool", { type });
+    const observeWait = metrics.poolWait.startTimer({ type });
+    return new Promise<Account>((resolve, reject) => {
       // 1. 检查是否有任何账号支持该请求
       const existsCapable = this.accounts.some(a => {
           if (!a.enabled) return false;
@@ -366,6 +626,13 @@ class AccountManager extends EventEmitter {
         this.queue.push({ type, modelId, resolve: (account: Account) => resolve(account), reject });
         logger.info(`[AccountManager] 暂无空闲账号，请求 [${type}:${modelId || 'any'}] 进入队列。当前排队: ${this.queue.length}`);
       }
+    }).then(account => {
+      observeWait();
+      endSpan({ account: account.name });
+      return account;
+    }, err => {
+      endSpan({ error: err?.message || String(err) });
+      throw err;
     });
   }
 
@@ -378,19 +645,22 @@ class AccountManager extends EventEmitter {
     if (type === 'image') account.usageImage++;
     if (type === 'video') account.usageVideo++;
     
-    this.saveAccounts(); 
+    this.scheduleSave(account);
     logger.info(`[AccountManager] 账号 [${account.name}] 锁定 (Type: ${type})。`);
   }
 
   public releaseToken(token: string) {
+    if (cluster.isWorker()) return cluster.notify("accounts", "releaseToken", [token]);
     const account = this.accounts.find(a => a.token === token);
     if (!account) return;
 
     account.status = AccountStatus.COOLDOWN;
+    this.publish();
     logger.info(`[AccountManager] 账号 [${account.name}] 任务完成，进入 ${this.settings.cooldownTime/1000}s 冷却。`);
 
     setTimeout(() => {
       account.status = AccountStatus.IDLE;
+      this.publish();
       logger.info(`[AccountManager] 账号 [${account.name}] 冷却结束，恢复空闲。`);
       this.processQueue();
     }, this.settings.cooldownTime);
@@ -414,6 +684,10 @@ class AccountManager extends EventEmitter {
     }
   }
 
+  public getAccountById(id: string) {
+      return this.accounts.find(a => a.id === id);
+  }
+
   public getAccountsData() {
       // 计算剩余量辅助前端显示
       return this.accounts.map(a => ({
@@ -444,7 +718,7 @@ class AccountManager extends EventEmitter {
               busy: this.accounts.filter(a => a.status === AccountStatus.BUSY).length,
               cooldown: this.accounts.filter(a => a.status === AccountStatus.COOLDOWN).length,
           },
-          queue: this.queue.length,
+          queue: cluster.isWorker() ? this.remoteQueueLength : this.queue.length,
           totalRemainingChat: this.getTotalRemainingUsage('chat'),
           totalRemainingImage: this.getTotalRemainingUsage('image'),
           totalRemainingVideo: this.getTotalRemainingUsage('video'),
@@ -510,6 +784,8 @@ class AccountManager extends EventEmitter {
           apiKey: extra.apiKey || "",
           capability: extra.capability || undefined,
           modelName: extra.modelName || "",
+          streamUsage: !!extra.streamUsage,
+          streamCount: !!extra.streamCount,
           models: extra.models || "",
           modelMapping: extra.modelMapping || "",
           mergePolicy: extra.mergePolicy || "merge",
@@ -619,7 +895,13 @@ class AccountManager extends EventEmitter {
 
     const policy = ResponsePolicyManager.getPolicyForStatus(statusCode, account.type);
     if (!policy) return null;
+    if (cluster.isWorker()) {
+      // 动作由本地副本判定，状态变更交给主进程执行
+      cluster.notify("accounts", "applyResponsePolicy", [id, statusCode]);
+      return policy.action;
+    }
 
+    metrics.accountErrors.inc({ account: account.id, channel: account.name, status: statusCode });
     logger.warn(`[AccountManager] 触发响应策略: 账号 [${account.name}] 遇到 [${statusCode}], 动作: ${policy.action} (${policy.description})`);
 
     switch (policy.action) {
@@ -646,6 +928,7 @@ class AccountManager extends EventEmitter {
    * 更新账号用量和 Token 统计
    */
   public async updateAccountUsage(id: string, type: AccountCapability, promptTokens: number = 0, completionTokens: number = 0) {
+    if (cluster.isWorker()) return cluster.call("accounts", "updateAccountUsage", [id, type, promptTokens, completionTokens]);
     const account = this.accounts.find(a => a.id === id);
     if (!account) return;
 
@@ -661,7 +944,7 @@ class AccountManager extends EventEmitter {
     account.totalPromptTokens += promptTokens;
     account.totalCompletionTokens += completionTokens;
 
-    await this.saveAccounts();
+    this.scheduleSave(account);
   }
 
   /**
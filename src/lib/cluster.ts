@@ -0,0 +1,347 @@
+import os from "os";
+import path from "path";
+import http from "http";
+import nodeCluster from "cluster";
+import fs from "fs-extra";
+
+import config from "@/lib/config.ts";
+import logger from "@/lib/logger.ts";
+import APIException from "@/lib/exceptions/APIException.ts";
+
+// worker 崩溃后的重启延迟
+const RESPAWN_DELAY = 1000;
+// 由主进程处理的路由：后台管理、异步媒体任务与本地媒体文件（状态只存在于主进程）
+const COORDINATOR_PATHS = [
+    /^\/admin(\/|$)/,
+    /^\/v1\/generations\//,
+    /^\/v1\/images\/generations\/(async|batch)(\/|$)/,
+    /^\/v1\/video\/generations\/async$/,
+    /^\/v1\/media\//,
+    /^\/metrics$/
+];
+// 主进程调用 worker 服务的超时
+const WORKER_CALL_TIMEOUT = 5000;
+
+type RemoteHandler = (method: string, args: any[], workerId: number) => any;
+
+interface ClusterMessage {
+    cluster: "call" | "reply" | "broadcast" | "ready";
+    id?: number;
+    service?: string;
+    method?: string;
+    args?: any[];
+    result?: any;
+    error?: { message: string; code?: number; status?: number };
+    channel?: string;
+    payload?: any;
+}
+
+const handlers = new Map<string, RemoteHandler>();
+const subscribers = new Map<string, ((payload: any) => void)[]>();
+const exitListeners: ((workerId: number) => void)[] = [];
+const pendingCalls = new Map<number, { resolve: (value: any) => void; reject: (err: any) => void }>();
+let callId = 0;
+let shuttingDown = false;
+// 正在排空、退出后不需要重启的 worker
+const retiring = new Set<number>();
+
+/**
+ * worker 进程数：0 表示按 CPU 核数，1 表示不启用集群
+ */
+function getWorkerCount() {
+    const workers = Number(config.system.workers);
+    if (workers === 0) return typeof os.availableParallelism === "function" ? os.availableParallelism() : os.cpus().length;
+    return Number.isFinite(workers) && workers > 1 ? Math.floor(workers) : 1;
+}
+
+/**
+ * 主进程：worker 是否仍在运行
+ */
+function isWorkerAlive(workerId: number) {
+    return !!nodeCluster.workers?.[workerId];
+}
+
+function isWorker() {
+    return nodeCluster.isWorker;
+}
+
+/**
+ * 是否为集群主进程（已启用集群且为主进程）
+ */
+function isCoordinator() {
+    return nodeCluster.isPrimary && getWorkerCount() > 1;
+}
+
+function getSocketPath(pid = process.pid) {
+    const name = `doubao-free-api-${pid}`;
+    return process.platform === "win32" ? `\\\\.\\pipe\\${name}` : path.join(os.tmpdir(), `${name}.sock`);
+}
+
+/**
+ * 路径（不含 urlPrefix）是否需要由主进程处理
+ */
+function isCoordinatorPath(urlPath: string) {
+    const prefix = config.service.urlPrefix || "";
+    if (prefix && urlPath.startsWith(prefix)) urlPath = urlPath.slice(prefix.length) || "/";
+    return COORDINATOR_PATHS.some(pattern => pattern.test(urlPath));
+}
+
+/**
+ * worker：将请求原样转发到主进程的内部监听地址，响应以流的方式回传（支持 SSE 与 Range）
+ */
+function proxy(ctx: any) {
+    return new Promise<void>(resolve => {
+        const headers = { ...ctx.req.headers };
+        if (!headers["x-real-ip"] && !headers["x-forwarded-for"]) headers["x-forwarded-for"] = ctx.ip;
+        ctx.respond = false;
+        const upstream = http.request({
+            socketPath: getSocketPath(process.ppid),
+            method: ctx.method,
+            path: ctx.originalUrl,
+            headers
+        }, response => {
+            ctx.res.writeHead(response.statusCode || 502, response.headers);
+            response.pipe(ctx.res);
+            response.once("end", () => resolve());
+            response.once("error", () => resolve());
+        });
+        // 客户端断开时中止转发，主进程随之结束 SSE 等长连接
+        ctx.res.once("close", () => {
+            upstream.destroy();
+            resolve();
+        });
+        upstream.once("error", err => {
+            logger.error(`[Cluster] proxy ${ctx.method} ${ctx.originalUrl} failed: ${err.message}`);
+            if (!ctx.res.headersSent) ctx.res.writeHead(502, { "Content-Type": "text/plain; charset=utf-8" });
+            ctx.res.end("Bad Gateway");
+            resolve();
+        });
+        ctx.req.pipe(upstream);
+    });
+}
+
+function sendToWorker(worker: any, message: ClusterMessage) {
+    if (worker.isConnected()) worker.send(message);
+}
+
+/**
+ * 执行对端发起的调用并回复结果（主进程处理 worker 调用，worker 处理主进程调用）
+ */
+async function handleCall(message: ClusterMessage, workerId: number, reply: (message: ClusterMessage) => void) {
+    const handler = handlers.get(message.service!);
+    try {
+        if (!handler) throw new Error(`Unknown cluster service: ${message.service}`);
+        const result = await handler(message.method!, message.args || [], workerId);
+        if (message.id) reply({ cluster: "reply", id: message.id, result });
+    } catch (err: any) {
+        if (!message.id) return logger.error(`[Cluster] ${message.service}.${message.method} failed: ${err?.message || err}`);
+        reply({
+            cluster: "reply",
+            id: message.id,
+            error: { message: err?.message || String(err), code: err?.errcode, status: err?.httpStatusCode }
+        });
+    }
+}
+
+function handleReply(message: ClusterMessage) {
+    const pending = pendingCalls.get(message.id!);
+    if (!pending) return;
+    pendingCalls.delete(message.id!);
+    if (!message.error) return pending.resolve(message.result);
+    const { code, status } = message.error;
+    // 还原业务异常，保持与单进程模式相同的错误响应
+    const err = Number.isFinite(code) ? new APIException([code!, message.error.message]) : new Error(message.error.message);
+    if (status && err instanceof APIException) err.setHTTPStatusCode(status);
+    pending.reject(err);
+}
+
+function fork() {
+    const worker = nodeCluster.fork();
+    worker.on("message", (message: ClusterMessage) => {
+        if (message?.cluster === "call") handleCall(message, worker.id, reply => sendToWorker(worker, reply));
+        else if (message?.cluster === "reply") handleReply(message);
+    });
+    return worker;
+}
+
+/**
+ * 主进程：启动 worker 并负责崩溃重启，worker 共享同一端口
+ */
+function start() {
+    const count = getWorkerCount();
+    nodeCluster.on("exit", (worker, code, signal) => {
+        exitListeners.forEach(listener => listener(worker.id));
+        if (shuttingDown || retiring.delete(worker.id)) return;
+        logger.warn(`[Cluster] worker(${worker.process.pid}) exited (${signal || code}), respawning...`);
+        setTimeout(() => !shuttingDown && fork(), RESPAWN_DELAY);
+    });
+    for (let i = 0; i < count; i++) fork();
+    logger.success(`[Cluster] started ${count} workers`);
+}
+
+process.once("exit", () => {
+    shuttingDown = true;
+    if (nodeCluster.isPrimary) fs.removeSync(getSocketPath());
+});
+
+/**
+ * 主进程：通知 worker 排空后退出，超时未退出的强制结束
+ */
+function retire(workers: any[], timeout: number) {
+    return Promise.all(workers.map(worker => new Promise<void>(resolve => {
+        if (worker.isDead()) return resolve();
+        retiring.add(worker.id);
+        const timer = setTimeout(() => worker.process.kill("SIGKILL"), timeout + 5000);
+        worker.once("exit", () => {
+            clearTimeout(timer);
+            resolve();
+        });
+        sendToWorker(worker, { cluster: "broadcast", channel: "drain", payload: timeout });
+    })));
+}
+
+/**
+ * 主进程：滚动重启，新一代 worker 全部就绪后再排空旧 worker，监听端口始终由主进程持有
+ */
+async function reload(timeout: number) {
+    const previous = Object.values(nodeCluster.workers || {}).filter(Boolean);
+    const count = getWorkerCount();
+    logger.info(`[Cluster] reloading ${count} workers...`);
+    await Promise.all(Array.from({ length: count }, () => new Promise<void>((resolve, reject) => {
+        const worker = fork();
+        const onExit = () => reject(new Error(`worker(${worker.process.pid}) exited during startup`));
+        worker.once("exit", onExit);
+        // worker 先监听再加载状态，状态加载完成（ready）后才替换旧 worker
+        const onMessage = (message: ClusterMessage) => {
+            if (message?.cluster !== "ready") return;
+            worker.off("message", onMessage);
+            worker.off("exit", onExit);
+            resolve();
+        };
+        worker.on("message", onMessage);
+    })));
+    await retire(previous, timeout);
+    logger.success(`[Cluster] reload completed, ${count} workers running`);
+}
+
+/**
+ * 主进程：停止全部 worker（排空后退出，不再重启）
+ */
+function stopWorkers(timeout: number) {
+    shuttingDown = true;
+    return retire(Object.values(nodeCluster.workers || {}).filter(Boolean), timeout);
+}
+
+/**
+ * 注册供对端调用的服务（主进程注册供 worker 调用，worker 注册供主进程调用）
+ */
+function handle(service: string, handler: RemoteHandler) {
+    handlers.set(service, handler);
+}
+
+/**
+ * 主进程：worker 退出时回调（用于回收其占用的账号）
+ */
+function onWorkerExit(listener: (workerId: number) => void) {
+    exitListeners.push(listener);
+}
+
+/**
+ * 主进程：向所有 worker 广播
+ */
+function broadcast(channel: string, payload?: any) {
+    if (!isCoordinator()) return;
+    for (const worker of Object.values(nodeCluster.workers || {}))
+        worker && sendToWorker(worker, { cluster: "broadcast", channel, payload });
+}
+
+/**
+ * 主进程：调用所有运行中 worker 的服务，超时或失败的 worker 不计入结果
+ */
+function callWorkers<T = any>(service: string, method: string, args: any[] = []): Promise<{ workerId: number; result: T }[]> {
+    const workers = Object.values(nodeCluster.workers || {}).filter(worker => worker && worker.isConnected() && !retiring.has(worker.id));
+    return Promise.all(workers.map(worker => new Promise<{ workerId: number; result: T } | null>(resolve => {
+        const id = ++callId;
+        const timer = setTimeout(() => {
+            pendingCalls.delete(id);
+            resolve(null);
+        }, WORKER_CALL_TIMEOUT);
+        pendingCalls.set(id, {
+            resolve: result => {
+                clearTimeout(timer);
+                resolve({ workerId: worker!.id, result });
+            },
+            reject: err => {
+                clearTimeout(timer);
+                logger.warn(`[Cluster] worker(${worker!.process.pid}) ${service}.${method} failed: ${err?.message || err}`);
+                resolve(null);
+            }
+        });
+        sendToWorker(worker, { cluster: "call", id, service, method, args });
+    }))).then(results => results.filter(Boolean) as { workerId: number; result: T }[]);
+}
+
+/**
+ * worker：订阅主进程广播
+ */
+function subscribe(channel: string, listener: (payload: any) => void) {
+    if (!subscribers.has(channel)) subscribers.set(channel, []);
+    subscribers.get(channel)!.push(listener);
+}
+
+/**
+ * worker：调用主进程服务并等待结果
+ */
+function call<T = any>(service: string, method: string, args: any[] = []): Promise<T> {
+    return new Promise((resolve, reject) => {
+        const id = ++callId;
+        pendingCalls.set(id, { resolve, reject });
+        process.send!({ cluster: "call", id, service, method, args });
+    });
+}
+
+/**
+ * worker：通知主进程状态已加载完成（滚动重启据此替换旧 worker）
+ */
+function markReady() {
+    process.send!({ cluster: "ready" });
+}
+
+/**
+ * worker：通知主进程，不等待结果
+ */
+function notify(service: string, method: string, args: any[] = []) {
+    process.send!({ cluster: "call", service, method, args });
+}
+
+if (nodeCluster.isWorker) {
+    process.on("message", (message: ClusterMessage) => {
+        if (message?.cluster === "reply") handleReply(message);
+        else if (message?.cluster === "call") handleCall(message, nodeCluster.worker!.id, reply => process.send!(reply));
+        else if (message?.cluster === "broadcast")
+            (subscribers.get(message.channel!) || []).forEach(listener => listener(message.payload));
+    });
+    // 主进程退出后 worker 随之退出
+    process.on("disconnect", () => process.exit(0));
+}
+
+export default {
+    getWorkerCount,
+    isWorker,
+    isWorkerAlive,
+    isCoordinator,
+    getSocketPath,
+    isCoordinatorPath,
+    proxy,
+    start,
+    reload,
+    stopWorkers,
+    markReady,
+    handle,
+    onWorkerExit,
+    broadcast,
+    callWorkers,
+    subscribe,
+    call,
+    notify
+};
@@ -21,8 +21,12 @@ export class SystemConfig {
     logDir: string;
     /** 日志写入间隔（毫秒） */
     logWriteInterval: number;
-    /** 日志文件有效期（毫秒） */
+    /** 日志文件有效期（毫秒），超过后删除 */
     logFileExpires: number;
+    /** 单个日志文件大小上限（字节），超过后轮转，0 为不限 */
+    logMaxFileSize: number;
+    /** 日志写入缓存的最大行数，写入跟不上时丢弃最早的日志 */
+    logBufferLines: number;
     /** 公共目录路径 */
     publicDir: string;
     /** 临时文件有效期（毫秒） */
@@ -31,14 +35,44 @@ export class SystemConfig {
     requestBody: any;
     /** 是否调试模式 */
     debug: boolean;
+    /** 状态存储后端：json 或 sqlite */
+    storage: string;
+    /** SQLite 数据库文件路径 */
+    storageFile: string;
+    /** SQLite 不可用时是否回退到 JSON 文件（默认终止启动） */
+    storageFallback: boolean;
+    /** 集群 worker 进程数（0 为 CPU 核数，1 为单进程） */
+    workers: number;
+    /** 优雅停止/重启时等待进行中请求结束的最长时间（毫秒） */
+    drainTimeout: number;
+    /** 上游请求记录模式：off、errors（只记录失败）、sampled（采样，失败总是记录） */
+    upstreamLog: string;
+    /** 上游请求记录采样率（0-1），sampled 模式下生效 */
+    upstreamLogSampleRate: number;
+    /** 上游请求记录文件大小上限（字节），超过后轮转 */
+    upstreamLogMaxSize: number;
+    /** 慢请求追踪阈值（毫秒），超过后写入追踪文件，0 为关闭 */
+    traceSlowThreshold: number;
+    /** 慢请求追踪采样率（0-1） */
+    traceSampleRate: number;
+    /** 分词词表路径（tiktoken 格式），为空时按字符类别估算 token 数 */
+    tokenizerVocab: string;
+    /** 允许任务回调访问内网地址的主机名 */
+    callbackAllowedHosts: string[];
+    /** 已结束异步任务的保留时长（毫秒） */
+    mediaTaskRetention: number;
+    /** 最多保留的已结束异步任务数，0 为不限 */
+    mediaTaskMaxFinished: number;
 
     constructor(options?: any) {
-        const { requestLog, tmpDir, logDir, logWriteInterval, logFileExpires, publicDir, tmpFileExpires, requestBody, debug } = options || {};
+        const { requestLog, tmpDir, logDir, logWriteInterval, logFileExpires, logMaxFileSize, logBufferLines, publicDir, tmpFileExpires, requestBody, debug, storage, storageFile, storageFallback, workers, drainTimeout, upstreamLog, upstreamLogSampleRate, upstreamLogMaxSize, traceSlowThreshold, traceSampleRate, tokenizerVocab, callbackAllowedHosts, mediaTaskRetention, mediaTaskMaxFinished } = options || {};
         this.requestLog = _.defaultTo(requestLog, false);
         this.tmpDir = _.defaultTo(tmpDir, './tmp');
         this.logDir = _.defaultTo(logDir, './logs');
         this.logWriteInterval = _.defaultTo(logWriteInterval, 200);
         this.logFileExpires = _.defaultTo(logFileExpires, 2626560000);
+        this.logMaxFileSize = _.defaultTo(logMaxFileSize, 52428800);
+        this.logBufferLines = _.defaultTo(logBufferLines, 10000);
         this.publicDir = _.defaultTo(publicDir, './public');
         this.tmpFileExpires = _.defaultTo(tmpFileExpires, 86400000);
         this.requestBody = Object.assign(requestBody || {}, {
@@ -55,6 +89,20 @@ export class SystemConfig {
             parsedMethods: ['POST', 'PUT', 'PATCH']
         });
         this.debug = _.defaultTo(debug, true);
+        this.storage = _.defaultTo(storage, 'json');
+        this.storageFile = _.defaultTo(storageFile, './data/store.db');
+        this.storageFallback = _.defaultTo(storageFallback, false);
+        this.workers = _.defaultTo(workers, 1);
+        this.drainTimeout = _.defaultTo(drainTimeout, 30000);
+        this.upstreamLog = _.defaultTo(upstreamLog, 'errors');
+        this.upstreamLogSampleRate = _.defaultTo(upstreamLogSampleRate, 0.01);
+        this.upstreamLogMaxSize = _.defaultTo(upstreamLogMaxSize, 104857600);
+        this.traceSlowThreshold = _.defaultTo(traceSlowThreshold, 10000);
+        this.traceSampleRate = _.defaultTo(traceSampleRate, 1);
+        this.tokenizerVocab = _.defaultTo(tokenizerVocab, 'configs/tokenizer/cl100k_base.tiktoken');
+        this.callbackAllowedHosts = _.defaultTo(callbackAllowedHosts, []);
+        this.mediaTaskRetention = _.defaultTo(mediaTaskRetention, 604800000);
+        this.mediaTaskMaxFinished = _.defaultTo(mediaTaskMaxFinished, 10000);
     }
 
     get rootDirPath() {
@@ -73,6 +121,10 @@ export class SystemConfig {
         return path.resolve(this.publicDir);
     }
 
+    get storageFilePath() {
+        return path.resolve(this.storageFile);
+    }
+
     static load() {
         if (!fs.pathExistsSync(CONFIG_PATH)) return new SystemConfig();
         const data = yaml.parse(fs.readFileSync(CONFIG_PATH).toString());
@@ -1,24 +1,112 @@
-import fs from 'fs';
 import path from 'path';
-import util from '@/lib/util.ts';
+import fs from 'fs-extra';
+import _ from 'lodash';
+import { AxiosRequestConfig } from 'axios';
 
-const LOG_FILE_PATH = path.join(process.cwd(), 'request_debug.jsonl');
+import config from '@/lib/config.ts';
+import { summarizeForLog } from '@/lib/logger.ts';
 
-export function logRequest(method: string, url: string, params: any, headers: any, data: any) {
-    const logEntry = {
+// 上游请求追踪文件名（位于日志目录下），超过大小上限后轮转为 .1 并覆盖旧的轮转文件
+const LOG_FILE_NAME = 'upstream.jsonl';
+// 批量写入间隔
+const FLUSH_INTERVAL = 1000;
+// 待写入记录上限，超出后丢弃并计数
+const MAX_PENDING = 1000;
+
+let pending: string[] = [];
+let dropped = 0;
+let writing: Promise<any> = Promise.resolve();
+let timer: NodeJS.Timeout | null = null;
+
+function getFilePath(rotated = false) {
+    return path.join(config.system.logDirPath, rotated ? `${LOG_FILE_NAME}.1` : LOG_FILE_NAME);
+}
+
+/**
+ * 是否为失败的上游响应：HTTP 错误或业务错误码非 0（流式响应只看状态码）
+ */
+function isFailure(response: any) {
+    if (!response) return true;
+    if (response.status >= 400) return true;
+    const code = response.data?.code;
+    return _.isFinite(code) && code !== 0;
+}
+
+async function write() {
+    if (pending.length === 0 && dropped === 0) return;
+    const lines = pending;
+    pending = [];
+    if (dropped > 0) {
+        lines.push(JSON.stringify({ timestamp: new Date().toISOString(), dropped }) + '\n');
+        dropped = 0;
+    }
+    const content = lines.join('');
+    const file = getFilePath();
+    await fs.ensureDir(path.dirname(file));
+    const stat = await fs.stat(file).catch(() => null);
+    const maxSize = config.system.upstreamLogMaxSize;
+    if (stat && maxSize > 0 && stat.size + Buffer.byteLength(content) > maxSize)
+        await fs.move(file, getFilePath(true), { overwrite: true });
+    await fs.appendFile(file, content);
+}
+
+function scheduleFlush() {
+    if (timer) return;
+    timer = setTimeout(() => {
+        timer = null;
+        writing = writing.then(write).catch(err => console.error('Failed to write upstream log:', err));
+    }, FLUSH_INTERVAL);
+    timer.unref();
+}
+
+function enqueue(requestConfig: AxiosRequestConfig, outcome: Record<string, any>) {
+    if (pending.length >= MAX_PENDING) {
+        dropped++;
+        return;
+    }
+    // 截断与脱敏后再序列化：省略 base64、隐去 Cookie 等凭据
+    pending.push(JSON.stringify({
         timestamp: new Date().toISOString(),
-        method,
-        url,
-        params,
-        headers,
-        data,
-    };
-
-    const logString = JSON.stringify(logEntry) + '\n';
-
-    fs.appendFile(LOG_FILE_PATH, logString, (err) => {
-        if (err) {
-            console.error('Failed to write to debug log:', err);
-        }
+        method: requestConfig.method,
+        url: requestConfig.url,
+        params: summarizeForLog(requestConfig.params),
+        headers: summarizeForLog(requestConfig.headers),
+        data: summarizeForLog(requestConfig.data),
+        ...outcome
+    }) + '\n');
+    scheduleFlush();
+}
+
+/**
+ * 记录上游请求（按 system.yml 的 upstreamLog 配置）
+ *
+ * off：不记录；errors：只记录失败的请求；sampled：按 upstreamLogSampleRate 采样记录，失败的请求总是记录。
+ * 记录在请求结束后批量异步写入 logs/upstream.jsonl。
+ */
+export function logRequest<T>(requestConfig: AxiosRequestConfig, request: Promise<T>): Promise<T> {
+    const mode = config.system.upstreamLog;
+    if (mode !== 'errors' && mode !== 'sampled') return request;
+    const sampled = mode === 'sampled' && Math.random() < config.system.upstreamLogSampleRate;
+    const started = performance.now();
+    return request.then(response => {
+        const failed = isFailure(response);
+        if (sampled || failed)
+            enqueue(requestConfig, { status: (response as any)?.status, failed, duration: Math.round(performance.now() - started) });
+        return response;
+    }, err => {
+        enqueue(requestConfig, { status: err?.response?.status, failed: true, error: err?.message || String(err), duration: Math.round(performance.now() - started) });
+        throw err;
     });
 }
+
+/**
+ * 写出剩余记录（优雅停止时调用）
+ */
+export function flush() {
+    if (timer) {
+        clearTimeout(timer);
+        timer = null;
+    }
+    writing = writing.then(write).catch(err => console.error('Failed to write upstream log:', err));
+    return writing;
+}
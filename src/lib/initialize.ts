@@ -17,11 +17,7 @@ process.on("exit", () => {
     logger.info("Service exit");
     logger.footer();
 });
-// 进程被kill
-process.on("SIGTERM", () => {
-    logger.warn("received kill signal");
-    process.exit(2);
-});
+// 进程被kill：优雅停止见 lifecycle.ts
 // Ctrl-C进程退出
 process.on("SIGINT", () => {
     process.exit(0);
@@ -0,0 +1,125 @@
+import config from "@/lib/config.ts";
+import logger from "@/lib/logger.ts";
+import server from "@/lib/server.ts";
+import cluster from "@/lib/cluster.ts";
+import mediaTaskManager from "@/lib/media-task-manager.ts";
+import mediaTaskNotifier from "@/lib/media-task-notifier.ts";
+import mediaStore from "@/lib/media-store.ts";
+import storage from "@/lib/storage.ts";
+import AccountManager from "@/lib/account-manager.ts";
+import ModelManager from "@/lib/model-manager.ts";
+import ResponsePolicyManager from "@/lib/response-policy.ts";
+import TokenCounter from "@/lib/token-counter.ts";
+import tokenizer from "@/lib/tokenizer.ts";
+import { flush as flushUpstreamLog } from "@/lib/debug-logger.ts";
+
+// 守护进程约定的重启退出码
+const RESTART_EXIT_CODE = 3;
+
+let stopping: Promise<void> | null = null;
+let ready = false;
+// 启动阶段各子系统加载耗时（毫秒）
+let startupTimings: Record<string, number> = {};
+let startupTime = 0;
+
+/**
+ * 启动阶段：并行加载各状态存储并记录各自耗时；端口先行监听，完成前 /ready 返回 503，其他请求等待完成后处理
+ */
+async function initialize() {
+    const started = performance.now();
+    const subsystems: [string, () => Promise<any>][] = [
+        ["storage", () => storage.getStorage()],
+        ["accounts", () => AccountManager.init()],
+        ["models", () => ModelManager.init()],
+        ["policies", () => ResponsePolicyManager.init()],
+        ["usage", () => TokenCounter.init()],
+        ["tokenizer", () => tokenizer.init()]
+    ];
+    // 异步任务与本地媒体只在单进程或集群主进程中加载
+    if (!cluster.isWorker()) {
+        subsystems.push(
+            ["media-store", () => mediaStore.ensureReady()],
+            ["media-tasks", () => mediaTaskManager.init()],
+            ["media-callbacks", () => mediaTaskNotifier.resumePendingCallbacks()]
+        );
+    }
+    const timings: Record<string, number> = {};
+    await Promise.all(subsystems.map(async ([name, load]) => {
+        const subsystemStarted = performance.now();
+        await load();
+        timings[name] = Math.round(performance.now() - subsystemStarted);
+    }));
+    startupTimings = timings;
+    startupTime = Math.round(performance.now() - started);
+    ready = true;
+    logger.success(`State loaded in ${startupTime}ms (${Object.entries(timings).map(([name, ms]) => `${name}=${ms}ms`).join(", ")})`);
+}
+
+/**
+ * 就绪状态：状态加载完成且未在排空时为 ready，加载期间 starting 为 true
+ */
+function getStatus() {
+    return {
+        ready: ready && !stopping,
+        starting: !ready,
+        draining: !!stopping,
+        pid: process.pid,
+        startup_ms: startupTime,
+        subsystems: startupTimings
+    };
+}
+
+/**
+ * 优雅停止：停止接受新请求，等待进行中的请求与流式响应结束（最多 drainTimeout 毫秒），
+ * 保存任务状态并写出日志后以指定退出码退出
+ */
+function shutdown(code: number) {
+    if (stopping) return stopping;
+    const timeout = config.system.drainTimeout;
+    const deadline = Date.now() + timeout;
+    const remainingTime = () => Math.max(0, deadline - Date.now());
+    logger.info(`Graceful shutdown started, timeout ${timeout}ms`);
+    stopping = (async () => {
+        // 集群模式下先排空 worker，它们转发给主进程的请求随之结束
+        if (cluster.isCoordinator()) await cluster.stopWorkers(timeout);
+        const remaining = await server.drain(remainingTime());
+        if (remaining > 0) logger.warn(`${remaining} requests still in flight at drain deadline`);
+        await mediaTaskManager.drain(remainingTime());
+        await mediaStore.flush();
+        await Promise.all([AccountManager.flush(), TokenCounter.flush(), flushUpstreamLog()]);
+        logger.info("Graceful shutdown completed");
+        await logger.flush();
+    })()
+        .catch(err => logger.error("Graceful shutdown failed:", err))
+        .finally(() => process.exit(code));
+    return stopping;
+}
+
+/**
+ * 重启：集群模式下滚动替换 worker，主进程持有监听端口与账号、任务状态，不中断服务；
+ * 单进程模式下排空后以退出码 3 退出，由守护进程（或 Docker / PM2）重新拉起
+ */
+function restart() {
+    if (cluster.isCoordinator()) {
+        cluster.reload(config.system.drainTimeout)
+            .catch(err => logger.error("[Cluster] reload failed, keeping current workers:", err));
+        return "reload";
+    }
+    // 等待当前响应返回后再开始排空
+    setImmediate(() => shutdown(RESTART_EXIT_CODE));
+    return "restart";
+}
+
+process.on("SIGTERM", () => {
+    logger.warn("received kill signal");
+    shutdown(2);
+});
+// 集群主进程要求排空（滚动重启或停止）
+if (cluster.isWorker()) cluster.subscribe("drain", () => shutdown(0));
+
+export default {
+    initialize,
+    getStatus,
+    shutdown,
+    restart
+};
@@ -8,6 +8,7 @@ import { format as dateFormat } from 'date-fns';
 
 import config from './config.ts';
 import util from './util.ts';
+import metrics from './metrics.ts';
 
 
 // 全局日志文本清洗：移除/掩码可能出现的 base64 和 data URI，防止日志泄露/爆炸
@@ -45,42 +46,212 @@ function sanitizeLogString(input: string): string {
   }
 }
 
+// 请求日志中字符串字段的最大长度
+const MAX_FIELD_LENGTH = 1000;
+// 请求日志中数组保留的元素数
+const MAX_ARRAY_ITEMS = 20;
+// 请求日志中对象的最大嵌套深度
+const MAX_DEPTH = 6;
+const REDACTED_KEYS = /^(authorization|cookie|password|secret|token|refresh_?token|access_?token|api_?key|session_?token|secret_?key)$/i;
+// 日志文件名：yyyy-MM-dd.log 或按大小轮转后的 yyyy-MM-dd.N.log
+const LOG_FILE_PATTERN = /^\d{4}-\d{2}-\d{2}(\.\d+)?\.(log|json)$/;
+// 过期日志清理间隔
+const CLEANUP_INTERVAL = 3600 * 1000;
+
+/**
+ * 生成用于请求日志的副本：截断长字符串、省略 base64 数据、限制数组长度与嵌套深度并隐去凭据字段，
+ * 避免在事件循环上序列化完整的图片与生成内容
+ */
+export function summarizeForLog(value: any, depth = 0): any {
+    if (value === null || value === undefined) return value;
+    if (typeof value === "string") {
+        const dataUri = value.match(/^data:([^;,]*);base64,/);
+        if (dataUri) return `data:${dataUri[1]};base64,[OMITTED len=${value.length - dataUri[0].length}]`;
+        return value.length > MAX_FIELD_LENGTH ? `${value.slice(0, MAX_FIELD_LENGTH)}...[TRUNCATED len=${value.length}]` : value;
+    }
+    if (typeof value !== "object") return value;
+    if (Buffer.isBuffer(value)) return `[Buffer len=${value.length}]`;
+    if (typeof value.pipe === "function") return "[Stream]";
+    if (depth >= MAX_DEPTH) return Array.isArray(value) ? "[Array]" : "[Object]";
+    if (Array.isArray(value)) {
+        const items = value.slice(0, MAX_ARRAY_ITEMS).map(item => summarizeForLog(item, depth + 1));
+        if (value.length > MAX_ARRAY_ITEMS) items.push(`...[${value.length - MAX_ARRAY_ITEMS} more]`);
+        return items;
+    }
+    const result: Record<string, any> = {};
+    for (const key of Object.keys(value))
+        result[key] = REDACTED_KEYS.test(key) ? "[REDACTED]" : summarizeForLog(value[key], depth + 1);
+    return result;
+}
+
 const isVercelEnv = process.env.VERCEL;
 
+const droppedLines = new metrics.Counter("log_lines_dropped_total", "Log lines dropped because the write buffer was full");
+
+/**
+ * 日志文件写入器
+ *
+ * 日志先进入固定容量的环形缓存，由定时任务通过常驻的追加写入流批量写出，不阻塞事件循环；
+ * 磁盘写入跟不上时丢弃最早的日志并计数。文件按日期与大小（logMaxFileSize）轮转，
+ * 超过 logFileExpires 的日志与追踪文件定期清理。
+ */
 class LogWriter {
 
-    #buffers = [];
+    #ring: (string | undefined)[];
+    #head = 0;
+    #count = 0;
+    #dropped = 0;
+    #stream: fs.WriteStream | null = null;
+    #file = { date: "", index: 0, size: 0 };
+    #writing: Promise<any> = Promise.resolve();
 
     constructor() {
-        !isVercelEnv && fs.ensureDirSync(config.system.logDirPath);
-        !isVercelEnv && this.work();
+        this.#ring = new Array(Math.max(1, config.system.logBufferLines));
+        if (isVercelEnv) return;
+        fs.ensureDirSync(config.system.logDirPath);
+        this.work();
+        this.cleanup();
+        setInterval(() => this.cleanup(), CLEANUP_INTERVAL).unref();
+    }
+
+    push(content: string) {
+        if (isVercelEnv) return;
+        const capacity = this.#ring.length;
+        if (this.#count === capacity) {
+            // 缓存已满：覆盖最早的一条
+            this.#head = (this.#head + 1) % capacity;
+            this.#count--;
+            this.#dropped++;
+            droppedLines.inc();
+        }
+        this.#ring[(this.#head + this.#count) % capacity] = content;
+        this.#count++;
+    }
+
+    #take() {
+        const lines: string[] = [];
+        const capacity = this.#ring.length;
+        while (this.#count > 0) {
+            lines.push(this.#ring[this.#head]!);
+            this.#ring[this.#head] = undefined;
+            this.#head = (this.#head + 1) % capacity;
+            this.#count--;
+        }
+        if (this.#dropped > 0) {
+            lines.unshift(`[${dateFormat(new Date(), "yyyy-MM-dd HH:mm:ss.SSS")}][warning][logger<0,0>] log buffer full, ${this.#dropped} lines dropped\n`);
+            this.#dropped = 0;
+        }
+        return lines.join("");
+    }
+
+    #getFilePath(date: string, index: number) {
+        return path.join(config.system.logDirPath, index > 0 ? `${date}.${index}.log` : `${date}.log`);
     }
 
-    push(content) {
-        const buffer = Buffer.from(content);
-        this.#buffers.push(buffer);
+    /**
+     * 从 index 开始查找当天第一个未写满的日志文件（多进程共用日志目录时以实际文件大小为准）
+     */
+    async #resolveFile(date: string, index: number) {
+        const maxSize = config.system.logMaxFileSize;
+        while (true) {
+            const stat = await fs.stat(this.#getFilePath(date, index)).catch(() => null);
+            const size = stat ? stat.size : 0;
+            if (maxSize <= 0 || size < maxSize) return { date, index, size };
+            index++;
+        }
     }
 
-    writeSync(buffer) {
-        !isVercelEnv && fs.appendFileSync(path.join(config.system.logDirPath, `/${util.getDateString()}.log`), buffer);
+    /**
+     * 获取写入流，日期变化或文件超过大小上限时轮转
+     */
+    async #getStream(bytes: number) {
+        const date = util.getDateString();
+        const maxSize = config.system.logMaxFileSize;
+        let file = this.#file;
+        if (date !== file.date)
+            file = await this.#resolveFile(date, 0);
+        else if (maxSize > 0 && file.size > 0 && file.size + bytes > maxSize)
+            file = await this.#resolveFile(date, file.index + 1);
+        if (!this.#stream || file !== this.#file) {
+            this.#stream && this.#stream.end();
+            this.#stream = fs.createWriteStream(this.#getFilePath(file.date, file.index), { flags: "a" });
+            this.#stream.on("error", err => console.error("Log write error:", err));
+            this.#file = file;
+        }
+        return this.#stream;
     }
 
-    async write(buffer) {
-        !isVercelEnv && await fs.appendFile(path.join(config.system.logDirPath, `/${util.getDateString()}.log`), buffer);
+    async #writeBatch() {
+        const content = this.#take();
+        if (!content) return;
+        const bytes = Buffer.byteLength(content);
+        const stream = await this.#getStream(bytes);
+        this.#file.size += bytes;
+        if (!stream.write(content))
+            await new Promise(resolve => stream.once("drain", resolve));
     }
 
+    #currentFilePath() {
+        const date = util.getDateString();
+        return this.#file.date === date ? this.#getFilePath(date, this.#file.index) : this.#getFilePath(date, 0);
+    }
+
+    /**
+     * 同步写入（仅用于启动与退出标记）
+     */
+    writeSync(buffer: Buffer) {
+        !isVercelEnv && fs.appendFileSync(this.#currentFilePath(), buffer);
+    }
+
+    /**
+     * 同步写出剩余缓存（进程退出时调用）
+     */
     flush() {
-        if(!this.#buffers.length) return;
-        !isVercelEnv && fs.appendFileSync(path.join(config.system.logDirPath, `/${util.getDateString()}.log`), Buffer.concat(this.#buffers));
+        if (isVercelEnv) return;
+        const content = this.#take();
+        content && fs.appendFileSync(this.#currentFilePath(), content);
+    }
+
+    /**
+     * 等待进行中的写入完成，写出剩余缓存并关闭写入流
+     */
+    async drain() {
+        if (isVercelEnv) return;
+        await this.#writing.catch(() => null);
+        await this.#writeBatch().catch(err => console.error("Log write error:", err));
+        const stream = this.#stream;
+        this.#stream = null;
+        if (stream) await new Promise(resolve => stream.end(resolve));
     }
 
     work() {
-        if (!this.#buffers.length) return setTimeout(this.work.bind(this), config.system.logWriteInterval);
-        const buffer = Buffer.concat(this.#buffers);
-        this.#buffers = [];
-        this.write(buffer)
-        .finally(() => setTimeout(this.work.bind(this), config.system.logWriteInterval))
-        .catch(err => console.error("Log write error:", err));
+        this.#writing = this.#writeBatch();
+        this.#writing
+        .catch(err => console.error("Log write error:", err))
+        .finally(() => setTimeout(() => this.work(), config.system.logWriteInterval).unref());
+    }
+
+    /**
+     * 删除超过有效期的日志与慢请求追踪文件
+     */
+    async cleanup() {
+        const expires = config.system.logFileExpires;
+        if (!(expires > 0)) return;
+        const deadline = Date.now() - expires;
+        const dirs = [config.system.logDirPath, path.join(config.system.logDirPath, "traces")];
+        try {
+            for (const dir of dirs) {
+                if (!await fs.pathExists(dir)) continue;
+                for (const name of await fs.readdir(dir)) {
+                    if (!LOG_FILE_PATTERN.test(name)) continue;
+                    const file = path.join(dir, name);
+                    const stat = await fs.stat(file).catch(() => null);
+                    if (stat && stat.mtimeMs < deadline) await fs.remove(file);
+                }
+            }
+        } catch (err) {
+            console.error("Log cleanup error:", err);
+        }
     }
 
 }
@@ -164,6 +335,10 @@ class Logger {
         this.#writer.writeSync(Buffer.from(`\n\n===================== LOG START ${dateFormat(new Date(), "yyyy-MM-dd HH:mm:ss.SSS")} =====================\n\n`));
     }
 
+    flush() {
+        return this.#writer.drain();
+    }
+
     footer() {
         this.#writer.flush();  //将未写入文件的日志缓存写入
         this.#writer.writeSync(Buffer.from(`\n\n===================== LOG END ${dateFormat(new Date(), "yyyy-MM-dd HH:mm:ss.SSS")} =====================\n\n`));
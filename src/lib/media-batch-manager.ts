@@ -0,0 +1,272 @@
+import { EventEmitter } from "events";
+import { PassThrough } from "stream";
+
+import logger from "@/lib/logger.ts";
+import util from "@/lib/util.ts";
+import APIException from "@/lib/exceptions/APIException.ts";
+import EX from "@/api/consts/exceptions.ts";
+import mediaTaskManager, { CreateTaskOptions, LocalMediaItem, MediaTask, TaskStatus } from "@/lib/media-task-manager.ts";
+
+type BatchItemStatus = "pending" | TaskStatus;
+
+export interface BatchItem {
+    index: number;
+    custom_id?: string;
+    status: BatchItemStatus;
+    task_id?: string;
+    images?: string[];
+    media?: LocalMediaItem[];
+    error?: string;
+    completed_at?: string;
+}
+
+export interface MediaBatch {
+    id: string;
+    type: "image";
+    items: BatchItem[];
+    created_at: string;
+    completed_at?: string;
+}
+
+interface BatchRuntime {
+    batch: MediaBatch;
+    specs: any[];
+    nextIndex: number;
+    running: number;
+    done: number;
+    startedAt: number;
+    getConcurrency: (spec: any) => number;
+    getTaskOptions: (spec: any) => CreateTaskOptions;
+    /** 暂停（无可用账号）后的重试定时器 */
+    retryTimer: NodeJS.Timeout | null;
+}
+
+// 单个批次最大条目数
+const MAX_BATCH_ITEMS = 10000;
+// 已完成批次在内存中的保留时长
+const BATCH_RETENTION = 24 * 3600 * 1000;
+// 无可用账号时暂停提交，按此间隔重新检查
+const PAUSE_RETRY_INTERVAL = 5000;
+
+const batches = new Map<string, BatchRuntime>();
+// task_id -> [批次ID, 条目序号]
+const taskIndex = new Map<string, [string, number]>();
+const emitter = new EventEmitter();
+emitter.setMaxListeners(0);
+
+mediaTaskManager.events.on("update", (task: MediaTask, result?: any) => {
+    const ref = taskIndex.get(task.id);
+    if (!ref) return;
+    const runtime = batches.get(ref[0]);
+    if (!runtime) return;
+    const item = runtime.batch.items[ref[1]];
+    item.status = task.status;
+    if (task.status !== "succeeded" && task.status !== "failed") return;
+
+    taskIndex.delete(task.id);
+    item.completed_at = task.completed_at;
+    item.error = task.error;
+    item.media = task.media;
+    item.images = result?.data?.map((entry: any) => entry?.url).filter(Boolean)
+        || result?.choices?.[0]?.message?.images
+        || [];
+    completeItem(runtime, item);
+});
+
+/**
+ * 条目结束（成功或失败）后推进批次
+ */
+function completeItem(runtime: BatchRuntime, item: BatchItem) {
+    runtime.running--;
+    runtime.done++;
+    emitter.emit(`item:${runtime.batch.id}`, item);
+    if (runtime.done === runtime.batch.items.length) {
+        runtime.batch.completed_at = new Date().toISOString();
+        emitter.emit(`done:${runtime.batch.id}`);
+        logger.success(`[MediaBatch] ${runtime.batch.id} completed, items=${runtime.done}`);
+        return;
+    }
+    pump(runtime);
+}
+
+/**
+ * 当前允许的并发：异步任务图片并发上限与下一条目所需模型的可用账号数中的较小值
+ */
+function getLimit(runtime: BatchRuntime) {
+    const spec = runtime.specs[Math.min(runtime.nextIndex, runtime.specs.length - 1)];
+    return Math.min(mediaTaskManager.getWorkerLimit("image"), runtime.getConcurrency(spec));
+}
+
+/**
+ * 按当前账号池容量补充提交任务；没有可用账号时暂停，定时重新检查
+ */
+function pump(runtime: BatchRuntime) {
+    if (runtime.retryTimer) {
+        clearTimeout(runtime.retryTimer);
+        runtime.retryTimer = null;
+    }
+    while (runtime.running < getLimit(runtime) && runtime.nextIndex < runtime.specs.length) {
+        const index = runtime.nextIndex++;
+        const spec = runtime.specs[index];
+        const item = runtime.batch.items[index];
+        runtime.running++;
+        item.status = "queued";
+        mediaTaskManager.createTask("image", { ...spec, batch_id: runtime.batch.id }, runtime.getTaskOptions(spec))
+            .then(task => {
+                item.task_id = task.id;
+                taskIndex.set(task.id, [runtime.batch.id, index]);
+                // 提交前已由其他事件推进状态时以任务当前状态为准
+                item.status = task.status;
+            })
+            .catch(err => {
+                item.status = "failed";
+                item.error = err?.message || String(err);
+                item.completed_at = new Date().toISOString();
+                logger.error(`[MediaBatch] ${runtime.batch.id} item ${index} submit failed: ${item.error}`);
+                completeItem(runtime, item);
+            });
+    }
+    // 没有运行中的条目时不会再由任务完成推进，需要定时重试
+    if (runtime.running === 0 && runtime.nextIndex < runtime.specs.length) {
+        runtime.retryTimer = setTimeout(() => pump(runtime), PAUSE_RETRY_INTERVAL);
+        runtime.retryTimer.unref();
+    }
+}
+
+function evictExpiredBatches() {
+    const now = Date.now();
+    for (const [id, runtime] of batches) {
+        const completedAt = runtime.batch.completed_at ? Date.parse(runtime.batch.completed_at) : 0;
+        if (completedAt && now - completedAt > BATCH_RETENTION) batches.delete(id);
+    }
+}
+
+/**
+ * 解析批量条目：支持 JSON 数组或 JSONL 文本
+ */
+function parseSpecs(input: any): any[] {
+    if (Array.isArray(input)) return input;
+    if (typeof input !== "string") return [];
+    return input
+        .split(/\r?\n/)
+        .map(line => line.trim())
+        .filter(Boolean)
+        .map((line, index) => {
+            const spec = util.ignoreJSONParse(line);
+            if (!spec || typeof spec !== "object") throw new APIException(EX.API_REQUEST_PARAMS_INVALID, `Params batch JSONL line ${index + 1} invalid`).setHTTPStatusCode(400);
+            return spec;
+        });
+}
+
+/**
+ * 创建批量生成任务
+ *
+ * 批次只保存在内存中（条目的调度参数可能含指定 Token 模式的凭据，不写入磁盘）：
+ * 重启或排空后批次记录与未提交的条目丢失，已提交的条目作为普通异步任务继续执行
+ *
+ * @param specs 条目列表，每项至少包含 prompt
+ * @param options.getConcurrency 条目所需模型当前允许的最大并发（按账号池容量动态计算），0 时暂停提交
+ * @param options.getTaskOptions 条目提交时的调度参数（优先级、客户端、Authorization）
+ */
+function createBatch(specs: any[], options: { getConcurrency: (spec: any) => number; getTaskOptions: (spec: any) => CreateTaskOptions }) {
+    if (specs.length === 0) throw new APIException(EX.API_REQUEST_PARAMS_INVALID, "Params batch items is empty").setHTTPStatusCode(400);
+    if (specs.length > MAX_BATCH_ITEMS) throw new APIException(EX.API_REQUEST_PARAMS_INVALID, `Params batch items exceeds limit ${MAX_BATCH_ITEMS}`).setHTTPStatusCode(400);
+    specs.forEach((spec, index) => {
+        if (!spec || typeof spec.prompt !== "string") throw new APIException(EX.API_REQUEST_PARAMS_INVALID, `Params items[${index}].prompt invalid`).setHTTPStatusCode(400);
+    });
+    evictExpiredBatches();
+
+    const id = `batch-${Date.now()}-${util.generateRandomString({ length: 8, charset: "alphanumeric" }).toLowerCase()}`;
+    const batch: MediaBatch = {
+        id,
+        type: "image",
+        items: specs.map((spec, index) => ({
+            index,
+            custom_id: spec.custom_id,
+            status: "pending"
+        })),
+        created_at: new Date().toISOString()
+    };
+    const runtime: BatchRuntime = {
+        batch,
+        specs,
+        nextIndex: 0,
+        running: 0,
+        done: 0,
+        startedAt: Date.now(),
+        getConcurrency: options.getConcurrency,
+        getTaskOptions: options.getTaskOptions,
+        retryTimer: null
+    };
+    batches.set(id, runtime);
+    logger.info(`[MediaBatch] ${id} created, items=${specs.length}`);
+    pump(runtime);
+    return getProgress(id);
+}
+
+/**
+ * 获取批次聚合进度（吞吐量与预计剩余时间）
+ */
+function getProgress(id: string) {
+    const runtime = batches.get(id);
+    if (!runtime) return null;
+    const { batch } = runtime;
+    const counts: Record<BatchItemStatus, number> = { pending: 0, queued: 0, running: 0, succeeded: 0, failed: 0 };
+    batch.items.forEach(item => counts[item.status]++);
+    const endTime = batch.completed_at ? Date.parse(batch.completed_at) : Date.now();
+    const elapsedSeconds = Math.max(0.001, (endTime - runtime.startedAt) / 1000);
+    const throughput = runtime.done / elapsedSeconds;
+    const remaining = batch.items.length - runtime.done;
+    return {
+        batch_id: batch.id,
+        status: batch.completed_at ? "completed" : "running",
+        total: batch.items.length,
+        completed: runtime.done,
+        counts,
+        concurrency: batch.completed_at ? 0 : Math.max(0, getLimit(runtime)),
+        paused: !batch.completed_at && runtime.running === 0 && runtime.nextIndex < batch.items.length,
+        elapsed_seconds: Math.round(elapsedSeconds),
+        throughput_per_minute: Number((throughput * 60).toFixed(2)),
+        eta_seconds: remaining === 0 ? 0 : (throughput > 0 ? Math.round(remaining / throughput) : null),
+        created_at: batch.created_at,
+        completed_at: batch.completed_at,
+        results_url: `/v1/images/generations/batch/${batch.id}/results`
+    };
+}
+
+/**
+ * 以 NDJSON 流输出已完成条目，先输出已完成部分，随后按完成顺序推送，全部完成后结束
+ */
+function createResultStream(id: string) {
+    const runtime = batches.get(id);
+    if (!runtime) return null;
+    const stream = new PassThrough();
+    const write = (item: BatchItem) => !stream.destroyed && stream.write(JSON.stringify(item) + "\n");
+    const cleanup = () => {
+        emitter.off(`item:${id}`, write);
+        emitter.off(`done:${id}`, finish);
+    };
+    const finish = () => {
+        cleanup();
+        !stream.destroyed && stream.end();
+    };
+
+    runtime.batch.items
+        .filter(item => item.status === "succeeded" || item.status === "failed")
+        .forEach(write);
+    if (runtime.done === runtime.batch.items.length) {
+        stream.end();
+        return stream;
+    }
+    emitter.on(`item:${id}`, write);
+    emitter.once(`done:${id}`, finish);
+    stream.once("close", cleanup);
+    return stream;
+}
+
+export default {
+    createBatch,
+    getProgress,
+    createResultStream,
+    parseSpecs
+};
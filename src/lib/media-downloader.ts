@@ -0,0 +1,215 @@
+import crypto from "crypto";
+import { Transform } from "stream";
+import { pipeline } from "stream/promises";
+import fs from "fs-extra";
+import axios from "axios";
+
+import logger from "@/lib/logger.ts";
+import AccountManager from "@/lib/account-manager.ts";
+
+// 单个文件最大体积
+const MAX_DOWNLOAD_SIZE = 1024 * 1024 * 1024;
+// 单个文件最大尝试次数（失败后按 Range 续传）
+const DOWNLOAD_ATTEMPTS = 4;
+// 重试基础间隔，按尝试次数递增
+const RETRY_DELAY = 1000;
+// 连接空闲超时
+const IDLE_TIMEOUT = 60000;
+
+export interface DownloadResult {
+    size: number;
+    sha256: string;
+    contentType?: string;
+}
+
+interface DownloadState {
+    /** 首次完整响应的总长度 */
+    size?: number;
+    /** 首次完整响应的 Content-MD5（base64） */
+    md5?: string;
+    etag?: string;
+    contentType?: string;
+}
+
+class DownloadError extends Error {
+    constructor(message: string, public retryable = true) {
+        super(message);
+    }
+}
+
+let activeConnections = 0;
+const connectionWaiters: (() => void)[] = [];
+// 全局带宽令牌桶（字节），允许 1 秒的突发
+let bandwidthTokens = 0;
+let bandwidthUpdatedAt = Date.now();
+
+function getConnectionLimit() {
+    const limit = Number(AccountManager.getSettings().mediaDownloadConnections);
+    return Number.isFinite(limit) && limit > 0 ? Math.floor(limit) : 4;
+}
+
+function getBandwidthLimit() {
+    const limit = Number(AccountManager.getSettings().mediaDownloadBandwidthKB);
+    return Number.isFinite(limit) && limit > 0 ? limit * 1024 : 0;
+}
+
+async function acquireConnection() {
+    if (activeConnections < getConnectionLimit()) {
+        activeConnections++;
+        return;
+    }
+    await new Promise<void>(resolve => connectionWaiters.push(resolve));
+}
+
+function releaseConnection() {
+    activeConnections--;
+    while (connectionWaiters.length > 0 && activeConnections < getConnectionLimit()) {
+        activeConnections++;
+        connectionWaiters.shift()!();
+    }
+}
+
+/**
+ * 预约带宽，返回需要等待的毫秒数
+ */
+function reserveBandwidth(bytes: number) {
+    const rate = getBandwidthLimit();
+    if (rate <= 0) return 0;
+    const now = Date.now();
+    bandwidthTokens = Math.min(rate, bandwidthTokens + (now - bandwidthUpdatedAt) * rate / 1000);
+    bandwidthUpdatedAt = now;
+    bandwidthTokens -= bytes;
+    return bandwidthTokens >= 0 ? 0 : Math.ceil(-bandwidthTokens / rate * 1000);
+}
+
+function parseRangeTotal(contentRange?: string) {
+    const match = /\/(\d+)\s*$/.exec(contentRange || "");
+    return match ? Number(match[1]) : undefined;
+}
+
+/**
+ * 续传前用已下载部分重建摘要状态
+ */
+async function feedExisting(filePath: string, hashes: crypto.Hash[]) {
+    if (hashes.length === 0) return;
+    await pipeline(fs.createReadStream(filePath), new Transform({
+        transform(chunk, _encoding, callback) {
+            hashes.forEach(hash => hash.update(chunk));
+            callback();
+        }
+    }));
+}
+
+async function attemptDownload(url: string, filePath: string, state: DownloadState, accept?: string): Promise<DownloadResult> {
+    const offset = await fs.stat(filePath).then(stat => stat.size, () => 0);
+    const headers: Record<string, string> = {
+        "User-Agent": "Mozilla/5.0",
+        "Accept": accept || "*/*",
+        // 断点续传、大小与 MD5 校验均按原始字节计算，要求不压缩传输
+        "Accept-Encoding": "identity"
+    };
+    if (offset > 0) {
+        headers["Range"] = `bytes=${offset}-`;
+        if (state.etag) headers["If-Range"] = state.etag;
+    }
+    const response = await axios.get(url, {
+        responseType: "stream",
+        decompress: false,
+        timeout: IDLE_TIMEOUT,
+        headers,
+        validateStatus: status => status === 200 || status === 206
+    }).catch(err => {
+        const status = err?.response?.status;
+        if (status === 416) {
+            // 已下载部分与远端不一致，丢弃后从头下载
+            return fs.remove(filePath).then(() => { throw new DownloadError("Range not satisfiable"); });
+        }
+        const retryable = !status || status === 408 || status === 429 || status >= 500;
+        throw new DownloadError(`HTTP ${status || "error"}: ${err?.message || err}`, retryable);
+    });
+
+    const resumed = offset > 0 && response.status === 206;
+    if (!resumed) {
+        state.size = Number(response.headers["content-length"]) || undefined;
+        state.md5 = response.headers["content-md5"] || undefined;
+        state.etag = response.headers["etag"] || undefined;
+        state.contentType = response.headers["content-type"] || undefined;
+    }
+    const expectedSize = resumed ? parseRangeTotal(response.headers["content-range"]) ?? state.size : state.size;
+    if (expectedSize && expectedSize > MAX_DOWNLOAD_SIZE) {
+        response.data.destroy();
+        throw new DownloadError(`Media size ${expectedSize} exceeds limit`, false);
+    }
+
+    const sha256 = crypto.createHash("sha256");
+    const md5 = state.md5 ? crypto.createHash("md5") : null;
+    const hashes = md5 ? [sha256, md5] : [sha256];
+    if (resumed) await feedExisting(filePath, hashes);
+    let size = resumed ? offset : 0;
+
+    const meter = new Transform({
+        transform(chunk: Buffer, _encoding, callback) {
+            size += chunk.length;
+            if (size > MAX_DOWNLOAD_SIZE) return callback(new DownloadError("Media exceeds size limit", false));
+            hashes.forEach(hash => hash.update(chunk));
+            const wait = reserveBandwidth(chunk.length);
+            if (wait > 0) setTimeout(() => callback(null, chunk), wait);
+            else callback(null, chunk);
+        }
+    });
+    await pipeline(response.data, meter, fs.createWriteStream(filePath, { flags: resumed ? "a" : "w" }));
+
+    if (expectedSize && size !== expectedSize) {
+        // 数据不足时保留已下载部分用于续传，超出则说明内容已变化
+        if (size > expectedSize) await fs.remove(filePath);
+        throw new DownloadError(`Size mismatch: expected ${expectedSize}, got ${size}`);
+    }
+    if (md5 && md5.digest("base64") !== state.md5) {
+        await fs.remove(filePath);
+        throw new DownloadError("Content-MD5 mismatch");
+    }
+    return { size, sha256: sha256.digest("hex"), contentType: state.contentType };
+}
+
+/**
+ * 流式下载到指定文件，失败时按 Range 续传并校验大小与摘要
+ *
+ * 全局连接数与带宽受后台设置 mediaDownloadConnections / mediaDownloadBandwidthKB 限制。
+ * 成功后文件保留在 filePath，由调用方重命名到最终位置；失败时删除。
+ */
+async function download(url: string, filePath: string, options: { accept?: string } = {}): Promise<DownloadResult> {
+    const state: DownloadState = {};
+    await fs.remove(filePath);
+    await acquireConnection();
+    try {
+        for (let attempt = 1; ; attempt++) {
+            try {
+                return await attemptDownload(url, filePath, state, options.accept);
+            } catch (err: any) {
+                const retryable = !(err instanceof DownloadError) || err.retryable;
+                if (!retryable || attempt >= DOWNLOAD_ATTEMPTS) throw err;
+                logger.warn(`[MediaDownload] ${url} attempt ${attempt} failed: ${err?.message || err}, retrying`);
+                await new Promise(resolve => setTimeout(resolve, RETRY_DELAY * attempt));
+            }
+        }
+    } catch (err) {
+        await fs.remove(filePath).catch(() => undefined);
+        throw err;
+    } finally {
+        releaseConnection();
+    }
+}
+
+function getStats() {
+    return {
+        active: activeConnections,
+        waiting: connectionWaiters.length,
+        connections: getConnectionLimit(),
+        bandwidth_kb: getBandwidthLimit() / 1024
+    };
+}
+
+export default {
+    download,
+    getStats
+};
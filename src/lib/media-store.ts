@@ -0,0 +1,313 @@
+import path from "path";
+import fs from "fs-extra";
+
+import logger from "@/lib/logger.ts";
+import AccountManager from "@/lib/account-manager.ts";
+
+const STORE_DIR = path.join(process.cwd(), "data", "media", "store");
+// 下载中的临时文件
+const TMP_DIR = path.join(STORE_DIR, "tmp");
+// 条目元数据（大小、类型、最近访问时间），引用计数不落盘，由任务记录重建
+const INDEX_FILE = path.join(STORE_DIR, "index.json");
+// 索引写入防抖
+const INDEX_SAVE_DELAY = 5000;
+// 后台淘汰检查间隔
+const EVICT_INTERVAL = 10 * 60 * 1000;
+
+export interface StoreEntry {
+    sha256: string;
+    ext: string;
+    size: number;
+    mime_type?: string;
+    created_at: number;
+    last_access: number;
+}
+
+export interface IngestOptions {
+    sha256: string;
+    size: number;
+    ext: string;
+    mime_type?: string;
+}
+
+const entries = new Map<string, StoreEntry>();
+const refs = new Map<string, number>();
+let totalBytes = 0;
+let evictedFiles = 0;
+let evictedBytes = 0;
+let dedupHits = 0;
+let ready: Promise<void> | null = null;
+let saveTimer: NodeJS.Timeout | null = null;
+
+function getEntryPath(entry: Pick<StoreEntry, "sha256" | "ext">) {
+    return path.join(STORE_DIR, entry.sha256.slice(0, 2), `${entry.sha256}.${entry.ext}`);
+}
+
+function getQuotaBytes() {
+    const quota = Number(AccountManager.getSettings().mediaStoreQuotaMB);
+    return Number.isFinite(quota) && quota > 0 ? quota * 1024 * 1024 : 0;
+}
+
+function getMaxAge() {
+    const days = Number(AccountManager.getSettings().mediaStoreMaxAgeDays);
+    return Number.isFinite(days) && days > 0 ? days * 24 * 3600 * 1000 : 0;
+}
+
+/**
+ * 扫描存储目录，以磁盘上实际存在的文件为准合并索引
+ */
+async function load() {
+    await fs.ensureDir(TMP_DIR);
+    await fs.emptyDir(TMP_DIR);
+    const index: Record<string, StoreEntry> = await fs.readJson(INDEX_FILE).catch(() => ({}));
+    const dirs = (await fs.readdir(STORE_DIR)).filter(name => /^[0-9a-f]{2}$/.test(name));
+    for (const dir of dirs) {
+        for (const filename of await fs.readdir(path.join(STORE_DIR, dir))) {
+            const match = /^([0-9a-f]{64})\.(\w+)$/.exec(filename);
+            if (!match) continue;
+            const [, sha256, ext] = match;
+            const stat = await fs.stat(path.join(STORE_DIR, dir, filename));
+            const known = index[sha256];
+            entries.set(sha256, {
+                sha256,
+                ext,
+                size: stat.size,
+                mime_type: known?.mime_type,
+                created_at: known?.created_at || stat.mtimeMs,
+                last_access: known?.last_access || stat.mtimeMs
+            });
+            totalBytes += stat.size;
+        }
+    }
+    setInterval(() => evict(), EVICT_INTERVAL).unref();
+}
+
+function ensureReady() {
+    if (!ready) ready = load();
+    return ready;
+}
+
+function saveIndex() {
+    const tmpFile = `${INDEX_FILE}.tmp`;
+    return fs.writeFile(tmpFile, JSON.stringify(Object.fromEntries(entries)))
+        .then(() => fs.rename(tmpFile, INDEX_FILE))
+        .catch(err => logger.error(`[MediaStore] index save failed: ${err?.message || err}`));
+}
+
+function scheduleSave() {
+    if (saveTimer) return;
+    saveTimer = setTimeout(() => {
+        saveTimer = null;
+        saveIndex();
+    }, INDEX_SAVE_DELAY);
+    saveTimer.unref();
+}
+
+/**
+ * 立即写入尚在防抖等待中的索引
+ */
+async function flush() {
+    if (!saveTimer) return;
+    clearTimeout(saveTimer);
+    saveTimer = null;
+    await saveIndex();
+}
+
+function removeEntry(entry: StoreEntry) {
+    entries.delete(entry.sha256);
+    totalBytes -= entry.size;
+    return fs.remove(getEntryPath(entry));
+}
+
+/**
+ * 按年龄与配额淘汰未被任务引用的条目：先淘汰过期条目，再按最近最少访问的顺序淘汰至配额以内；
+ * 仍被引用的文件无论年龄与配额都不会删除
+ */
+async function evict() {
+    await ensureReady();
+    const quota = getQuotaBytes();
+    const maxAge = getMaxAge();
+    const now = Date.now();
+    const unreferenced = [...entries.values()].filter(entry => !refs.has(entry.sha256));
+    const removed: StoreEntry[] = [];
+
+    if (maxAge > 0) {
+        for (const entry of unreferenced) {
+            if (now - entry.last_access > maxAge) removed.push(entry);
+        }
+    }
+    let bytes = totalBytes - removed.reduce((sum, entry) => sum + entry.size, 0);
+    if (quota > 0 && bytes > quota) {
+        const expired = new Set(removed);
+        const candidates = unreferenced
+            .filter(entry => !expired.has(entry))
+            .sort((a, b) => a.last_access - b.last_access);
+        for (const entry of candidates) {
+            if (bytes <= quota) break;
+            removed.push(entry);
+            bytes -= entry.size;
+        }
+        if (bytes > quota) logger.warn(`[MediaStore] referenced files exceed quota, usage=${Math.round(bytes / 1024 / 1024)}MB`);
+    }
+
+    let count = 0;
+    for (const entry of removed) {
+        // 删除过程中可能被新任务复用，此时保留
+        if (refs.has(entry.sha256) || entries.get(entry.sha256) !== entry) continue;
+        await removeEntry(entry).catch(err => logger.error(`[MediaStore] remove ${entry.sha256} failed: ${err?.message || err}`));
+        evictedFiles++;
+        evictedBytes += entry.size;
+        count++;
+    }
+    if (count === 0) return;
+    scheduleSave();
+    logger.info(`[MediaStore] evicted ${count} files, usage=${Math.round(totalBytes / 1024 / 1024)}MB`);
+}
+
+/**
+ * 分配下载临时文件路径
+ */
+async function getTempPath(name: string) {
+    await ensureReady();
+    return path.join(TMP_DIR, `${name}.part`);
+}
+
+/**
+ * 将已校验的临时文件移入存储，内容相同的文件只保留一份，并增加一次引用
+ */
+async function ingest(tmpPath: string, options: IngestOptions) {
+    await ensureReady();
+    const now = Date.now();
+    let entry = entries.get(options.sha256);
+    if (entry) {
+        dedupHits++;
+        entry.last_access = now;
+        // 先增加引用，避免等待期间被淘汰
+        retain(entry.sha256);
+        await fs.remove(tmpPath);
+    } else {
+        entry = {
+            sha256: options.sha256,
+            ext: options.ext,
+            size: options.size,
+            mime_type: options.mime_type,
+            created_at: now,
+            last_access: now
+        };
+        // 先登记再移动文件，并发写入相同内容时后到者直接复用
+        entries.set(entry.sha256, entry);
+        totalBytes += entry.size;
+        retain(entry.sha256);
+        const filePath = getEntryPath(entry);
+        try {
+            await fs.ensureDir(path.dirname(filePath));
+            await fs.rename(tmpPath, filePath);
+        } catch (err) {
+            release(entry.sha256);
+            entries.delete(entry.sha256);
+            totalBytes -= entry.size;
+            throw err;
+        }
+        if (getQuotaBytes() > 0 && totalBytes > getQuotaBytes()) setImmediate(() => evict());
+    }
+    scheduleSave();
+    return {
+        ...entry,
+        local_path: path.relative(process.cwd(), getEntryPath(entry)).replace(/\\/g, "/"),
+        filename: `${entry.sha256}.${entry.ext}`
+    };
+}
+
+async function ingestBuffer(buffer: Buffer, options: IngestOptions) {
+    const tmpPath = await getTempPath(`${options.sha256}-${process.hrtime.bigint()}`);
+    await fs.writeFile(tmpPath, buffer);
+    return ingest(tmpPath, options);
+}
+
+function retain(sha256?: string) {
+    if (sha256) refs.set(sha256, (refs.get(sha256) || 0) + 1);
+}
+
+/**
+ * 释放任务引用；文件不会立即删除，而是在淘汰时优先清理
+ */
+function release(sha256?: string) {
+    if (!sha256) return;
+    const count = (refs.get(sha256) || 0) - 1;
+    if (count > 0) refs.set(sha256, count);
+    else refs.delete(sha256);
+}
+
+/**
+ * 记录一次访问，用于 LRU 淘汰
+ */
+function touch(sha256: string) {
+    const entry = entries.get(sha256);
+    if (!entry) return null;
+    entry.last_access = Date.now();
+    scheduleSave();
+    return entry;
+}
+
+/**
+ * 按文件名（<sha256>.<ext>）查找存储文件并记录访问，内容寻址因此可使用哈希作为强 ETag
+ */
+function resolve(filename: string) {
+    const match = /^([0-9a-f]{64})\.(\w+)$/.exec(filename);
+    const entry = match ? entries.get(match[1]) : undefined;
+    if (!entry || entry.ext !== match![2]) return null;
+    touch(entry.sha256);
+    return {
+        path: getEntryPath(entry),
+        size: entry.size,
+        mime_type: entry.mime_type,
+        etag: `"${entry.sha256}"`,
+        immutable: true
+    };
+}
+
+function has(sha256?: string) {
+    return !!sha256 && entries.has(sha256);
+}
+
+function getUsage() {
+    return {
+        files: entries.size,
+        bytes: totalBytes,
+        quota_bytes: getQuotaBytes(),
+        referenced_files: refs.size,
+        dedup_hits: dedupHits,
+        evicted_files: evictedFiles,
+        evicted_bytes: evictedBytes
+    };
+}
+
+async function clear() {
+    await ensureReady();
+    const children = (await fs.readdir(STORE_DIR)).filter(name => name !== "tmp");
+    await Promise.all(children.map(name => fs.remove(path.join(STORE_DIR, name))));
+    entries.clear();
+    refs.clear();
+    totalBytes = 0;
+}
+
+export default {
+    ensureReady,
+    getTempPath,
+    ingest,
+    ingestBuffer,
+    retain,
+    release,
+    touch,
+    resolve,
+    has,
+    evict,
+    getUsage,
+    clear,
+    flush,
+    getEntryPath,
+    paths: {
+        storeDir: STORE_DIR,
+        indexFile: INDEX_FILE
+    }
+};
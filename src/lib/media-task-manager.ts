@@ -1,13 +1,20 @@
 import path from "path";
+import crypto from "crypto";
+import { EventEmitter } from "events";
 import fs from "fs-extra";
-import axios from "axios";
 import mime from "mime";
 
+import config from "@/lib/config.ts";
 import logger from "@/lib/logger.ts";
 import util from "@/lib/util.ts";
+import AccountManager from "@/lib/account-manager.ts";
+import mediaDownloader from "@/lib/media-downloader.ts";
+import mediaStore from "@/lib/media-store.ts";
+import storage, { StorageBackend } from "@/lib/storage.ts";
+import tracing from "@/lib/tracing.ts";
 
-type MediaType = "image" | "video";
-type TaskStatus = "queued" | "running" | "succeeded" | "failed";
+export type MediaType = "image" | "video";
+export type TaskStatus = "queued" | "running" | "succeeded" | "failed";
 
 export interface LocalMediaItem {
     type: MediaType;
@@ -16,48 +23,694 @@ export interface LocalMediaItem {
     filename: string;
     size: number;
     mime_type?: string;
+    sha256?: string;
 }
 
 export interface MediaTask {
     id: string;
     type: MediaType;
     status: TaskStatus;
-    request: any;
-    result?: any;
+    priority?: number;
+    client?: string;
+    /** 使用账号池执行（无需凭据）；指定 Token 的任务凭据只保存在内存中，不写入磁盘 */
+    pooled?: boolean;
+    /** 执行该任务的账号池账号 ID（重试时为最后一次使用的账号） */
+    account?: string;
+    /** 请求体旁路文件的内容哈希（含 Base64 参考图，不常驻内存） */
+    request_ref?: string;
+    /** 生成结果旁路文件的内容哈希 */
+    result_ref?: string;
     media: LocalMediaItem[];
     error?: string;
     created_at: string;
     started_at?: string;
     completed_at?: string;
+    /** 任务结束后接收通知的地址 */
+    callback_url?: string;
+    /** 回调投递状态：成功送达时间、已尝试次数、最终失败原因 */
+    callback_delivered_at?: string;
+    callback_attempts?: number;
+    callback_error?: string;
 }
 
 const MEDIA_DIR = path.join(process.cwd(), "data", "media");
 const IMAGE_DIR = path.join(MEDIA_DIR, "images");
 const VIDEO_DIR = path.join(MEDIA_DIR, "videos");
+// 媒体存储目录的相对路径前缀（旧版本文件仍位于 images/videos 目录）
+const STORE_PREFIX = path.relative(process.cwd(), mediaStore.paths.storeDir).replace(/\\/g, "/") + "/";
+// 任务快照（压缩后的全量状态）
 const TASKS_FILE = path.join(MEDIA_DIR, "tasks.json");
+// 任务状态变更日志（NDJSON，仅追加）
+const JOURNAL_FILE = path.join(MEDIA_DIR, "tasks.journal.ndjson");
+// 请求体与生成结果的旁路文件（按内容 sha256 命名）
+const BLOB_DIR = path.join(MEDIA_DIR, "blobs");
+// 旁路文件内存缓存上限（字节，按 JSON 长度估算）
+const BLOB_CACHE_BYTES = 64 * 1024 * 1024;
+// 日志条数达到阈值后压缩进快照
+const JOURNAL_COMPACT_THRESHOLD = 1000;
+// 定时压缩间隔
+const JOURNAL_COMPACT_INTERVAL = 10 * 60 * 1000;
+// SQLite 后端中的任务集合名
+const TASKS_COLLECTION = "media-tasks";
+// 任务列表单页上限
+const MAX_LIST_LIMIT = 100;
+// 任务优先级范围
+const MIN_PRIORITY = -10;
+const MAX_PRIORITY = 10;
+
+export interface CreateTaskOptions {
+    /** 优先级，越大越先执行，默认 0 */
+    priority?: number;
+    /** 客户端标识，用于同优先级下的公平调度 */
+    client?: string;
+    /** 使用账号池执行 */
+    pooled?: boolean;
+    /** 提交时的 Authorization（指定 Token 模式），只保存在内存中，任务结束后丢弃 */
+    auth?: string;
+    /** 任务结束后接收签名通知的地址 */
+    callback_url?: string;
+}
+
+/**
+ * 执行器工厂：根据持久化的任务记录构建生成执行器，排队期间不持有闭包
+ */
+export type TaskExecutorFactory = (task: MediaTask, request: any, auth?: string) => () => Promise<any>;
+
+interface QueueEntry {
+    id: string;
+    priority: number;
+    /** 公平队列虚拟时间，同一客户端的任务依次递增 */
+    vtime: number;
+    seq: number;
+}
+
+type JournalRecord =
+    | { op: "put"; task: MediaTask }
+    | { op: "patch"; id: string; data: { [K in keyof MediaTask]?: MediaTask[K] | null } }
+    | { op: "delete"; id: string };
 
 let tasks: Record<string, MediaTask> | null = null;
-let saveQueue = Promise.resolve();
+let storeReady: Promise<void> | null = null;
+// 启动阶段是否已完成（存储已加载、开始消费队列）
+let initialized = false;
+// 所有文件写入串行执行，保证日志与快照顺序一致
+let writeChain = Promise.resolve();
+let journalBuffer: string[] = [];
+let journalFlush: Promise<void> | null = null;
+let journalEntries = 0;
+// 使用 SQLite 后端时按行持久化任务，替代快照与日志
+let rowStorage: StorageBackend | null = null;
+const dirtyRows = new Set<string>();
+let rowFlush: Promise<void> | null = null;
+// 任务状态变更事件（update），监听方只读，不应修改任务对象
+const events = new EventEmitter();
+events.setMaxListeners(0);
 
-async function ensureStore() {
+const executorFactories: Partial<Record<MediaType, TaskExecutorFactory>> = {};
+// 任务 ID -> 提交时的 Authorization，不持久化，任务结束或进程重启后即不可用
+const taskCredentials = new Map<string, string>();
+// 各类型的有序等待队列（按优先级、虚拟时间、提交顺序排序）
+const queues: Record<MediaType, QueueEntry[]> = { image: [], video: [] };
+// 任务 ID -> 排队中的队列项，用于二分查找排队位置
+const queuedEntries = new Map<string, QueueEntry>();
+const activeWorkers: Record<MediaType, number> = { image: 0, video: 0 };
+// 排空中：不再派发新任务
+let draining = false;
+// 已分派任务的虚拟时间，新客户端从此处开始计数
+const dispatchedVtime: Record<MediaType, number> = { image: 0, video: 0 };
+// 各客户端最近一次入队的虚拟时间
+const clientVtime = new Map<string, number>();
+let queueSeq = 0;
+// 旁路文件引用计数，归零后删除文件
+const blobRefs = new Map<string, number>();
+// 最近使用的旁路内容（Map 按插入顺序实现 LRU）
+const blobCache = new Map<string, { value: any; size: number }>();
+let blobCacheBytes = 0;
+// 二级索引：all / status:<状态> / type:<类型> / client:<客户端> / account:<账号> -> 按创建时间升序排列的任务 ID
+const indexes = new Map<string, string[]>();
+
+export interface ListTasksOptions {
+    status?: TaskStatus;
+    type?: MediaType;
+    client?: string;
+    /** 执行任务的账号池账号 ID */
+    account?: string;
+    /** 创建时间下限（含），ISO 时间 */
+    created_after?: string;
+    /** 创建时间上限（不含），ISO 时间 */
+    created_before?: string;
+    limit?: number;
+    /** 上一页返回的 next_cursor */
+    cursor?: string;
+}
+
+function applyJournalRecord(store: Record<string, MediaTask>, record: JournalRecord) {
+    if (record.op === "put") {
+        store[record.task.id] = record.task;
+    } else if (record.op === "patch") {
+        // 值为 null 的字段表示移除
+        const task = store[record.id];
+        if (task) {
+            for (const [key, value] of Object.entries(record.data)) {
+                if (value === null) delete (task as any)[key];
+                else (task as any)[key] = value;
+            }
+        }
+    } else if (record.op === "delete") {
+        delete store[record.id];
+    }
+}
+
+function getBlobPath(hash: string) {
+    return path.join(BLOB_DIR, hash.slice(0, 2), `${hash}.json`);
+}
+
+function cacheBlob(hash: string, value: any, size: number) {
+    const cached = blobCache.get(hash);
+    if (cached) {
+        blobCache.delete(hash);
+        blobCacheBytes -= cached.size;
+    }
+    if (size > BLOB_CACHE_BYTES / 4) return;
+    blobCache.set(hash, { value, size });
+    blobCacheBytes += size;
+    for (const [key, entry] of blobCache) {
+        if (blobCacheBytes <= BLOB_CACHE_BYTES) break;
+        blobCache.delete(key);
+        blobCacheBytes -= entry.size;
+    }
+}
+
+function retainBlob(hash?: string) {
+    if (hash) blobRefs.set(hash, (blobRefs.get(hash) || 0) + 1);
+}
+
+/**
+ * 写入内容寻址的旁路文件并增加引用计数，相同内容只保存一份
+ */
+function putBlob(value: any): Promise<string> {
+    const json = JSON.stringify(value ?? null);
+    const hash = crypto.createHash("sha256").update(json).digest("hex");
+    const existing = blobRefs.get(hash) || 0;
+    retainBlob(hash);
+    cacheBlob(hash, value ?? null, json.length);
+    // 已有引用时文件已在写入队列中，等待队列推进即可
+    if (existing > 0) return writeChain.then(() => hash);
+    const filePath = getBlobPath(hash);
+    const write = writeChain.then(async () => {
+        if (await fs.pathExists(filePath)) return;
+        await fs.ensureDir(path.dirname(filePath));
+        await fs.writeFile(`${filePath}.tmp`, json);
+        await fs.rename(`${filePath}.tmp`, filePath);
+    });
+    writeChain = write.catch(() => undefined);
+    return write.then(() => hash, err => {
+        releaseBlob(hash);
+        throw err;
+    });
+}
+
+/**
+ * 释放引用，归零后删除旁路文件（删除前再次确认未被重新引用）
+ */
+function releaseBlob(hash?: string) {
+    if (!hash) return;
+    const refs = (blobRefs.get(hash) || 0) - 1;
+    if (refs > 0) {
+        blobRefs.set(hash, refs);
+        return;
+    }
+    blobRefs.delete(hash);
+    const cached = blobCache.get(hash);
+    if (cached) {
+        blobCache.delete(hash);
+        blobCacheBytes -= cached.size;
+    }
+    writeChain = writeChain
+        .then(() => blobRefs.has(hash) ? undefined : fs.remove(getBlobPath(hash)))
+        .catch(err => logger.error(`[MediaTask] blob remove failed: ${err?.message || err}`));
+}
+
+async function readBlob(hash?: string) {
+    if (!hash) return undefined;
+    const cached = blobCache.get(hash);
+    if (cached) {
+        cacheBlob(hash, cached.value, cached.size);
+        return cached.value;
+    }
+    const json = await fs.readFile(getBlobPath(hash), "utf8");
+    const value = JSON.parse(json);
+    cacheBlob(hash, value, json.length);
+    return value;
+}
+
+/**
+ * 加载快照并重放日志，未完成的任务重新入队
+ */
+async function readJsonStore() {
+    const store: Record<string, MediaTask> = await fs.readJson(TASKS_FILE).catch(() => ({}));
+    if (await fs.pathExists(JOURNAL_FILE)) {
+        const lines = (await fs.readFile(JOURNAL_FILE, "utf8")).split("\n");
+        for (const line of lines) {
+            if (!line.trim()) continue;
+            // 进程崩溃时最后一行可能写入不完整，直接跳过
+            const record = util.ignoreJSONParse(line);
+            if (!record || !record.op) continue;
+            applyJournalRecord(store, record);
+            journalEntries++;
+        }
+    }
+    return store;
+}
+
+async function loadStore() {
     await fs.ensureDir(IMAGE_DIR);
     await fs.ensureDir(VIDEO_DIR);
-    if (!await fs.pathExists(TASKS_FILE)) {
-        await fs.writeJson(TASKS_FILE, {}, { spaces: 2 });
+    const backend = await storage.getStorage();
+    let store: Record<string, MediaTask>;
+    let imported = false;
+    if (backend.name === "sqlite") {
+        const rows = await backend.loadCollection<MediaTask>(TASKS_COLLECTION);
+        if (rows) {
+            store = Object.fromEntries(rows.map(task => [task.id, task]));
+        } else {
+            // 首次启用 SQLite 时导入现有快照与日志
+            store = await readJsonStore();
+            imported = Object.keys(store).length > 0;
+            journalEntries = 0;
+        }
+        rowStorage = backend;
+    } else {
+        store = await readJsonStore();
     }
-    if (!tasks) {
-        tasks = await fs.readJson(TASKS_FILE).catch(() => ({}));
+    // 旧版本记录内联保存了请求与结果，迁移到旁路文件
+    let migrated = 0;
+    let stripped = 0;
+    for (const task of Object.values(store) as any[]) {
+        // 旧版本记录保存了 Authorization：只保留是否为账号池模式，凭据从磁盘移除且不再使用
+        if ("auth" in task) {
+            if (typeof task.auth === "string" && (task.auth.includes("pooled") || task.auth.length < 20)) task.pooled = true;
+            delete task.auth;
+            stripped++;
+        }
+        if ("request" in task) {
+            task.request_ref = await putBlob(task.request);
+            delete task.request;
+            migrated++;
+        } else {
+            retainBlob(task.request_ref);
+        }
+        if ("result" in task) {
+            task.result_ref = task.result === undefined ? undefined : await putBlob(task.result);
+            delete task.result;
+            migrated++;
+        } else {
+            retainBlob(task.result_ref);
+        }
+    }
+    tasks = store;
+    if (imported) {
+        // 导入后重命名原文件，避免清空任务后再次导入
+        await compactJournal();
+        for (const file of [TASKS_FILE, JOURNAL_FILE]) {
+            if (await fs.pathExists(file)) await fs.move(file, `${file}.imported`, { overwrite: true });
+        }
+        logger.info(`[MediaTask] imported ${Object.keys(store).length} tasks into SQLite`);
+    }
+    // 由任务记录重建媒体文件引用计数
+    await mediaStore.ensureReady();
+    for (const task of Object.values(store)) {
+        task.media.forEach(item => mediaStore.retain(item.sha256));
+    }
+    if (migrated > 0) {
+        logger.info(`[MediaTask] migrated ${migrated} inline payloads to ${path.relative(process.cwd(), BLOB_DIR)}`);
+    }
+    if (stripped > 0) {
+        logger.info(`[MediaTask] removed stored credentials from ${stripped} tasks`);
+    }
+    // 重写快照，覆盖旧记录
+    if (migrated > 0 || stripped > 0) await compactJournal();
+
+    const pending = Object.values(store)
+        .filter(task => task.status === "queued" || task.status === "running")
+        .sort((a, b) => a.created_at.localeCompare(b.created_at));
+    for (const task of pending) {
+        if (task.status === "running") {
+            task.status = "queued";
+            delete task.started_at;
+            appendJournal({ op: "patch", id: task.id, data: { status: "queued", started_at: null } });
+        }
+        enqueueTask(task);
+    }
+    if (pending.length > 0) logger.info(`[MediaTask] recovered ${pending.length} unfinished tasks`);
+    rebuildIndexes();
+    evictFinishedTasks();
+    if (journalEntries >= JOURNAL_COMPACT_THRESHOLD) await compactJournal();
+    setInterval(() => {
+        evictFinishedTasks();
+        if (journalEntries > 0) compactJournal().catch(err => logger.error(`[MediaTask] journal compaction failed: ${err?.message || err}`));
+    }, JOURNAL_COMPACT_INTERVAL).unref();
+}
+
+async function ensureStore() {
+    if (!storeReady) storeReady = loadStore();
+    await storeReady;
+}
+
+/**
+ * 追加一条状态变更，同一事件循环内的多条记录合并为一次写入
+ */
+function appendJournal(record: JournalRecord): Promise<void> {
+    if (rowStorage) return persistRow(record.op === "put" ? record.task.id : record.id);
+    journalBuffer.push(JSON.stringify(record) + "\n");
+    journalEntries++;
+    if (!journalFlush) {
+        journalFlush = new Promise<void>(resolve => setImmediate(resolve)).then(() => {
+            const chunk = journalBuffer.join("");
+            journalBuffer = [];
+            journalFlush = null;
+            writeChain = writeChain
+                .then(() => fs.appendFile(JOURNAL_FILE, chunk))
+                .catch(err => logger.error(`[MediaTask] journal write failed: ${err?.message || err}`));
+            return writeChain;
+        });
+    }
+    return journalFlush.then(() => {
+        if (journalEntries >= JOURNAL_COMPACT_THRESHOLD) compactJournal();
+    });
+}
+
+/**
+ * SQLite 后端：记录变更的任务，同一事件循环内合并为一次事务写入当前状态
+ */
+function persistRow(id: string): Promise<void> {
+    dirtyRows.add(id);
+    if (!rowFlush) {
+        rowFlush = new Promise<void>(resolve => setImmediate(resolve)).then(() => {
+            const rows = [...dirtyRows].map(id => [id, tasks?.[id] || null] as [string, any]);
+            dirtyRows.clear();
+            rowFlush = null;
+            writeChain = writeChain
+                .then(() => rowStorage!.putRows(TASKS_COLLECTION, rows))
+                .catch(err => logger.error(`[MediaTask] task rows write failed: ${err?.message || err}`));
+            return writeChain;
+        });
+    }
+    return rowFlush;
+}
+
+/**
+ * 将当前状态写入快照并清空日志（SQLite 后端为整体同步任务集合）
+ */
+function compactJournal(): Promise<void> {
+    journalEntries = 0;
+    if (rowStorage) {
+        const backend = rowStorage;
+        writeChain = writeChain
+            .then(() => backend.saveCollection(TASKS_COLLECTION, Object.values(tasks || {}), task => task.id))
+            .catch(err => logger.error(`[MediaTask] task rows sync failed: ${err?.message || err}`));
+        return writeChain;
     }
+    writeChain = writeChain
+        .then(async () => {
+            const tmpFile = `${TASKS_FILE}.tmp`;
+            await fs.writeFile(tmpFile, JSON.stringify(tasks || {}));
+            await fs.rename(tmpFile, TASKS_FILE);
+            await fs.writeFile(JOURNAL_FILE, "");
+        })
+        .catch(err => logger.error(`[MediaTask] journal compaction failed: ${err?.message || err}`));
+    return writeChain;
 }
 
-async function saveTasks() {
+function hasPendingCallback(task: MediaTask) {
+    return !!task.callback_url && !task.callback_delivered_at && !task.callback_error;
+}
+
+/**
+ * 移除任务记录，释放旁路文件与媒体文件引用
+ */
+function evictTask(task: MediaTask) {
+    unindexTask(task);
+    delete tasks![task.id];
+    taskCredentials.delete(task.id);
+    releaseBlob(task.request_ref);
+    releaseBlob(task.result_ref);
+    task.media.forEach(item => mediaStore.release(item.sha256));
+    appendJournal({ op: "delete", id: task.id });
+}
+
+/**
+ * 已结束任务数超过上限时从最早创建的开始移除（回调尚未送达的任务保留）
+ *
+ * @returns 移除的任务数
+ */
+function enforceFinishedLimit() {
+    const limit = config.system.mediaTaskMaxFinished;
+    if (!tasks || !(limit > 0)) return 0;
+    const succeeded = indexes.get("status:succeeded") || [];
+    const failed = indexes.get("status:failed") || [];
+    const excess = succeeded.length + failed.length - limit;
+    if (excess <= 0) return 0;
+    // 合并两个按创建时间升序的状态索引，先收集再移除（移除会修改索引）
+    const victims: MediaTask[] = [];
+    let i = 0, j = 0;
+    while (victims.length < excess && (i < succeeded.length || j < failed.length)) {
+        const a = i < succeeded.length ? tasks[succeeded[i]] : null;
+        const b = j < failed.length ? tasks[failed[j]] : null;
+        const older = !b || (a && (a.created_at < b.created_at || (a.created_at === b.created_at && a.id < b.id)));
+        const task = older ? (i++, a!) : (j++, b!);
+        if (!hasPendingCallback(task)) victims.push(task);
+    }
+    victims.forEach(evictTask);
+    return victims.length;
+}
+
+/**
+ * 移除超过保留时长的已结束任务，并按数量上限移除最早的已结束任务
+ */
+function evictFinishedTasks() {
+    if (!tasks) return;
+    const deadline = Date.now() - config.system.mediaTaskRetention;
+    let expired = 0;
+    for (const task of Object.values(tasks)) {
+        if (task.status !== "succeeded" && task.status !== "failed") continue;
+        if (Date.parse(task.completed_at || task.created_at) > deadline) continue;
+        evictTask(task);
+        expired++;
+    }
+    if (expired > 0) logger.info(`[MediaTask] evicted ${expired} expired tasks`);
+    const overflow = enforceFinishedLimit();
+    if (overflow > 0) logger.info(`[MediaTask] evicted ${overflow} finished tasks over limit ${config.system.mediaTaskMaxFinished}`);
+}
+
+function getIndexKeys(task: MediaTask) {
+    const keys = ["all", `status:${task.status}`, `type:${task.type}`, `client:${task.client || "anonymous"}`];
+    if (task.account) keys.push(`account:${task.account}`);
+    return keys;
+}
+
+/**
+ * 在按 (created_at, id) 升序的列表中查找第一个不小于给定位置的下标
+ */
+function lowerBound(list: string[], createdAt: string, id: string) {
+    let low = 0, high = list.length;
+    while (low < high) {
+        const mid = (low + high) >> 1;
+        const task = tasks![list[mid]];
+        if (task.created_at < createdAt || (task.created_at === createdAt && task.id < id)) low = mid + 1;
+        else high = mid;
+    }
+    return low;
+}
+
+function indexAdd(key: string, task: MediaTask) {
+    let list = indexes.get(key);
+    if (!list) indexes.set(key, list = []);
+    // 新任务总是最新的，绝大多数情况直接追加
+    const last = list.length > 0 ? tasks![list[list.length - 1]] : null;
+    if (!last || last.created_at < task.created_at || (last.created_at === task.created_at && last.id < task.id)) list.push(task.id);
+    else list.splice(lowerBound(list, task.created_at, task.id), 0, task.id);
+}
+
+function indexRemove(key: string, task: MediaTask) {
+    const list = indexes.get(key);
+    if (!list) return;
+    const index = lowerBound(list, task.created_at, task.id);
+    if (list[index] === task.id) list.splice(index, 1);
+    if (list.length === 0) indexes.delete(key);
+}
+
+function indexTask(task: MediaTask) {
+    getIndexKeys(task).forEach(key => indexAdd(key, task));
+}
+
+function unindexTask(task: MediaTask) {
+    getIndexKeys(task).forEach(key => indexRemove(key, task));
+}
+
+function rebuildIndexes() {
+    indexes.clear();
+    Object.values(tasks || {})
+        .sort((a, b) => a.created_at.localeCompare(b.created_at) || a.id.localeCompare(b.id))
+        .forEach(indexTask);
+}
+
+/**
+ * 更新任务状态并同步状态索引（任务已被清理时只修改对象本身）
+ */
+function setTaskStatus(task: MediaTask, status: TaskStatus) {
+    const indexed = tasks?.[task.id] === task;
+    if (indexed) indexRemove(`status:${task.status}`, task);
+    task.status = status;
+    if (indexed) indexAdd(`status:${task.status}`, task);
+}
+
+/**
+ * 记录执行任务的账号池账号并同步账号索引
+ */
+function assignAccount(id: string, accountId: string) {
+    const task = tasks?.[id];
+    if (!task || task.account === accountId) return;
+    if (task.account) indexRemove(`account:${task.account}`, task);
+    task.account = accountId;
+    indexAdd(`account:${task.account}`, task);
+    appendJournal({ op: "patch", id, data: { account: accountId } });
+}
+
+/**
+ * 对外返回的任务视图：不含旁路引用，只浅拷贝元数据
+ */
+function projectTask(task: MediaTask): Record<string, any> {
+    const projection: Record<string, any> = {
+        id: task.id,
+        type: task.type,
+        status: task.status,
+        priority: task.priority,
+        client: task.client,
+        // 已被配额淘汰的文件标记为 evicted，其余附带下载地址
+        media: task.media.map(item =>
+            item.local_path.startsWith(STORE_PREFIX) && !mediaStore.has(item.sha256)
+                ? { ...item, evicted: true }
+                : { ...item, url: `/v1/media/files/${item.filename}` }
+        ),
+        error: task.error,
+        created_at: task.created_at,
+        started_at: task.started_at,
+        completed_at: task.completed_at,
+        callback_url: task.callback_url,
+        callback_delivered_at: task.callback_delivered_at
+    };
+    if (task.status === "queued") {
+        projection.queue_position = getQueuePosition(task);
+    }
+    return projection;
+}
+
+function compareQueueEntries(a: QueueEntry, b: QueueEntry) {
+    return b.priority - a.priority || a.vtime - b.vtime || a.seq - b.seq;
+}
+
+function getWorkerLimit(type: MediaType) {
+    const settings = AccountManager.getSettings();
+    const limit = Number(type === "image" ? settings.mediaImageWorkers : settings.mediaVideoWorkers);
+    return Number.isFinite(limit) && limit > 0 ? Math.floor(limit) : 1;
+}
+
+/**
+ * 在有序队列中查找第一个不小于给定队列项的下标
+ */
+function queueLowerBound(queue: QueueEntry[], entry: QueueEntry) {
+    let low = 0, high = queue.length;
+    while (low < high) {
+        const mid = (low + high) >> 1;
+        if (compareQueueEntries(queue[mid], entry) < 0) low = mid + 1;
+        else high = mid;
+    }
+    return low;
+}
+
+/**
+ * 排队位置：队列按 (优先级, 虚拟时间, 提交顺序) 全序排列，由队列项二分定位
+ */
+function getQueuePosition(task: MediaTask) {
+    const entry = queuedEntries.get(task.id);
+    if (!entry) return null;
+    const index = queueLowerBound(queues[task.type], entry);
+    return queues[task.type][index] === entry ? index + 1 : null;
+}
+
+/**
+ * 入队：同优先级内按客户端虚拟时间轮转，避免单个客户端的突发请求占满队列
+ */
+function enqueueTask(task: MediaTask) {
+    const clientKey = `${task.type}:${task.client || "anonymous"}`;
+    const vtime = Math.max(dispatchedVtime[task.type], clientVtime.get(clientKey) || 0) + 1;
+    clientVtime.set(clientKey, vtime);
+    const entry: QueueEntry = { id: task.id, priority: task.priority || 0, vtime, seq: ++queueSeq };
+    // 二分插入保持有序（seq 唯一，不存在相等的队列项）
+    queues[task.type].splice(queueLowerBound(queues[task.type], entry), 0, entry);
+    queuedEntries.set(task.id, entry);
+}
+
+/**
+ * 在工作线程空闲时从队列取出任务执行
+ */
+function dispatch(type: MediaType) {
+    const queue = queues[type];
+    while (!draining && activeWorkers[type] < getWorkerLimit(type) && queue.length > 0) {
+        const entry = queue.shift()!;
+        queuedEntries.delete(entry.id);
+        dispatchedVtime[type] = Math.max(dispatchedVtime[type], entry.vtime);
+        activeWorkers[type]++;
+        // 每个任务执行作为独立追踪，超过慢请求阈值时写入追踪文件
+        const trace = tracing.start(`media-task ${type}`, { task_id: entry.id });
+        tracing.run(trace, () => runTask(entry.id))
+            .catch(err => logger.error(`[MediaTask] runner crashed: ${err?.stack || err}`))
+            .finally(() => {
+                tracing.end(trace);
+                activeWorkers[type]--;
+                dispatch(type);
+            });
+    }
+    if (queue.length === 0) {
+        // 队列清空后重置虚拟时间，防止客户端记录无限增长
+        for (const key of clientVtime.keys()) {
+            if (key.startsWith(`${type}:`)) clientVtime.delete(key);
+        }
+    }
+}
+
+/**
+ * 注册任务执行器；模块导入时不加载存储，启动阶段完成后才开始消费队列
+ */
+function registerExecutor(type: MediaType, factory: TaskExecutorFactory) {
+    executorFactories[type] = factory;
+    if (initialized) dispatch(type);
+}
+
+/**
+ * 启动阶段：加载存储（恢复上次未完成的任务）后开始消费已注册执行器的队列；
+ * 集群 worker 将异步任务路由转发给主进程，不调用此方法
+ */
+async function init() {
     await ensureStore();
-    saveQueue = saveQueue.then(() => fs.writeJson(TASKS_FILE, tasks || {}, { spaces: 2 }));
-    await saveQueue;
+    initialized = true;
+    (Object.keys(executorFactories) as MediaType[]).forEach(dispatch);
 }
 
-function cloneTask(task: MediaTask) {
-    return JSON.parse(JSON.stringify(task));
+/**
+ * 停止派发新任务，等待运行中的任务结束（最多 timeout 毫秒）后写入全部任务状态；
+ * 仍在运行的任务保存为 running，下次启动时重新排队执行
+ */
+async function drain(timeout: number) {
+    draining = true;
+    const deadline = Date.now() + timeout;
+    while (activeWorkers.image + activeWorkers.video > 0 && Date.now() < deadline)
+        await new Promise(resolve => setTimeout(resolve, 200));
+    const running = activeWorkers.image + activeWorkers.video;
+    if (running > 0) logger.warn(`[MediaTask] ${running} tasks still running at drain deadline, will resume after restart`);
+    if (tasks) await compactJournal();
+    else await writeChain;
 }
 
 function getMessage(result: any) {
@@ -99,136 +752,300 @@ function inferExtension(url: string, contentType?: string, fallback = "bin") {
     return fallback;
 }
 
-async function saveDataUri(dataUri: string, taskId: string, index: number, type: MediaType): Promise<LocalMediaItem> {
+async function saveDataUri(dataUri: string, type: MediaType): Promise<LocalMediaItem> {
     const match = dataUri.match(/^data:([^;]+);base64,(.+)$/);
     if (!match) throw new Error("Invalid base64 media data");
     const mimeType = match[1];
     const buffer = Buffer.from(match[2], "base64");
-    const ext = inferExtension(dataUri, mimeType, type === "image" ? "png" : "mp4");
-    const filename = `${taskId}-${index + 1}.${ext}`;
-    const dir = type === "image" ? IMAGE_DIR : VIDEO_DIR;
-    const filePath = path.join(dir, filename);
-    await fs.writeFile(filePath, buffer);
+    const entry = await mediaStore.ingestBuffer(buffer, {
+        sha256: crypto.createHash("sha256").update(buffer).digest("hex"),
+        size: buffer.length,
+        ext: inferExtension(dataUri, mimeType, type === "image" ? "png" : "mp4"),
+        mime_type: mimeType
+    });
     return {
         type,
         source_url: "data-uri",
-        local_path: path.relative(process.cwd(), filePath).replace(/\\/g, "/"),
-        filename,
-        size: buffer.length,
-        mime_type: mimeType
+        local_path: entry.local_path,
+        filename: entry.filename,
+        size: entry.size,
+        mime_type: mimeType,
+        sha256: entry.sha256
     };
 }
 
+/**
+ * 下载结果文件并存入内容寻址存储，相同内容只保存一份
+ */
 async function downloadMedia(url: string, taskId: string, index: number, type: MediaType): Promise<LocalMediaItem> {
     if (url.startsWith("data:")) {
-        return saveDataUri(url, taskId, index, type);
+        return saveDataUri(url, type);
     }
 
-    const response = await axios.get(url, {
-        responseType: "arraybuffer",
-        timeout: 120000,
-        maxContentLength: 1024 * 1024 * 1024,
-        headers: {
-            "User-Agent": "Mozilla/5.0",
-            "Accept": type === "image" ? "image/*,*/*;q=0.8" : "video/*,*/*;q=0.8"
-        }
+    const partPath = await mediaStore.getTempPath(`${taskId}-${index + 1}`);
+    const { size, sha256, contentType } = await mediaDownloader.download(url, partPath, {
+        accept: type === "image" ? "image/*,*/*;q=0.8" : "video/*,*/*;q=0.8"
+    });
+    const entry = await mediaStore.ingest(partPath, {
+        sha256,
+        size,
+        ext: inferExtension(url, contentType, type === "image" ? "png" : "mp4"),
+        mime_type: contentType
     });
-    const contentType = response.headers?.["content-type"];
-    const buffer = Buffer.from(response.data);
-    const ext = inferExtension(url, contentType, type === "image" ? "png" : "mp4");
-    const filename = `${taskId}-${index + 1}.${ext}`;
-    const dir = type === "image" ? IMAGE_DIR : VIDEO_DIR;
-    const filePath = path.join(dir, filename);
-    await fs.writeFile(filePath, buffer);
     return {
         type,
         source_url: url,
-        local_path: path.relative(process.cwd(), filePath).replace(/\\/g, "/"),
-        filename,
-        size: buffer.length,
-        mime_type: contentType
+        local_path: entry.local_path,
+        filename: entry.filename,
+        size,
+        mime_type: contentType,
+        sha256
     };
 }
 
-async function runTask(taskId: string, executor: () => Promise<any>) {
+async function runTask(taskId: string) {
     await ensureStore();
     const task = tasks?.[taskId];
     if (!task) return;
+    const factory = executorFactories[task.type];
+    const auth = taskCredentials.get(task.id);
 
-    task.status = "running";
+    setTaskStatus(task, "running");
     task.started_at = new Date().toISOString();
-    await saveTasks();
+    await appendJournal({ op: "patch", id: task.id, data: { status: task.status, started_at: task.started_at } });
+    events.emit("update", task);
 
     try {
-        const result = await executor();
+        if (!factory) throw new Error(`No executor registered for ${task.type} tasks`);
+        if (!task.pooled && !auth) throw new Error("Task credentials are not retained across restarts, please resubmit the task");
+        const request = await readBlob(task.request_ref);
+        const result = await factory(task, request, auth)();
         const sources = extractMediaSources(task.type, result);
-        const media = await Promise.all(
-            sources.map((source, index) => downloadMedia(source.url, task.id, index, source.type))
+        const settled = await Promise.allSettled(
+            sources.map((source, index) => tracing.span("download", () => downloadMedia(source.url, task.id, index, source.type)))
         );
+        const media = settled.flatMap(item => item.status === "fulfilled" ? [item.value] : []);
+        const failure = settled.find(item => item.status === "rejected") as PromiseRejectedResult | undefined;
+        if (failure) {
+            // 部分文件失败时释放已入库文件的引用
+            media.forEach(item => mediaStore.release(item.sha256));
+            throw failure.reason;
+        }
 
-        task.status = "succeeded";
-        task.result = result;
+        const resultRef = await putBlob(result);
+        // 执行期间任务可能已被清理
+        if (tasks?.[task.id] !== task) {
+            releaseBlob(resultRef);
+            media.forEach(item => mediaStore.release(item.sha256));
+            return;
+        }
+        setTaskStatus(task, "succeeded");
+        task.result_ref = resultRef;
         task.media = media;
         task.completed_at = new Date().toISOString();
-        await saveTasks();
+        await appendJournal({
+            op: "patch",
+            id: task.id,
+            data: { status: task.status, result_ref: task.result_ref, media: task.media, completed_at: task.completed_at }
+        });
+        events.emit("update", task, result);
+        enforceFinishedLimit();
         logger.success(`[MediaTask] ${task.id} completed, files=${media.length}`);
     } catch (err: any) {
-        task.status = "failed";
+        setTaskStatus(task, "failed");
         task.error = err?.message || String(err);
         task.completed_at = new Date().toISOString();
-        await saveTasks();
+        await appendJournal({ op: "patch", id: task.id, data: { status: task.status, error: task.error, completed_at: task.completed_at } });
+        events.emit("update", task);
+        enforceFinishedLimit();
         logger.error(`[MediaTask] ${task.id} failed: ${task.error}`);
+    } finally {
+        // 任务结束后不再需要凭据
+        taskCredentials.delete(task.id);
     }
 }
 
-async function createTask(type: MediaType, requestBody: any, executor: () => Promise<any>) {
+async function createTask(type: MediaType, requestBody: any, options: CreateTaskOptions = {}) {
     await ensureStore();
     const id = `media-${Date.now()}-${util.generateRandomString({ length: 8, charset: "alphanumeric" }).toLowerCase()}`;
+    const priority = Number(options.priority);
+    const requestRef = await putBlob(requestBody);
     const task: MediaTask = {
         id,
         type,
         status: "queued",
-        request: requestBody,
+        priority: Number.isFinite(priority) ? Math.min(MAX_PRIORITY, Math.max(MIN_PRIORITY, Math.round(priority))) : 0,
+        client: options.client,
+        pooled: options.pooled || undefined,
+        request_ref: requestRef,
         media: [],
-        created_at: new Date().toISOString()
+        created_at: new Date().toISOString(),
+        callback_url: options.callback_url
     };
     tasks![id] = task;
-    await saveTasks();
+    if (!task.pooled && options.auth) taskCredentials.set(id, options.auth);
+    indexTask(task);
+    await appendJournal({ op: "put", task });
 
-    setImmediate(() => {
-        runTask(id, executor).catch(err => logger.error(`[MediaTask] runner crashed: ${err?.stack || err}`));
-    });
+    enqueueTask(task);
+    const projection = projectTask(task);
+    setImmediate(() => dispatch(type));
+    return projection;
+}
 
-    return cloneTask(task);
+/**
+ * 查询任务，默认只返回元数据；include 可指定附带 request / result（从旁路文件读取）
+ */
+async function getTask(id: string, include: string[] = []) {
+    await ensureStore();
+    const task = tasks?.[id];
+    if (!task) return null;
+    const projection = projectTask(task);
+    const refs = { request: task.request_ref, result: task.result_ref };
+    for (const field of Object.keys(refs) as (keyof typeof refs)[]) {
+        if (!include.includes(field)) continue;
+        projection[field] = await readBlob(refs[field]).catch(err => {
+            logger.warn(`[MediaTask] ${task.id} ${field} blob unavailable: ${err?.message || err}`);
+            return null;
+        });
+    }
+    return projection;
 }
 
-async function getTask(id: string) {
+/**
+ * 更新任务的附加状态（如回调投递进度）并写入日志
+ */
+async function patchTask(id: string, data: Pick<MediaTask, "callback_delivered_at" | "callback_attempts" | "callback_error">) {
     await ensureStore();
     const task = tasks?.[id];
-    return task ? cloneTask(task) : null;
+    if (!task) return;
+    Object.assign(task, data);
+    await appendJournal({ op: "patch", id, data });
+}
+
+/**
+ * 已结束但回调尚未送达（且未放弃）的任务，用于重启后继续投递
+ */
+async function getPendingCallbacks() {
+    await ensureStore();
+    return Object.values(tasks || {})
+        .filter(hasPendingCallback)
+        .filter(task => task.status === "succeeded" || task.status === "failed")
+        .map(task => ({ task: projectTask(task), attempts: task.callback_attempts || 0 }));
+}
+
+function encodeCursor(task: MediaTask) {
+    return Buffer.from(JSON.stringify([task.created_at, task.id])).toString("base64url");
+}
+
+function decodeCursor(cursor: string): [string, string] | null {
+    const value = util.ignoreJSONParse(Buffer.from(cursor, "base64url").toString());
+    return Array.isArray(value) && value.length === 2 && value.every(item => typeof item === "string") ? value as [string, string] : null;
+}
+
+/**
+ * 按创建时间倒序列出任务
+ *
+ * 从各筛选条件对应的索引中选取最短的一条，二分定位时间上界（或游标）后向前遍历，
+ * 其余条件逐条校验，不扫描全部任务。
+ */
+async function listTasks(options: ListTasksOptions = {}) {
+    await ensureStore();
+    const keys = [
+        options.status && `status:${options.status}`,
+        options.type && `type:${options.type}`,
+        options.client && `client:${options.client}`,
+        options.account && `account:${options.account}`
+    ].filter(Boolean) as string[];
+    const lists = keys.map(key => indexes.get(key) || []);
+    const list = lists.length > 0 ? lists.reduce((a, b) => a.length <= b.length ? a : b) : (indexes.get("all") || []);
+    const limit = Math.min(MAX_LIST_LIMIT, Math.max(1, Math.floor(Number(options.limit)) || 20));
+
+    let end = list.length;
+    if (options.created_before) end = Math.min(end, lowerBound(list, options.created_before, ""));
+    if (options.cursor) {
+        const cursor = decodeCursor(options.cursor);
+        if (!cursor) throw new Error("Invalid cursor");
+        end = Math.min(end, lowerBound(list, cursor[0], cursor[1]));
+    }
+
+    const data: Record<string, any>[] = [];
+    let last: MediaTask | null = null;
+    let hasMore = false;
+    for (let i = end - 1; i >= 0; i--) {
+        const task = tasks![list[i]];
+        if (options.created_after && task.created_at < options.created_after) break;
+        if (options.status && task.status !== options.status) continue;
+        if (options.type && task.type !== options.type) continue;
+        if (options.client && (task.client || "anonymous") !== options.client) continue;
+        if (options.account && task.account !== options.account) continue;
+        if (data.length === limit) {
+            hasMore = true;
+            break;
+        }
+        data.push(projectTask(task));
+        last = task;
+    }
+    return {
+        data,
+        has_more: hasMore,
+        next_cursor: hasMore && last ? encodeCursor(last) : null
+    };
+}
+
+function getQueueStats() {
+    return (["image", "video"] as MediaType[]).reduce((stats, type) => ({
+        ...stats,
+        [type]: { queued: queues[type].length, running: activeWorkers[type], workers: getWorkerLimit(type) }
+    }), {} as Record<MediaType, { queued: number; running: number; workers: number }>);
 }
 
 async function clearLocalMedia() {
     await ensureStore();
     await fs.emptyDir(IMAGE_DIR);
     await fs.emptyDir(VIDEO_DIR);
+    await fs.emptyDir(BLOB_DIR);
+    await mediaStore.clear();
+    blobRefs.clear();
+    blobCache.clear();
+    blobCacheBytes = 0;
+    queues.image.length = 0;
+    queues.video.length = 0;
+    taskCredentials.clear();
     tasks = {};
-    await saveTasks();
+    indexes.clear();
+    await compactJournal();
     return {
         images_dir: path.relative(process.cwd(), IMAGE_DIR).replace(/\\/g, "/"),
         videos_dir: path.relative(process.cwd(), VIDEO_DIR).replace(/\\/g, "/"),
-        tasks_file: path.relative(process.cwd(), TASKS_FILE).replace(/\\/g, "/")
+        tasks_file: path.relative(process.cwd(), TASKS_FILE).replace(/\\/g, "/"),
+        journal_file: path.relative(process.cwd(), JOURNAL_FILE).replace(/\\/g, "/"),
+        blobs_dir: path.relative(process.cwd(), BLOB_DIR).replace(/\\/g, "/"),
+        store_dir: STORE_PREFIX.slice(0, -1)
     };
 }
 
 export default {
     createTask,
     getTask,
+    listTasks,
+    patchTask,
+    assignAccount,
+    getPendingCallbacks,
+    project: projectTask,
+    getQueueStats,
+    getWorkerLimit,
+    registerExecutor,
     clearLocalMedia,
+    drain,
+    init,
+    events,
     paths: {
         mediaDir: MEDIA_DIR,
         imageDir: IMAGE_DIR,
         videoDir: VIDEO_DIR,
-        tasksFile: TASKS_FILE
+        tasksFile: TASKS_FILE,
+        journalFile: JOURNAL_FILE,
+        blobDir: BLOB_DIR
     }
 };
@@ -0,0 +1,251 @@
+import crypto from "crypto";
+import dns from "dns";
+import http from "http";
+import https from "https";
+import net from "net";
+import { PassThrough } from "stream";
+import axios from "axios";
+
+import config from "@/lib/config.ts";
+import logger from "@/lib/logger.ts";
+import util from "@/lib/util.ts";
+import AccountManager from "@/lib/account-manager.ts";
+import mediaTaskManager, { MediaTask } from "@/lib/media-task-manager.ts";
+
+// 回调最大尝试次数
+const CALLBACK_ATTEMPTS = 8;
+// 回调首次重试间隔，之后按 3 倍递增
+const CALLBACK_RETRY_BASE = 5000;
+// 回调重试间隔上限
+const CALLBACK_RETRY_MAX = 30 * 60 * 1000;
+const CALLBACK_TIMEOUT = 10000;
+// 单个 SSE 连接最多订阅的任务数
+const MAX_STREAM_TASKS = 100;
+// SSE 心跳间隔，防止代理断开空闲连接
+const HEARTBEAT_INTERVAL = 15000;
+
+// 正在投递或等待重试的任务，避免重复投递
+const deliveries = new Set<string>();
+let secretGeneration: Promise<string> | null = null;
+
+// 回调禁止访问的地址段：本机、内网、链路本地（含云平台元数据地址）、CGNAT、组播与保留地址
+const blockedAddresses = new net.BlockList();
+[
+    ["0.0.0.0", 8], ["10.0.0.0", 8], ["100.64.0.0", 10], ["127.0.0.0", 8], ["169.254.0.0", 16], ["172.16.0.0", 12],
+    ["192.0.0.0", 24], ["192.168.0.0", 16], ["198.18.0.0", 15], ["224.0.0.0", 4], ["240.0.0.0", 4]
+].forEach(([address, prefix]) => blockedAddresses.addSubnet(address as string, prefix as number, "ipv4"));
+[
+    ["::", 128], ["::1", 128], ["fc00::", 7], ["fe80::", 10], ["ff00::", 8]
+].forEach(([address, prefix]) => blockedAddresses.addSubnet(address as string, prefix as number, "ipv6"));
+
+function isBlockedAddress(address: string) {
+    const family = net.isIP(address);
+    return family === 0 || blockedAddresses.check(address, family === 6 ? "ipv6" : "ipv4");
+}
+
+/**
+ * 是否为 callbackAllowedHosts 中允许访问内网地址的主机
+ */
+function isAllowedHost(hostname: string) {
+    const allowed: string[] = config.system.callbackAllowedHosts || [];
+    return allowed.some(host => host.toLowerCase() === hostname.toLowerCase());
+}
+
+/**
+ * 连接时解析域名并校验全部地址，校验通过的地址直接用于连接，避免校验后 DNS 结果变化（DNS rebinding）
+ */
+function safeLookup(hostname: string, options: any, callback: (...args: any[]) => void) {
+    dns.lookup(hostname, { ...options, all: true }, (err, addresses: dns.LookupAddress[]) => {
+        if (err) return callback(err);
+        if (!isAllowedHost(hostname) && addresses.some(item => isBlockedAddress(item.address)))
+            return callback(new Error(`Callback host ${hostname} resolves to a private address`));
+        if (options?.all) return callback(null, addresses);
+        callback(null, addresses[0].address, addresses[0].family);
+    });
+}
+
+const callbackClient = axios.create({
+    httpAgent: new http.Agent({ lookup: safeLookup } as any),
+    httpsAgent: new https.Agent({ lookup: safeLookup } as any),
+    timeout: CALLBACK_TIMEOUT,
+    maxRedirects: 0,
+    proxy: false
+});
+
+function isFinished(status: string) {
+    return status === "succeeded" || status === "failed";
+}
+
+/**
+ * 获取签名密钥，未设置时生成；并发的首次投递共用同一次生成，避免各自生成不同的密钥
+ */
+async function getWebhookSecret() {
+    const secret = AccountManager.getSettings().mediaWebhookSecret;
+    if (secret) return secret;
+    if (!secretGeneration) {
+        const generated = util.generateRandomString({ length: 32, charset: "alphanumeric" });
+        secretGeneration = AccountManager.saveSettings({ mediaWebhookSecret: generated })
+            .then(() => {
+                logger.info("[MediaNotify] webhook secret generated");
+                return generated;
+            })
+            .finally(() => {
+                secretGeneration = null;
+            });
+    }
+    return secretGeneration;
+}
+
+/**
+ * 签名：HMAC-SHA256(secret, `${timestamp}.${body}`)
+ */
+function sign(secret: string, timestamp: number, body: string) {
+    return crypto.createHmac("sha256", secret).update(`${timestamp}.${body}`).digest("hex");
+}
+
+/**
+ * 投递回调，失败后按指数退避重试，投递状态写入任务记录以便重启后继续
+ */
+async function deliver(task: Record<string, any>, attempts = 0) {
+    if (deliveries.has(task.id)) return;
+    deliveries.add(task.id);
+    const body = JSON.stringify({ event: `task.${task.status}`, task });
+    try {
+        while (attempts < CALLBACK_ATTEMPTS) {
+            attempts++;
+            try {
+                // 创建任务后配置可能已变化，投递前重新校验（域名在连接时由 safeLookup 校验）
+                if (!isValidCallbackUrl(task.callback_url)) {
+                    await mediaTaskManager.patchTask(task.id, { callback_attempts: attempts, callback_error: "Callback URL not allowed" });
+                    logger.error(`[MediaNotify] ${task.id} callback rejected: URL not allowed`);
+                    return;
+                }
+                const timestamp = Math.floor(Date.now() / 1000);
+                const signature = sign(await getWebhookSecret(), timestamp, body);
+                await callbackClient.post(task.callback_url, body, {
+                    headers: {
+                        "Content-Type": "application/json",
+                        "User-Agent": "doubao-free-api-webhook",
+                        "X-Webhook-Id": task.id,
+                        "X-Webhook-Signature": `t=${timestamp},v1=${signature}`
+                    },
+                    validateStatus: status => status >= 200 && status < 300
+                });
+                await mediaTaskManager.patchTask(task.id, { callback_attempts: attempts, callback_delivered_at: new Date().toISOString() });
+                logger.info(`[MediaNotify] ${task.id} callback delivered, attempts=${attempts}`);
+                return;
+            } catch (err: any) {
+                const message = err?.response ? `HTTP ${err.response.status}` : (err?.message || String(err));
+                if (attempts >= CALLBACK_ATTEMPTS) {
+                    await mediaTaskManager.patchTask(task.id, { callback_attempts: attempts, callback_error: message });
+                    logger.error(`[MediaNotify] ${task.id} callback abandoned after ${attempts} attempts: ${message}`);
+                    return;
+                }
+                await mediaTaskManager.patchTask(task.id, { callback_attempts: attempts });
+                const delay = Math.min(CALLBACK_RETRY_MAX, CALLBACK_RETRY_BASE * 3 ** (attempts - 1));
+                logger.warn(`[MediaNotify] ${task.id} callback failed (${message}), retry in ${Math.round(delay / 1000)}s`);
+                await new Promise(resolve => setTimeout(resolve, delay).unref());
+            }
+        }
+    } finally {
+        deliveries.delete(task.id);
+    }
+}
+
+mediaTaskManager.events.on("update", (task: MediaTask) => {
+    if (!task.callback_url || !isFinished(task.status)) return;
+    deliver(mediaTaskManager.project(task))
+        .catch(err => logger.error(`[MediaNotify] ${task.id} callback crashed: ${err?.stack || err}`));
+});
+
+/**
+ * 重启后继续投递未送达的回调，由启动阶段调用（集群模式下异步任务只在主进程中运行）；
+ * 投递在后台进行，不阻塞启动
+ */
+async function resumePendingCallbacks() {
+    const pending = await mediaTaskManager.getPendingCallbacks();
+    pending.forEach(({ task, attempts }) => deliver(task, attempts)
+        .catch(err => logger.error(`[MediaNotify] ${task.id} callback crashed: ${err?.stack || err}`)));
+    if (pending.length > 0) logger.info(`[MediaNotify] resuming ${pending.length} pending callbacks`);
+}
+
+/**
+ * 校验回调地址（不解析域名）：仅允许 http / https，IP 地址形式的主机不能是内网、本机或链路本地地址
+ */
+function isValidCallbackUrl(value: any) {
+    if (typeof value !== "string") return false;
+    try {
+        const url = new URL(value);
+        if (!["http:", "https:"].includes(url.protocol)) return false;
+        const hostname = url.hostname.replace(/^\[|\]$/g, "");
+        if (isAllowedHost(hostname)) return true;
+        return !net.isIP(hostname) || !isBlockedAddress(hostname);
+    } catch {
+        return false;
+    }
+}
+
+/**
+ * 解析回调地址的域名并校验全部地址，用于创建任务时提前拒绝
+ *
+ * @returns 不允许时的原因，允许时为 null
+ */
+async function checkCallbackUrl(value: string): Promise<string | null> {
+    if (!isValidCallbackUrl(value)) return "callback_url must be a public http(s) URL";
+    const hostname = new URL(value).hostname.replace(/^\[|\]$/g, "");
+    if (net.isIP(hostname) || isAllowedHost(hostname)) return null;
+    const addresses = await dns.promises.lookup(hostname, { all: true }).catch(() => null);
+    if (!addresses || addresses.length === 0) return `callback_url host ${hostname} cannot be resolved`;
+    if (addresses.some(item => isBlockedAddress(item.address))) return `callback_url host ${hostname} resolves to a private address`;
+    return null;
+}
+
+/**
+ * 创建任务状态 SSE 流：先推送当前状态，之后推送每次状态变化，全部任务结束后发送 done 并关闭
+ */
+async function createEventStream(ids: string[]) {
+    ids = [...new Set(ids)].slice(0, MAX_STREAM_TASKS);
+    const stream = new PassThrough();
+    const pending = new Set(ids);
+    const write = (event: string, data: any) => !stream.destroyed && stream.write(`event: ${event}\ndata: ${JSON.stringify(data)}\n\n`);
+    const heartbeat = setInterval(() => !stream.destroyed && stream.write(": ping\n\n"), HEARTBEAT_INTERVAL);
+    const cleanup = () => {
+        clearInterval(heartbeat);
+        mediaTaskManager.events.off("update", onUpdate);
+    };
+    const settle = (id: string) => {
+        pending.delete(id);
+        if (pending.size > 0) return;
+        write("done", { task_ids: ids });
+        cleanup();
+        stream.end();
+    };
+    const onUpdate = (task: MediaTask) => {
+        if (!pending.has(task.id)) return;
+        write("task", mediaTaskManager.project(task));
+        if (isFinished(task.status)) settle(task.id);
+    };
+    // 先订阅再读取快照，避免遗漏期间的状态变化
+    mediaTaskManager.events.on("update", onUpdate);
+    stream.once("close", cleanup);
+
+    for (const id of ids) {
+        const task = await mediaTaskManager.getTask(id);
+        if (!pending.has(id)) continue;
+        if (!task) {
+            write("error", { task_id: id, message: "Task not found" });
+            settle(id);
+            continue;
+        }
+        write("task", task);
+        if (isFinished(task.status)) settle(id);
+    }
+    return stream;
+}
+
+export default {
+    resumePendingCallbacks,
+    createEventStream,
+    isValidCallbackUrl,
+    checkCallbackUrl
+};
@@ -0,0 +1,257 @@
+import { monitorEventLoopDelay } from "perf_hooks";
+
+// 单个指标的标签组合上限，超出后丢弃新组合，防止用户输入（如模型名）导致序列膨胀
+const MAX_SERIES = 2000;
+// 耗时直方图分桶（秒）
+const DURATION_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300];
+// 首 token 时间分桶（秒）
+const TTFT_BUCKETS = [0.1, 0.25, 0.5, 1, 2, 3, 5, 8, 13, 20, 30, 60];
+
+type Labels = Record<string, string | number>;
+
+export interface MetricSnapshot {
+    name: string;
+    help: string;
+    type: "counter" | "gauge" | "histogram";
+    buckets?: number[];
+    /** [标签, 值]，直方图的值为 [各桶累计计数..., 总计数（+Inf）, sum] */
+    series: [Labels, number | number[]][];
+}
+
+function labelKey(labels: Labels) {
+    let key = "";
+    for (const name in labels) key += `${name}=${labels[name]},`;
+    return key;
+}
+
+abstract class Metric<T> {
+
+    protected series = new Map<string, { labels: Labels; value: T }>();
+
+    constructor(public name: string, public help: string) {
+        metrics.push(this);
+    }
+
+    protected get(labels: Labels, create: () => T) {
+        const key = labelKey(labels);
+        let entry = this.series.get(key);
+        if (!entry) {
+            if (this.series.size >= MAX_SERIES) {
+                seriesDropped.inc();
+                return null;
+            }
+            entry = { labels: { ...labels }, value: create() };
+            this.series.set(key, entry);
+        }
+        return entry;
+    }
+
+    abstract snapshot(): MetricSnapshot;
+
+}
+
+export class Counter extends Metric<number> {
+
+    inc(labels: Labels = {}, value = 1) {
+        const entry = this.get(labels, () => 0);
+        if (entry) entry.value += value;
+    }
+
+    snapshot(): MetricSnapshot {
+        return { name: this.name, help: this.help, type: "counter", series: [...this.series.values()].map(({ labels, value }) => [labels, value]) };
+    }
+
+}
+
+export class Gauge extends Metric<number> {
+
+    /**
+     * @param collect 抓取时调用，用于按当前状态重建序列
+     */
+    constructor(name: string, help: string, private collect?: (gauge: Gauge) => void) {
+        super(name, help);
+    }
+
+    set(labels: Labels, value: number) {
+        const entry = this.get(labels, () => 0);
+        if (entry) entry.value = value;
+    }
+
+    snapshot(): MetricSnapshot {
+        if (this.collect) {
+            this.series.clear();
+            this.collect(this);
+        }
+        return { name: this.name, help: this.help, type: "gauge", series: [...this.series.values()].map(({ labels, value }) => [labels, value]) };
+    }
+
+}
+
+export class Histogram extends Metric<Float64Array> {
+
+    constructor(name: string, help: string, private buckets: number[] = DURATION_BUCKETS) {
+        super(name, help);
+    }
+
+    /**
+     * 记录观测值；值数组布局为 [各桶计数..., +Inf 计数, sum]
+     */
+    observe(labels: Labels, value: number) {
+        const entry = this.get(labels, () => new Float64Array(this.buckets.length + 2));
+        if (!entry) return;
+        const counts = entry.value;
+        let i = 0;
+        while (i < this.buckets.length && value > this.buckets[i]) i++;
+        counts[i]++;
+        counts[this.buckets.length + 1] += value;
+    }
+
+    /**
+     * 开始计时，返回的函数在结束时调用并记录耗时（秒）
+     */
+    startTimer(labels: Labels = {}) {
+        const started = performance.now();
+        return (extra: Labels = {}) => this.observe({ ...labels, ...extra }, (performance.now() - started) / 1000);
+    }
+
+    snapshot(): MetricSnapshot {
+        const bucketCount = this.buckets.length;
+        return {
+            name: this.name,
+            help: this.help,
+            type: "histogram",
+            buckets: this.buckets,
+            series: [...this.series.values()].map(({ labels, value }) => {
+                // 转换为累计计数
+                const cumulative: number[] = [];
+                let total = 0;
+                for (let i = 0; i <= bucketCount; i++) cumulative.push(total += value[i]);
+                return [labels, [...cumulative, value[bucketCount + 1]]];
+            })
+        };
+    }
+
+}
+
+const metrics: Metric<any>[] = [];
+
+const eventLoopDelay = monitorEventLoopDelay({ resolution: 20 });
+eventLoopDelay.enable();
+
+const requests = new Counter("http_requests_total", "HTTP requests by route, method, status and model");
+const requestDuration = new Histogram("http_request_duration_seconds", "HTTP request duration (until the response ends, including streams)");
+const timeToFirstToken = new Histogram("sse_time_to_first_token_seconds", "Time from request start to the first SSE chunk", TTFT_BUCKETS);
+const poolWait = new Histogram("account_pool_wait_seconds", "Time spent waiting in acquireToken by request type");
+const accountErrors = new Counter("account_errors_total", "Upstream errors that triggered a response policy, by account and status");
+const upstreamResponses = new Counter("upstream_responses_total", "Upstream HTTP responses by endpoint and status");
+const uploadDuration = new Histogram("upload_duration_seconds", "Reference file upload duration by outcome");
+const pollDuration = new Histogram("poll_duration_seconds", "Image/video result polling duration by type and outcome");
+new Gauge("nodejs_eventloop_lag_seconds", "Event loop delay since the previous scrape", gauge => {
+    gauge.set({ quantile: "0.5" }, eventLoopDelay.percentile(50) / 1e9);
+    gauge.set({ quantile: "0.99" }, eventLoopDelay.percentile(99) / 1e9);
+    gauge.set({ quantile: "1" }, eventLoopDelay.max / 1e9);
+    eventLoopDelay.reset();
+});
+new Gauge("process_resident_memory_bytes", "Resident memory size", gauge => gauge.set({}, process.memoryUsage.rss()));
+const seriesDropped = new Counter("metrics_series_dropped_total", "Observations dropped because a metric reached its series limit");
+
+/**
+ * 规范化模型名标签：只接受较短的字符串，其他值统一为空
+ */
+function modelLabel(model: any) {
+    return typeof model === "string" && model.length <= 64 ? model : "";
+}
+
+/**
+ * 上游接口标签：去除查询参数
+ */
+function endpointLabel(uri: string) {
+    try {
+        return new URL(uri, "http://localhost").pathname;
+    } catch {
+        return uri.split("?")[0];
+    }
+}
+
+/**
+ * 记录上游响应状态码（无响应的失败记为 error）
+ */
+function trackUpstream<T extends { status: number }>(endpoint: string, request: Promise<T>): Promise<T> {
+    const label = endpointLabel(endpoint);
+    return request.then(response => {
+        upstreamResponses.inc({ endpoint: label, status: response.status });
+        return response;
+    }, err => {
+        upstreamResponses.inc({ endpoint: label, status: err?.response?.status || "error" });
+        throw err;
+    });
+}
+
+/**
+ * 采集当前进程的全部指标
+ */
+function snapshot(): MetricSnapshot[] {
+    return metrics.map(metric => metric.snapshot());
+}
+
+function escapeLabel(value: string | number) {
+    return String(value).replace(/\\/g, "\\\\").replace(/\n/g, "\\n").replace(/"/g, '\\"');
+}
+
+function formatLabels(labels: Labels, extra?: Labels) {
+    const all = extra ? { ...labels, ...extra } : labels;
+    const parts = Object.keys(all).map(name => `${name}="${escapeLabel(all[name])}"`);
+    return parts.length ? `{${parts.join(",")}}` : "";
+}
+
+/**
+ * 渲染为 Prometheus 文本格式（0.0.4）
+ *
+ * @param sources 各进程的采集结果，labels 为附加到该进程所有序列的标签（集群模式下区分 worker）
+ */
+function render(sources: { labels?: Labels; metrics: MetricSnapshot[] }[]) {
+    const byName = new Map<string, { meta: MetricSnapshot; lines: string[] }>();
+    for (const source of sources) {
+        for (const metric of source.metrics) {
+            if (!byName.has(metric.name)) byName.set(metric.name, { meta: metric, lines: [] });
+            const lines = byName.get(metric.name)!.lines;
+            for (const [labels, value] of metric.series) {
+                if (metric.type !== "histogram") {
+                    lines.push(`${metric.name}${formatLabels(labels, source.labels)} ${value}`);
+                    continue;
+                }
+                const values = value as number[];
+                const buckets = metric.buckets!;
+                buckets.forEach((le, i) => lines.push(`${metric.name}_bucket${formatLabels({ ...labels, ...source.labels, le })} ${values[i]}`));
+                lines.push(`${metric.name}_bucket${formatLabels({ ...labels, ...source.labels, le: "+Inf" })} ${values[buckets.length]}`);
+                lines.push(`${metric.name}_sum${formatLabels(labels, source.labels)} ${values[buckets.length + 1]}`);
+                lines.push(`${metric.name}_count${formatLabels(labels, source.labels)} ${values[buckets.length]}`);
+            }
+        }
+    }
+    let output = "";
+    for (const { meta, lines } of byName.values()) {
+        output += `# HELP ${meta.name} ${meta.help}\n# TYPE ${meta.name} ${meta.type}\n`;
+        if (lines.length) output += lines.join("\n") + "\n";
+    }
+    return output;
+}
+
+export default {
+    Counter,
+    Gauge,
+    Histogram,
+    requests,
+    requestDuration,
+    timeToFirstToken,
+    poolWait,
+    accountErrors,
+    upstreamResponses,
+    uploadDuration,
+    pollDuration,
+    modelLabel,
+    endpointLabel,
+    trackUpstream,
+    snapshot,
+    render
+};
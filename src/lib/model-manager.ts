@@ -1,9 +1,6 @@
-import fs from "fs-extra";
-import path from "path";
 import logger from "./logger.ts";
-
-const DATA_DIR = path.join(process.cwd(), "data");
-const MODELS_FILE = path.join(DATA_DIR, "models.json");
+import storage from "./storage.ts";
+import cluster from "./cluster.ts";
 
 export interface ModelConfig {
     id: string;
@@ -17,15 +14,35 @@ export interface ModelConfig {
 
 class ModelManager {
     private models: ModelConfig[] = [];
+    private initialized: Promise<void> | null = null;
 
     constructor() {
-        this.loadModels();
+        if (cluster.isCoordinator()) cluster.handle("models", () => this.init().then(() => this.models));
+    }
+
+    /**
+     * 加载模型配置，由启动阶段调用（重复调用只加载一次）
+     */
+    public init() {
+        if (!this.initialized) this.initialized = this.load();
+        return this.initialized;
+    }
+
+    private async load() {
+        if (cluster.isWorker()) {
+            // worker 使用主进程广播的模型配置副本
+            cluster.subscribe("models", models => this.models = models);
+            this.models = await cluster.call("models", "getModels");
+            return;
+        }
+        await this.loadModels();
     }
 
     private async loadModels() {
         try {
-            if (await fs.pathExists(MODELS_FILE)) {
-                this.models = await fs.readJson(MODELS_FILE);
+            const stored = await (await storage.getStorage()).loadCollection<ModelConfig>("models");
+            if (stored) {
+                this.models = stored;
             } else {
                 // 初始化默认模型
                 this.models = [
@@ -45,7 +62,8 @@ class ModelManager {
 
     public async saveModels() {
         try {
-            await fs.writeJson(MODELS_FILE, this.models, { spaces: 2 });
+            cluster.broadcast("models", this.models);
+            await (await storage.getStorage()).saveCollection("models", this.models, m => m.id);
         } catch (e) {
             logger.error("保存模型配置文件失败:", e);
         }
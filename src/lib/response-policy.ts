@@ -1,9 +1,6 @@
-import fs from "fs-extra";
-import path from "path";
 import logger from "@/lib/logger.ts";
-
-const DATA_DIR = path.join(process.cwd(), "data");
-const POLICY_FILE = path.join(DATA_DIR, "response-policies.json");
+import storage from "@/lib/storage.ts";
+import cluster from "@/lib/cluster.ts";
 
 export type PolicyAction = "retry" | "cooldown_1h" | "cooldown_24h" | "disable";
 
@@ -26,20 +23,35 @@ const DEFAULT_POLICIES: ResponsePolicy[] = [
 
 class ResponsePolicyManager {
   private policies: ResponsePolicy[] = [];
+  private initialized: Promise<void> | null = null;
 
   constructor() {
-    this.init();
+    if (cluster.isCoordinator()) cluster.handle("response-policies", () => this.init().then(() => this.policies));
+  }
+
+  /**
+   * 加载响应码策略，由启动阶段调用（重复调用只加载一次）
+   */
+  public init() {
+    if (!this.initialized) this.initialized = this.load();
+    return this.initialized;
   }
 
-  private async init() {
-    await fs.ensureDir(DATA_DIR);
+  private async load() {
+    if (cluster.isWorker()) {
+      // worker 使用主进程广播的策略副本
+      cluster.subscribe("policies", policies => this.policies = policies);
+      this.policies = await cluster.call("response-policies", "getPolicies");
+      return;
+    }
     await this.loadPolicies();
   }
 
   public async loadPolicies() {
     try {
-      if (await fs.pathExists(POLICY_FILE)) {
-        this.policies = await fs.readJson(POLICY_FILE);
+      const stored = await (await storage.getStorage()).loadDocument<ResponsePolicy[]>("response-policies");
+      if (stored) {
+        this.policies = stored;
       } else {
         this.policies = [...DEFAULT_POLICIES];
         await this.savePolicies(this.policies);
@@ -52,8 +64,9 @@ class ResponsePolicyManager {
 
   public async savePolicies(policies: ResponsePolicy[]) {
     this.policies = policies;
+    cluster.broadcast("policies", policies);
     try {
-      await fs.writeJson(POLICY_FILE, this.policies, { spaces: 2 });
+      await (await storage.getStorage()).saveDocument("response-policies", this.policies);
     } catch (e) {
       logger.error("保存策略文件失败:", e);
     }
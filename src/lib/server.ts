@@ -4,7 +4,6 @@ import koaRange from 'koa-range';
 import koaCors from "koa2-cors";
 import koaBody from 'koa-body';
 import _ from 'lodash';
-import path from 'path';
 import fs from 'fs-extra';
 
 import Exception from './exceptions/Exception.ts';
@@ -12,19 +11,46 @@ import Request from './request/Request.ts';
 import Response from './response/Response.js';
 import FailureBody from './response/FailureBody.ts';
 import EX from './consts/exceptions.ts';
-import logger from './logger.ts';
+import logger, { summarizeForLog } from './logger.ts';
 import config from './config.ts';
+import staticAssets from './static-assets.ts';
+import cluster from './cluster.ts';
+import metrics from './metrics.ts';
+import tracing, { Trace } from './tracing.ts';
 
 class Server {
 
     app;
     router;
+    #servers: any[] = [];
+    // 进行中的请求数（含流式响应）
+    #inflight = 0;
+    #draining = false;
+    #idleWaiters: Function[] = [];
+    // 启动阶段（状态加载）完成前，除探针外的请求等待其完成
+    #startup: Promise<any> | null = null;
     
     constructor() {
         this.app = new Koa();
+        // 统计进行中的请求，响应结束或连接断开时计数减一；排空期间要求客户端在响应后断开长连接
+        this.app.use((ctx: any, next: Function) => {
+            this.#inflight++;
+            ctx.res.once("close", () => {
+                if (--this.#inflight === 0) this.#idleWaiters.splice(0).forEach(fn => fn());
+            });
+            if (this.#draining) ctx.set("Connection", "close");
+            return next();
+        });
+        // 集群 worker：有状态的路由（后台、异步媒体任务）转发给主进程处理
+        if (cluster.isWorker())
+            this.app.use((ctx: any, next: Function) => cluster.isCoordinatorPath(ctx.path) ? cluster.proxy(ctx) : next());
+        this.app.use(async (ctx: any, next: Function) => {
+            if (this.#startup && !this.#isProbePath(ctx.path)) await this.#startup;
+            return next();
+        });
         this.app.use(koaCors());
-        // 范围请求支持
-        this.app.use(koaRange);
+        // 范围请求支持（媒体文件路由按区间读取文件，自行处理 Range）
+        this.app.use((ctx: any, next: Function) => ctx.path.includes("/media/files/") ? next() : koaRange(ctx, next));
         this.router = new KoaRouter({ prefix: config.service.urlPrefix });
         // 前置处理异常拦截
         this.app.use(async (ctx: any, next: Function) => {
@@ -47,6 +73,22 @@ class Server {
         logger.success("Server initialized");
     }
 
+    /**
+     * 启动阶段完成前先行监听：/ping 与 /ready 直接响应，其他请求等待 startup 完成后处理
+     * 
+     * @param startup 启动阶段
+     */
+    holdUntil(startup: Promise<any>) {
+        this.#startup = startup;
+        startup.then(() => this.#startup = null, () => {});
+    }
+
+    #isProbePath(urlPath: string) {
+        const prefix = config.service.urlPrefix || "";
+        if (prefix && urlPath.startsWith(prefix)) urlPath = urlPath.slice(prefix.length) || "/";
+        return urlPath === "/ping" || urlPath === "/ready";
+    }
+
     /**
      * 附加路由
      * 
@@ -63,7 +105,11 @@ class Server {
                 }
                 for (let uri in route[method]) {
                     this.router[method](`${prefix}${uri}`, async ctx => {
-                        const { request, response } = await this.#requestProcessing(ctx, route[method][uri]);
+                        this.#instrument(ctx, `${prefix}${uri}`);
+                        const trace = tracing.start(`${ctx.method} ${prefix}${uri}`);
+                        ctx.res.once("close", () => tracing.end(trace));
+                        const { request, response } = await tracing.run(trace, () => this.#requestProcessing(ctx, route[method][uri]));
+                        this.#applyTrace(ctx, trace);
                         if(response != null && config.system.requestLog)
                             logger.info(`<- ${request.method} ${request.url} ${response.time - request.time}ms`);
                     });
@@ -78,25 +124,11 @@ class Server {
             const request = new Request(ctx);
             const url = ctx.request.url;
 
-            // 1. 简单的静态资源支持 (如果不匹配任何路由)
-            if (ctx.method === 'GET') {
-                const publicPath = path.join(process.cwd(), 'public', url.split('?')[0]);
-                if (await fs.pathExists(publicPath) && (await fs.stat(publicPath)).isFile()) {
-                    const content = await fs.readFile(publicPath);
-                    const ext = path.extname(publicPath).toLowerCase();
-                    const mimeTypes: any = {
-                        '.html': 'text/html',
-                        '.js': 'text/javascript',
-                        '.css': 'text/css',
-                        '.json': 'application/json',
-                        '.png': 'image/png',
-                        '.jpg': 'image/jpeg',
-                        '.gif': 'image/gif',
-                        '.svg': 'image/svg+xml',
-                        '.ico': 'image/x-icon'
-                    };
-                    ctx.type = mimeTypes[ext] || 'application/octet-stream';
-                    ctx.body = content;
+            // 1. 静态资源支持 (如果不匹配任何路由)，直接从内存资源表响应
+            if (ctx.method === 'GET' || ctx.method === 'HEAD') {
+                const response = staticAssets.createResponse(request, url);
+                if (response) {
+                    response.injectTo(ctx);
                     return;
                 }
             }
@@ -121,6 +153,44 @@ class Server {
         });
     }
 
+    /**
+     * 请求指标：响应结束（含流式响应）时记录请求数与耗时，SSE 响应记录首个数据块的时间
+     * 
+     * @param ctx 上下文
+     * @param route 路由模板（避免按实际路径产生过多序列）
+     */
+    #instrument(ctx: any, route: string) {
+        const started = performance.now();
+        const res = ctx.res;
+        const write = res.write;
+        res.write = function (...args: any[]) {
+            res.write = write;
+            if (String(res.getHeader("Content-Type") || "").includes("text/event-stream"))
+                metrics.timeToFirstToken.observe({ route, model: metrics.modelLabel(ctx.request.body?.model) }, (performance.now() - started) / 1000);
+            return write.apply(this, args);
+        };
+        res.once("close", () => {
+            const model = metrics.modelLabel(ctx.request.body?.model);
+            metrics.requests.inc({ route, method: ctx.method, status: res.statusCode, model });
+            metrics.requestDuration.observe({ route, method: ctx.method, model }, (performance.now() - started) / 1000);
+        });
+    }
+
+    /**
+     * 输出追踪结果：Server-Timing 响应头包含响应开始前已结束的阶段（流式响应之后的阶段只写入慢请求追踪文件）；
+     * 请求头 X-Debug-Timing 非空时在 JSON 响应中附加 debug_timing 字段
+     * 
+     * @param ctx 上下文
+     * @param trace 请求追踪
+     */
+    #applyTrace(ctx: any, trace: Trace) {
+        if (ctx.headerSent) return;
+        ctx.set("Server-Timing", tracing.serverTiming(trace));
+        ctx.set("X-Trace-Id", trace.id);
+        if (ctx.get("X-Debug-Timing") && _.isPlainObject(ctx.body))
+            ctx.body = { ...ctx.body, debug_timing: tracing.debugInfo(trace) };
+    }
+
     /**
      * 请求处理
      * 
@@ -134,7 +204,7 @@ class Server {
                 if(config.system.requestLog) {
                     logger.info(`-> ${request.method} ${request.url}`);
                     if (!_.isEmpty(request.body)) {
-                        logger.info(`DATA: ${JSON.stringify(request.body)}`);
+                        logger.info(`DATA: ${JSON.stringify(summarizeForLog(request.body))}`);
                     }
                 }
                 routeFn(request)
@@ -143,14 +213,14 @@ class Server {
                         if(!Response.isInstance(response)) {
                             const _response = new Response(response);
                             if (config.system.requestLog && _response.body) {
-                                const logBody = typeof _response.body === 'object' ? JSON.stringify(_response.body) : _response.body;
+                                const logBody = typeof _response.body === 'object' ? JSON.stringify(summarizeForLog(_response.body)) : summarizeForLog(_response.body);
                                 logger.info(`REPLY: ${logBody}`);
                             }
                             _response.injectTo(ctx);
                             return resolve({ request, response: _response });
                         }
                         if (config.system.requestLog && response.body) {
-                            const logBody = typeof response.body === 'object' ? JSON.stringify(response.body) : response.body;
+                            const logBody = typeof response.body === 'object' ? JSON.stringify(summarizeForLog(response.body)) : summarizeForLog(response.body);
                             logger.info(`REPLY: ${logBody}`);
                         }
                         response.injectTo(ctx);
@@ -201,21 +271,62 @@ class Server {
             new Promise((resolve, reject) => {
                 if(host === "0.0.0.0" || host === "localhost" || host === "127.0.0.1")
                     return resolve(null);
-                this.app.listen(port, "localhost", err => {
+                this.#servers.push(this.app.listen(port, "localhost", err => {
                     if(err) return reject(err);
                     resolve(null);
-                });
+                }));
             }),
             new Promise((resolve, reject) => {
-                this.app.listen(port, host, err => {
+                this.#servers.push(this.app.listen(port, host, err => {
                     if(err) return reject(err);
                     resolve(null);
-                });
+                }));
             })
         ]);
         logger.success(`Server listening on port ${port} (${host})`);
     }
 
+    /**
+     * 集群主进程监听内部地址，接收 worker 转发的请求
+     */
+    async listenCoordinator() {
+        const socketPath = cluster.getSocketPath();
+        if (process.platform !== "win32") await fs.remove(socketPath);
+        await new Promise((resolve, reject) => {
+            this.#servers.push(this.app.listen(socketPath, err => {
+                if(err) return reject(err);
+                resolve(null);
+            }));
+        });
+        logger.success(`Coordinator listening on ${socketPath}`);
+    }
+
+    /**
+     * 排空：停止接受新连接，等待进行中的请求（含 SSE 流）结束，最多等待 timeout 毫秒
+     * 
+     * @returns 超时后仍未结束的请求数
+     */
+    async drain(timeout: number) {
+        this.#draining = true;
+        this.#servers.forEach(server => {
+            server.close();
+            server.closeIdleConnections?.();
+        });
+        if (this.#inflight > 0) {
+            logger.info(`Draining ${this.#inflight} in-flight requests (timeout ${timeout}ms)`);
+            await new Promise(resolve => {
+                const timer = setTimeout(resolve, timeout);
+                this.#idleWaiters.push(() => {
+                    clearTimeout(timer);
+                    resolve(null);
+                });
+            });
+        }
+        const remaining = this.#inflight;
+        this.#servers.forEach(server => server.closeAllConnections?.());
+        return remaining;
+    }
+
 }
 
 export default new Server();
\ No newline at end of file
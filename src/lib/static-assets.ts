@@ -0,0 +1,132 @@
+import path from "path";
+import zlib from "zlib";
+import crypto from "crypto";
+import fs from "fs-extra";
+import mime from "mime";
+
+import Request from "@/lib/request/Request.ts";
+import Response from "@/lib/response/Response.ts";
+import config from "@/lib/config.ts";
+import environment from "@/lib/environment.ts";
+import logger from "@/lib/logger.ts";
+
+// 小于该大小的资源不压缩
+const COMPRESS_MIN_SIZE = 1024;
+// 开发环境文件变更后的重新加载延迟
+const RELOAD_DELAY = 200;
+
+interface StaticAsset {
+    content: Buffer;
+    gzip?: Buffer;
+    br?: Buffer;
+    /** 内容哈希，各编码版本的 ETag 由其派生 */
+    hash: string;
+    type: string;
+}
+
+let assets = new Map<string, StaticAsset>();
+let reloadTimer: NodeJS.Timeout | null = null;
+
+function isCompressible(type: string) {
+    return /^text\/|\/(javascript|json|xml|svg\+xml)/.test(type);
+}
+
+function createAsset(filePath: string): StaticAsset {
+    const content = fs.readFileSync(filePath);
+    const baseType = mime.getType(filePath) || "application/octet-stream";
+    const type = /^text\/|\/javascript|\/json/.test(baseType) ? `${baseType}; charset=utf-8` : baseType;
+    const asset: StaticAsset = {
+        content,
+        hash: crypto.createHash("sha1").update(content).digest("base64url"),
+        type
+    };
+    if (content.length >= COMPRESS_MIN_SIZE && isCompressible(baseType)) {
+        asset.gzip = zlib.gzipSync(content, { level: 9 });
+        asset.br = zlib.brotliCompressSync(content, {
+            params: { [zlib.constants.BROTLI_PARAM_QUALITY]: zlib.constants.BROTLI_MAX_QUALITY }
+        });
+    }
+    return asset;
+}
+
+/**
+ * 读取公共目录下的全部文件并预先生成压缩版本，整体替换资源表
+ */
+function load() {
+    const root = config.system.publicDirPath;
+    const table = new Map<string, StaticAsset>();
+    const walk = (dir: string) => {
+        for (const name of fs.readdirSync(dir)) {
+            const filePath = path.join(dir, name);
+            const stat = fs.statSync(filePath);
+            if (stat.isDirectory()) walk(filePath);
+            else if (stat.isFile()) table.set("/" + path.relative(root, filePath).split(path.sep).join("/"), createAsset(filePath));
+        }
+    };
+    if (fs.pathExistsSync(root)) walk(root);
+    assets = table;
+    logger.info(`Static assets loaded: ${table.size} files`);
+}
+
+function watch() {
+    const root = config.system.publicDirPath;
+    if (!fs.pathExistsSync(root)) return;
+    try {
+        fs.watch(root, { recursive: true }, () => {
+            if (reloadTimer) clearTimeout(reloadTimer);
+            reloadTimer = setTimeout(() => {
+                reloadTimer = null;
+                try { load() }
+                catch (err) { logger.error(`Static assets reload failed: ${err?.message || err}`) }
+            }, RELOAD_DELAY);
+        }).unref();
+    }
+    catch (err) {
+        logger.warn(`Static assets watcher unavailable: ${err?.message || err}`);
+    }
+}
+
+function negotiateEncoding(acceptEncoding: string, asset: StaticAsset): "br" | "gzip" | null {
+    if (asset.br && /\bbr\b/.test(acceptEncoding)) return "br";
+    if (asset.gzip && /\bgzip\b/.test(acceptEncoding)) return "gzip";
+    return null;
+}
+
+/**
+ * 从资源表构建响应，不存在时返回 null（不访问文件系统）
+ *
+ * @param request 请求对象
+ * @param assetPath 资源路径，如 /admin.html
+ */
+function createResponse(request: Request, assetPath: string) {
+    let key: string;
+    try { key = decodeURIComponent(assetPath.split("?")[0]) }
+    catch { return null }
+    const asset = assets.get(key);
+    if (!asset) return null;
+
+    const encoding = negotiateEncoding(String(request.headers["accept-encoding"] || ""), asset);
+    // 不同编码是不同的表示，使用各自的强 ETag
+    const etag = encoding ? `"${asset.hash}-${encoding}"` : `"${asset.hash}"`;
+    const headers: Record<string, any> = {
+        "Content-Type": asset.type,
+        "ETag": etag,
+        // 每次使用前向服务端验证，未变化时返回 304
+        "Cache-Control": "no-cache"
+    };
+    if (asset.gzip) headers["Vary"] = "Accept-Encoding";
+    const ifNoneMatch = request.headers["if-none-match"];
+    if (typeof ifNoneMatch === "string" && ifNoneMatch.split(",").some(tag => tag.trim().replace(/^W\//, "") === etag))
+        return new Response(null, { statusCode: 304, headers });
+
+    if (encoding) headers["Content-Encoding"] = encoding;
+    return new Response(encoding ? asset[encoding] : asset.content, { statusCode: 200, headers });
+}
+
+load();
+if (environment.env === "dev") watch();
+
+export default {
+    createResponse,
+    reload: load
+};
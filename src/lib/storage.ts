@@ -0,0 +1,266 @@
+import path from "path";
+import fs from "fs-extra";
+
+import config from "@/lib/config.ts";
+import logger from "@/lib/logger.ts";
+
+const DATA_DIR = path.join(process.cwd(), "data");
+// 首次启用 SQLite 时从这些 JSON 文件导入
+const IMPORT_DOCUMENTS = ["settings", "usage-stats", "response-policies"];
+const IMPORT_COLLECTIONS: Record<string, string> = {
+    "accounts": "id",
+    "models": "id"
+};
+// 多进程同时写入时的锁等待时间
+const BUSY_TIMEOUT = 5000;
+
+/**
+ * 状态存储接口
+ *
+ * 文档（document）为整体读写的对象，如设置、用量统计；
+ * 集合（collection）为按主键区分的行，如账号、模型，SQLite 后端只写入发生变化的行。
+ */
+export interface StorageBackend {
+    readonly name: "json" | "sqlite";
+    loadDocument<T = any>(name: string): Promise<T | undefined>;
+    saveDocument(name: string, value: any): Promise<void>;
+    loadCollection<T = any>(name: string): Promise<T[] | undefined>;
+    saveCollection<T>(name: string, rows: T[], key: (row: T) => string): Promise<void>;
+    /** 按行写入（value 为 null 时删除该行），不影响集合中的其他行 */
+    putRows(name: string, rows: [string, any][]): Promise<void>;
+    close(): void;
+}
+
+/**
+ * JSON 文件后端：每个文档或集合对应 data/<name>.json，与旧版本文件格式一致
+ */
+class JsonStorage implements StorageBackend {
+
+    readonly name = "json";
+
+    private getFile(name: string) {
+        return path.join(DATA_DIR, `${name}.json`);
+    }
+
+    async loadDocument<T = any>(name: string): Promise<T | undefined> {
+        const file = this.getFile(name);
+        if (!await fs.pathExists(file)) return undefined;
+        return fs.readJson(file);
+    }
+
+    async saveDocument(name: string, value: any) {
+        await fs.ensureDir(DATA_DIR);
+        await fs.writeJson(this.getFile(name), value, { spaces: 2 });
+    }
+
+    loadCollection<T = any>(name: string): Promise<T[] | undefined> {
+        return this.loadDocument<T[]>(name);
+    }
+
+    saveCollection<T>(name: string, rows: T[]) {
+        return this.saveDocument(name, rows);
+    }
+
+    async putRows(name: string, changes: [string, any][]) {
+        const rows: any[] = (await this.loadCollection(name)) || [];
+        for (const [id, value] of changes) {
+            const index = rows.findIndex(row => row?.id === id);
+            if (value === null) index !== -1 && rows.splice(index, 1);
+            else if (index === -1) rows.push(value);
+            else rows[index] = value;
+        }
+        await this.saveCollection(name, rows);
+    }
+
+    close() {}
+
+}
+
+/**
+ * SQLite 后端（WAL 模式），使用 Node 内置 node:sqlite
+ */
+class SqliteStorage implements StorageBackend {
+
+    readonly name = "sqlite";
+    private db: any;
+    // 本进程最近一次写入的行内容，用于只写入变化的行
+    private savedRows = new Map<string, Map<string, string>>();
+
+    constructor(db: any) {
+        this.db = db;
+        db.exec(`PRAGMA journal_mode = WAL; PRAGMA synchronous = NORMAL; PRAGMA busy_timeout = ${BUSY_TIMEOUT};`);
+        db.exec(`
+            CREATE TABLE IF NOT EXISTS documents (
+                name TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                updated_at INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS collection_rows (
+                collection TEXT NOT NULL,
+                id TEXT NOT NULL,
+                position INTEGER NOT NULL,
+                value TEXT NOT NULL,
+                updated_at INTEGER NOT NULL,
+                PRIMARY KEY (collection, id)
+            );
+        `);
+    }
+
+    static async open(file: string) {
+        let sqlite: any;
+        try {
+            sqlite = await import("node:sqlite");
+        } catch (err) {
+            throw new Error(`SQLite storage requires Node.js 22.13+ (node:sqlite without --experimental-sqlite), current ${process.version}: ${err?.message || err}`);
+        }
+        await fs.ensureDir(path.dirname(file));
+        return new SqliteStorage(new sqlite.DatabaseSync(file));
+    }
+
+    private transaction(fn: () => void) {
+        this.db.exec("BEGIN IMMEDIATE");
+        try {
+            fn();
+            this.db.exec("COMMIT");
+        } catch (err) {
+            this.db.exec("ROLLBACK");
+            throw err;
+        }
+    }
+
+    isEmpty() {
+        const documents = this.db.prepare("SELECT COUNT(*) AS count FROM documents").get().count;
+        const rows = this.db.prepare("SELECT COUNT(*) AS count FROM collection_rows").get().count;
+        return documents === 0 && rows === 0;
+    }
+
+    async loadDocument<T = any>(name: string): Promise<T | undefined> {
+        const row = this.db.prepare("SELECT value FROM documents WHERE name = ?").get(name);
+        return row ? JSON.parse(row.value) : undefined;
+    }
+
+    async saveDocument(name: string, value: any) {
+        this.db.prepare(`
+            INSERT INTO documents (name, value, updated_at) VALUES (?, ?, ?)
+            ON CONFLICT (name) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at
+        `).run(name, JSON.stringify(value), Date.now());
+    }
+
+    async loadCollection<T = any>(name: string): Promise<T[] | undefined> {
+        const rows = this.db.prepare("SELECT id, value FROM collection_rows WHERE collection = ? ORDER BY position, id").all(name);
+        if (rows.length === 0) return undefined;
+        const saved = new Map<string, string>();
+        rows.forEach((row: any, index: number) => saved.set(row.id, `${index}:${row.value}`));
+        this.savedRows.set(name, saved);
+        return rows.map((row: any) => JSON.parse(row.value));
+    }
+
+    async saveCollection<T>(name: string, rows: T[], key: (row: T) => string) {
+        const saved = this.savedRows.get(name) || new Map<string, string>();
+        const next = new Map<string, string>();
+        const now = Date.now();
+        const upsert = this.db.prepare(`
+            INSERT INTO collection_rows (collection, id, position, value, updated_at) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (collection, id) DO UPDATE SET position = excluded.position, value = excluded.value, updated_at = excluded.updated_at
+        `);
+        const remove = this.db.prepare("DELETE FROM collection_rows WHERE collection = ? AND id = ?");
+        this.transaction(() => {
+            rows.forEach((row, index) => {
+                const id = key(row);
+                const value = JSON.stringify(row);
+                next.set(id, `${index}:${value}`);
+                if (saved.get(id) !== `${index}:${value}`) upsert.run(name, id, index, value, now);
+            });
+            // 以数据库中的实际行为准删除，其他进程新增的行同样会被替换
+            const existing = this.db.prepare("SELECT id FROM collection_rows WHERE collection = ?").all(name);
+            for (const { id } of existing) {
+                if (!next.has(id)) remove.run(name, id);
+            }
+        });
+        this.savedRows.set(name, next);
+    }
+
+    async putRows(name: string, changes: [string, any][]) {
+        const now = Date.now();
+        const upsert = this.db.prepare(`
+            INSERT INTO collection_rows (collection, id, position, value, updated_at) VALUES (?, ?, 0, ?, ?)
+            ON CONFLICT (collection, id) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at
+        `);
+        const remove = this.db.prepare("DELETE FROM collection_rows WHERE collection = ? AND id = ?");
+        const saved = this.savedRows.get(name);
+        this.transaction(() => {
+            for (const [id, value] of changes) {
+                if (value === null) {
+                    remove.run(name, id);
+                    saved?.delete(id);
+                    continue;
+                }
+                const json = JSON.stringify(value);
+                upsert.run(name, id, json, now);
+                // 已有行保留原位置，同步缓存，避免下次整体保存时重复写入
+                const previous = saved?.get(id);
+                if (previous !== undefined) saved!.set(id, `${previous.slice(0, previous.indexOf(":"))}:${json}`);
+            }
+        });
+    }
+
+    /**
+     * 从现有 JSON 文件导入文档与集合
+     */
+    async importFromJson() {
+        const json = new JsonStorage();
+        let imported = 0;
+        for (const name of IMPORT_DOCUMENTS) {
+            const value = await json.loadDocument(name).catch(() => undefined);
+            if (value === undefined) continue;
+            await this.saveDocument(name, value);
+            imported++;
+        }
+        for (const [name, field] of Object.entries(IMPORT_COLLECTIONS)) {
+            const rows = await json.loadCollection(name).catch(() => undefined);
+            if (!Array.isArray(rows)) continue;
+            await this.saveCollection(name, rows, (row: any) => String(row?.[field] ?? ""));
+            imported++;
+        }
+        return imported;
+    }
+
+    close() {
+        this.db.close();
+    }
+
+}
+
+let backend: Promise<StorageBackend> | null = null;
+
+async function open(): Promise<StorageBackend> {
+    if (config.system.storage !== "sqlite") return new JsonStorage();
+    const file = config.system.storageFilePath;
+    let storage: SqliteStorage;
+    try {
+        storage = await SqliteStorage.open(file);
+    } catch (err) {
+        // 明确配置了 SQLite 时默认终止启动，避免在运维不知情的情况下改用 JSON 文件
+        if (!config.system.storageFallback) throw err;
+        logger.warn(`[Storage] SQLite unavailable, storageFallback enabled, using JSON files: ${err?.message || err}`);
+        return new JsonStorage();
+    }
+    if (storage.isEmpty()) {
+        const imported = await storage.importFromJson();
+        if (imported > 0) logger.info(`[Storage] imported ${imported} JSON stores into ${path.relative(process.cwd(), file)}`);
+    }
+    logger.info(`[Storage] using SQLite (WAL) at ${path.relative(process.cwd(), file)}`);
+    return storage;
+}
+
+/**
+ * 获取当前存储后端（按 system.yml 的 storage 配置），首次调用时打开
+ */
+function getStorage() {
+    if (!backend) backend = open();
+    return backend;
+}
+
+export default {
+    getStorage
+};
@@ -1,9 +1,21 @@
 import fs from "fs-extra";
 import path from "path";
 import logger from "@/lib/logger.ts";
+import storage from "@/lib/storage.ts";
+import cluster from "@/lib/cluster.ts";
+import tracing from "@/lib/tracing.ts";
+import tokenizer from "@/lib/tokenizer.ts";
+import AccountManager, { RequestType } from "@/lib/account-manager.ts";
+import usageSeries, { UsageQuery } from "@/lib/usage-series.ts";
 
 const DATA_DIR = path.join(process.cwd(), "data");
-const USAGE_STATS_FILE = path.join(DATA_DIR, "usage-stats.json");
+// 保留的小时与天数（环形缓冲区槽位数）
+const HOUR_SLOTS = 48;
+const DAY_SLOTS = 30;
+const HOUR = 3600 * 1000;
+const DAY = 24 * HOUR;
+// 用量快照写入间隔
+const FLUSH_INTERVAL = 5000;
 
 export interface UsageMetric {
   promptTokens: number;
@@ -11,121 +23,227 @@ export interface UsageMetric {
   count: number;
 }
 
+export interface UsageDetails {
+  type?: RequestType;
+  model?: string;
+  latencyMs?: number;
+}
+
 export interface UsageStats {
   total: UsageMetric;
   byAccount: Record<string, UsageMetric>;
   hourly: Record<string, number>; // e.g., "2024-03-16 12:00" -> tokens
   daily: Record<string, number>;  // e.g., "2024-03-16" -> tokens
+  /** hourly / daily 键所用的时区，固定为 UTC；旧版本快照没有该字段（小时为服务器本地时间） */
+  timezone?: string;
+}
+
+/**
+ * 按时间槽索引的环形缓冲区：槽位 = 时间序号 % 槽位数，写入时发现槽位属于旧周期则先清零，无需排序或清理
+ */
+class UsageRing {
+
+  private periods: Float64Array;
+  private values: Float64Array;
+
+  constructor(private slots: number, private width: number) {
+    this.periods = new Float64Array(slots).fill(-1);
+    this.values = new Float64Array(slots);
+  }
+
+  add(time: number, value: number) {
+    const period = Math.floor(time / this.width);
+    const index = period % this.slots;
+    if (this.periods[index] !== period) {
+      this.periods[index] = period;
+      this.values[index] = 0;
+    }
+    this.values[index] += value;
+  }
+
+  /**
+   * 保留范围内的 [周期起始时间, 值]
+   */
+  entries(now = Date.now()) {
+    const current = Math.floor(now / this.width);
+    const result: [number, number][] = [];
+    for (let i = 0; i < this.slots; i++) {
+      const period = this.periods[i];
+      if (period < 0 || period > current || current - period >= this.slots) continue;
+      result.push([period * this.width, this.values[i]]);
+    }
+    return result.sort((a, b) => a[0] - b[0]);
+  }
+
+}
+
+// 与管理后台约定的键格式：UTC 日期 + UTC 小时，与环形缓冲区的周期边界一致
+function hourKey(time: number) {
+  const iso = new Date(time).toISOString();
+  return `${iso.slice(0, 10)} ${iso.slice(11, 13)}:00`;
+}
+
+function dayKey(time: number) {
+  return new Date(time).toISOString().split('T')[0];
+}
+
+/**
+ * 小时键还原为时间戳；legacy 为旧版本快照的键（UTC 日期 + 服务器本地小时）
+ */
+function parseHourKey(key: string, legacy = false) {
+  const match = key.match(/^(\d{4}-\d{2}-\d{2}) (\d{2}):00$/);
+  if (!match) return null;
+  if (!legacy) {
+    const time = Date.parse(`${match[1]}T${match[2]}:00:00Z`);
+    return Number.isFinite(time) ? time : null;
+  }
+  const local = new Date(`${match[1]}T${match[2]}:00:00`).getTime();
+  for (const offset of [0, -DAY, DAY]) {
+    const date = new Date(local + offset);
+    if (`${date.toISOString().split('T')[0]} ${date.getHours().toString().padStart(2, '0')}:00` === key) return local + offset;
+  }
+  return null;
 }
 
 class TokenCounter {
-  private stats: UsageStats = {
-    total: { promptTokens: 0, completionTokens: 0, count: 0 },
-    byAccount: {},
-    hourly: {},
-    daily: {}
-  };
+  private total: UsageMetric = { promptTokens: 0, completionTokens: 0, count: 0 };
+  private byAccount: Record<string, UsageMetric> = {};
+  private hourly = new UsageRing(HOUR_SLOTS, HOUR);
+  private daily = new UsageRing(DAY_SLOTS, DAY);
+  private dirty = false;
+  private saving: Promise<void> = Promise.resolve();
+
+  private initialized: Promise<void> | null = null;
 
   constructor() {
-    this.init();
+    if (cluster.isCoordinator()) cluster.handle("usage", (_method, args: any[]) => this.recordUsage(args[0], args[1], args[2], args[3]));
   }
 
-  private async init() {
+  /**
+   * 加载用量统计，由启动阶段调用（重复调用只加载一次）
+   */
+  public init() {
+    if (!this.initialized) this.initialized = this.load();
+    return this.initialized;
+  }
+
+  private async load() {
+    // 集群模式下用量统计只由主进程记录与保存
+    if (cluster.isWorker()) return;
     await fs.ensureDir(DATA_DIR);
-    await this.loadStats();
+    await Promise.all([this.loadStats(), usageSeries.load()]);
+    setInterval(() => this.saveStats(), FLUSH_INTERVAL).unref();
   }
 
   private async loadStats() {
     try {
-      if (await fs.pathExists(USAGE_STATS_FILE)) {
-        const stored = await fs.readJson(USAGE_STATS_FILE);
-        this.stats = {
-          ...this.stats,
-          ...stored,
-          hourly: stored.hourly || {},
-          daily: stored.daily || {}
-        };
+      const stored = await (await storage.getStorage()).loadDocument("usage-stats");
+      if (!stored) return;
+      if (stored.total) this.total = { ...this.total, ...stored.total };
+      this.byAccount = stored.byAccount || {};
+      const legacy = stored.timezone !== "UTC";
+      for (const [key, tokens] of Object.entries<number>(stored.hourly || {})) {
+        const time = parseHourKey(key, legacy);
+        if (time !== null) this.hourly.add(time, tokens);
+      }
+      for (const [key, tokens] of Object.entries<number>(stored.daily || {})) {
+        const time = Date.parse(`${key}T00:00:00Z`);
+        if (Number.isFinite(time)) this.daily.add(time, tokens);
       }
     } catch (e) {
       logger.error("加载用量统计失败:", e);
     }
   }
 
-  private async saveStats() {
-    try {
-      await fs.writeJson(USAGE_STATS_FILE, this.stats, { spaces: 2 });
-    } catch (e) {
-      logger.error("保存用量统计失败:", e);
-    }
+  /**
+   * 写入用量统计与时间序列快照（优雅停止时调用）
+   */
+  public async flush() {
+    await Promise.all([this.saveStats(), usageSeries.flush()]);
   }
 
   /**
-   * 估算 Token 数量
-   * 这是一个比较粗略的估算：
-   * 中文：每个字符约 0.6 token (或者按 1个汉字=1.5~2tokens)
-   * 英文：每个单词约 1.3 token，或者每 4 个字符 1 token
-   * 这里采用保守估算：中文 2 tokens/字符，英文 0.5 token/字符
+   * 写入用量快照（有变化时）
+   */
+  private saveStats() {
+    if (!this.dirty) return this.saving;
+    this.dirty = false;
+    const snapshot = this.getStats();
+    this.saving = this.saving
+      .then(async () => (await storage.getStorage()).saveDocument("usage-stats", snapshot))
+      .catch(e => {
+        this.dirty = true;
+        logger.error("保存用量统计失败:", e);
+      });
+    return this.saving;
+  }
+
+  /**
+   * 计算 Token 数量：配置了词表时按 BPE 分词计数，否则按字符类别估算（见 tokenizer.ts）
    */
   public estimateTokens(text: string): number {
-    if (!text) return 0;
-    let tokens = 0;
-    for (let i = 0; i < text.length; i++) {
-      const charCode = text.charCodeAt(i);
-      if (charCode > 255) {
-        tokens += 2; // 中文等双字节字符
-      } else {
-        tokens += 0.5; // 英文等单字节字符
-      }
-    }
-    return Math.ceil(tokens);
+    return tokenizer.count(text);
   }
 
   /**
-   * 记录用量
+   * 记录用量：只更新内存中的计数，快照由定时任务写入
+   *
+   * @param details 请求类型与模型，用于时间序列的维度；延迟取自当前请求追踪的已耗时
    */
-  public async recordUsage(accountId: string, promptTokens: number, completionTokens: number) {
+  public recordUsage(accountId: string, promptTokens: number, completionTokens: number, details: UsageDetails = {}) {
+    if (!details.latencyMs) {
+      const trace = tracing.current();
+      if (trace) details = { ...details, latencyMs: Math.round(performance.now() - trace.started) };
+    }
+    if (cluster.isWorker()) return cluster.notify("usage", "recordUsage", [accountId, promptTokens, completionTokens, details]);
     const totalTokens = promptTokens + completionTokens;
     // 更新全局统计
-    this.stats.total.promptTokens += promptTokens;
-    this.stats.total.completionTokens += completionTokens;
-    this.stats.total.count += 1;
+    this.total.promptTokens += promptTokens;
+    this.total.completionTokens += completionTokens;
+    this.total.count += 1;
 
     // 更新各账号统计
-    if (!this.stats.byAccount[accountId]) {
-      this.stats.byAccount[accountId] = { promptTokens: 0, completionTokens: 0, count: 0 };
-    }
-    this.stats.byAccount[accountId].promptTokens += promptTokens;
-    this.stats.byAccount[accountId].completionTokens += completionTokens;
-    this.stats.byAccount[accountId].count += 1;
+    const account = this.byAccount[accountId] || (this.byAccount[accountId] = { promptTokens: 0, completionTokens: 0, count: 0 });
+    account.promptTokens += promptTokens;
+    account.completionTokens += completionTokens;
+    account.count += 1;
 
     // 记录历史趋势
-    const now = new Date();
-    const dateStr = now.toISOString().split('T')[0]; // "YYYY-MM-DD"
-    const hourStr = `${dateStr} ${now.getHours().toString().padStart(2, '0')}:00`;
-
-    this.stats.hourly[hourStr] = (this.stats.hourly[hourStr] || 0) + totalTokens;
-    this.stats.daily[dateStr] = (this.stats.daily[dateStr] || 0) + totalTokens;
-
-    this.cleanupHistory();
-    await this.saveStats();
+    const now = Date.now();
+    this.hourly.add(now, totalTokens);
+    this.daily.add(now, totalTokens);
+    this.dirty = true;
+
+    usageSeries.record({
+      type: details.type || "chat",
+      model: details.model || "",
+      channel: AccountManager.getAccountById(accountId)?.name || "",
+      account: accountId,
+      promptTokens,
+      completionTokens,
+      latencyMs: details.latencyMs
+    }, now);
   }
 
-  private cleanupHistory() {
-    // 仅保留最近 48 小时的每小时统计
-    const hours = Object.keys(this.stats.hourly).sort();
-    if (hours.length > 48) {
-      hours.slice(0, hours.length - 48).forEach(h => delete this.stats.hourly[h]);
-    }
-
-    // 仅保留最近 30 天的每日统计
-    const days = Object.keys(this.stats.daily).sort();
-    if (days.length > 30) {
-      days.slice(0, days.length - 30).forEach(d => delete this.stats.daily[d]);
-    }
+  /**
+   * 按维度聚合查询用量时间序列
+   */
+  public querySeries(query: UsageQuery) {
+    return usageSeries.query(query);
   }
 
   public getStats(): UsageStats {
-    return this.stats;
+    const hourly: Record<string, number> = {};
+    const daily: Record<string, number> = {};
+    for (const [time, tokens] of this.hourly.entries()) hourly[hourKey(time)] = tokens;
+    for (const [time, tokens] of this.daily.entries()) daily[dayKey(time)] = tokens;
+    return {
+      total: { ...this.total },
+      byAccount: Object.fromEntries(Object.entries(this.byAccount).map(([id, metric]) => [id, { ...metric }])),
+      hourly,
+      daily,
+      timezone: "UTC"
+    };
   }
 }
 
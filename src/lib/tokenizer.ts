@@ -0,0 +1,173 @@
+import path from "path";
+import crypto from "crypto";
+import fs from "fs-extra";
+
+import config from "@/lib/config.ts";
+import logger from "@/lib/logger.ts";
+
+// 预分词规则（与 cl100k_base 一致）：按单词、数字、标点与空白切分，BPE 只在片段内部合并
+const PRE_TOKENIZE = /'(?:[sdmt]|ll|ve|re)|[^\r\n\p{L}\p{N}]?\p{L}+|\p{N}{1,3}| ?[^\s\p{L}\p{N}]+[\r\n]*|\s*[\r\n]+|\s+(?!\S)|\s+/giu;
+// 单个片段参与合并的最大字符数，超长片段（如无标点的长段中文）按窗口切分，避免合并耗时随长度平方增长
+const MAX_PIECE_LENGTH = 128;
+// 片段计数缓存上限，超出后清空
+const MAX_CACHE_SIZE = 100000;
+const CJK_PATTERN = /[぀-ヿ㐀-䶿一-鿿가-힯豈-﫿]/;
+// 已知词表的 SHA-256（OpenAI 发布的原始文件），文件名匹配时校验内容，防止损坏或被替换
+const KNOWN_VOCAB_SHA256: Record<string, string> = {
+    "cl100k_base.tiktoken": "223921b76ee99bde995b7ff738513eef100fb51d18c93597a113bcffe865b2a7"
+};
+
+// 词表：token 字节（latin1 字符串）-> 合并优先级
+let ranks: Map<string, number> | null = null;
+let loading: Promise<void> | null = null;
+const cache = new Map<string, number>();
+
+/**
+ * 加载词表（tiktoken 格式，每行 "<base64 token> <rank>"），由启动阶段调用；
+ * 未配置或加载失败时使用估算
+ */
+function init() {
+    if (!loading) loading = load();
+    return loading;
+}
+
+async function load() {
+    const vocab = config.system.tokenizerVocab;
+    if (!vocab) {
+        logger.warn("[Tokenizer] tokenizerVocab is not configured, token counts are estimates");
+        return;
+    }
+    const file = path.resolve(vocab);
+    try {
+        const buffer = await fs.readFile(file);
+        const expected = KNOWN_VOCAB_SHA256[path.basename(file)];
+        if (expected) {
+            const actual = crypto.createHash("sha256").update(buffer).digest("hex");
+            if (actual !== expected) throw new Error(`checksum mismatch (sha256 ${actual}, expected ${expected})`);
+        }
+        const content = buffer.toString("utf8");
+        const table = new Map<string, number>();
+        for (const line of content.split("\n")) {
+            const separator = line.indexOf(" ");
+            if (separator <= 0) continue;
+            table.set(Buffer.from(line.slice(0, separator), "base64").toString("latin1"), Number(line.slice(separator + 1)));
+        }
+        ranks = table;
+        cache.clear();
+        logger.info(`[Tokenizer] loaded ${table.size} tokens from ${path.relative(process.cwd(), file)}`);
+    } catch (err) {
+        logger.error(`[Tokenizer] vocabulary load failed from ${file}, token counts are estimates: ${err?.message || err}`);
+    }
+}
+
+/**
+ * 字节级 BPE：反复合并优先级最高（rank 最小）的相邻片段，返回最终 token 数
+ */
+function bytePairCount(bytes: Buffer, table: Map<string, number>) {
+    if (bytes.length <= 1) return bytes.length;
+    if (table.has(bytes.toString("latin1"))) return 1;
+    // parts 为各片段的起始字节位置（最后一项为结尾），pairRanks[i] 为 parts[i]..parts[i+2] 合并后的 rank
+    const parts: number[] = [];
+    for (let i = 0; i <= bytes.length; i++) parts.push(i);
+    const getRank = (i: number) => i + 2 < parts.length ? table.get(bytes.toString("latin1", parts[i], parts[i + 2])) ?? Infinity : Infinity;
+    const pairRanks: number[] = [];
+    for (let i = 0; i < parts.length - 1; i++) pairRanks.push(getRank(i));
+    while (parts.length > 2) {
+        let min = Infinity;
+        let index = -1;
+        for (let i = 0; i < pairRanks.length; i++) {
+            if (pairRanks[i] < min) {
+                min = pairRanks[i];
+                index = i;
+            }
+        }
+        if (index === -1) break;
+        parts.splice(index + 1, 1);
+        pairRanks.splice(index + 1, 1);
+        pairRanks[index] = getRank(index);
+        if (index > 0) pairRanks[index - 1] = getRank(index - 1);
+    }
+    return parts.length - 1;
+}
+
+/**
+ * 无词表时的估算（按字符类别校准）：中日韩文字约 0.7 token/字，其他非 ASCII 字符约 0.6，
+ * ASCII 片段约 4 字符 1 token（至少 1）
+ */
+function estimatePiece(piece: string) {
+    let ascii = 0;
+    let tokens = 0;
+    for (const char of piece) {
+        if (char.charCodeAt(0) < 128) ascii++;
+        else tokens += CJK_PATTERN.test(char) ? 0.7 : 0.6;
+    }
+    return tokens + (ascii > 0 ? Math.max(1, ascii / 4) : 0);
+}
+
+function countPiece(piece: string) {
+    let count = cache.get(piece);
+    if (count !== undefined) return count;
+    count = ranks ? bytePairCount(Buffer.from(piece, "utf8"), ranks) : estimatePiece(piece);
+    if (cache.size >= MAX_CACHE_SIZE) cache.clear();
+    cache.set(piece, count);
+    return count;
+}
+
+function countLongPiece(piece: string) {
+    if (piece.length <= MAX_PIECE_LENGTH) return countPiece(piece);
+    let count = 0;
+    for (let i = 0; i < piece.length; i += MAX_PIECE_LENGTH) count += countPiece(piece.slice(i, i + MAX_PIECE_LENGTH));
+    return count;
+}
+
+function split(text: string) {
+    return text.match(PRE_TOKENIZE) || [];
+}
+
+/**
+ * 计算文本的 token 数
+ */
+function count(text: string) {
+    if (!text) return 0;
+    let total = 0;
+    for (const piece of split(text)) total += countLongPiece(piece);
+    return Math.ceil(total);
+}
+
+/**
+ * 流式增量计数：每次只处理新增文本，最后一个片段可能随后续文本延长，保留到下次或结束时计数
+ */
+export class StreamingTokenCounter {
+
+    private pending = "";
+    private total = 0;
+
+    push(text: string) {
+        if (!text) return;
+        this.pending += text;
+        const pieces = split(this.pending);
+        if (pieces.length === 0) return;
+        let last = pieces.pop()!;
+        for (const piece of pieces) this.total += countLongPiece(piece);
+        // 无法切分的超长片段先按完整窗口计数
+        if (last.length > MAX_PIECE_LENGTH) {
+            const settled = last.length - (last.length % MAX_PIECE_LENGTH || MAX_PIECE_LENGTH);
+            this.total += countLongPiece(last.slice(0, settled));
+            last = last.slice(settled);
+        }
+        this.pending = last;
+    }
+
+    finish() {
+        if (this.pending) this.total += countLongPiece(this.pending);
+        this.pending = "";
+        return Math.ceil(this.total);
+    }
+
+}
+
+export default {
+    init,
+    count,
+    createCounter: () => new StreamingTokenCounter()
+};
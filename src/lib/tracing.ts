@@ -0,0 +1,215 @@
+import path from "path";
+import { AsyncLocalStorage } from "async_hooks";
+import fs from "fs-extra";
+
+import config from "@/lib/config.ts";
+import util from "@/lib/util.ts";
+
+// 慢请求追踪文件目录（位于日志目录下）
+const TRACE_DIR_NAME = "traces";
+// 单个追踪最多记录的阶段数，防止长时间轮询产生过多记录
+const MAX_SPANS = 500;
+
+export interface Span {
+    name: string;
+    /** 相对追踪开始的时间（毫秒） */
+    start: number;
+    duration: number;
+    attrs?: Record<string, any>;
+}
+
+export interface Trace {
+    id: string;
+    name: string;
+    /** performance.now() 时间基准 */
+    started: number;
+    /** 开始时间戳（毫秒） */
+    startedAt: number;
+    spans: Span[];
+    attrs: Record<string, any>;
+    ended: boolean;
+}
+
+const storage = new AsyncLocalStorage<Trace>();
+// 追踪文件中每个追踪使用独立的线程编号，在查看器中分行显示
+let threadId = 0;
+let writing: Promise<any> = Promise.resolve();
+
+/**
+ * 创建追踪
+ */
+function start(name: string, attrs: Record<string, any> = {}): Trace {
+    return {
+        id: util.uuid(false),
+        name,
+        started: performance.now(),
+        startedAt: Date.now(),
+        spans: [],
+        attrs,
+        ended: false
+    };
+}
+
+/**
+ * 在追踪上下文中执行，期间（含异步延续）创建的阶段都记录到该追踪
+ */
+function run<T>(trace: Trace, fn: () => T): T {
+    return storage.run(trace, fn);
+}
+
+function current() {
+    return storage.getStore();
+}
+
+/**
+ * 开始一个阶段，返回结束函数；不在追踪上下文中时为空操作
+ */
+function startSpan(name: string, attrs?: Record<string, any>) {
+    const trace = storage.getStore();
+    if (!trace) return (_extra?: Record<string, any>) => {};
+    const started = performance.now();
+    let ended = false;
+    return (extra?: Record<string, any>) => {
+        if (ended || trace.spans.length >= MAX_SPANS) return;
+        ended = true;
+        trace.spans.push({
+            name,
+            start: started - trace.started,
+            duration: performance.now() - started,
+            attrs: extra ? { ...attrs, ...extra } : attrs
+        });
+    };
+}
+
+/**
+ * 记录异步操作的耗时，失败时附加 error 属性
+ */
+async function span<T>(name: string, fn: () => Promise<T>, attrs?: Record<string, any>): Promise<T> {
+    const end = startSpan(name, attrs);
+    try {
+        const result = await fn();
+        end();
+        return result;
+    } catch (err) {
+        end({ error: err?.message || String(err) });
+        throw err;
+    }
+}
+
+/**
+ * 按阶段名汇总耗时，同名阶段（如并行上传、多次轮询请求）按时间区间合并后计算，避免重叠部分重复计入
+ */
+function summarize(trace: Trace) {
+    const groups = new Map<string, Span[]>();
+    for (const item of trace.spans) {
+        if (!groups.has(item.name)) groups.set(item.name, []);
+        groups.get(item.name)!.push(item);
+    }
+    const phases: { name: string; duration: number; count: number }[] = [];
+    for (const [name, spans] of groups) {
+        spans.sort((a, b) => a.start - b.start);
+        let duration = 0;
+        let rangeStart = spans[0].start;
+        let rangeEnd = rangeStart + spans[0].duration;
+        for (const item of spans.slice(1)) {
+            if (item.start > rangeEnd) {
+                duration += rangeEnd - rangeStart;
+                rangeStart = item.start;
+            }
+            rangeEnd = Math.max(rangeEnd, item.start + item.duration);
+        }
+        duration += rangeEnd - rangeStart;
+        phases.push({ name, duration, count: spans.length });
+    }
+    return phases;
+}
+
+/**
+ * 生成 Server-Timing 响应头（仅包含已结束的阶段与当前总耗时）
+ */
+function serverTiming(trace: Trace) {
+    const entries = summarize(trace).map(({ name, duration, count }) =>
+        `${name};dur=${duration.toFixed(1)}${count > 1 ? `;desc="${count}x"` : ""}`);
+    entries.push(`total;dur=${(performance.now() - trace.started).toFixed(1)}`);
+    return entries.join(", ");
+}
+
+/**
+ * 调试字段：各阶段的开始时间与耗时
+ */
+function debugInfo(trace: Trace) {
+    return {
+        trace_id: trace.id,
+        total_ms: Math.round(performance.now() - trace.started),
+        phases: summarize(trace).map(({ name, duration, count }) => ({ name, duration_ms: Math.round(duration), count })),
+        spans: trace.spans.map(item => ({
+            name: item.name,
+            start_ms: Math.round(item.start),
+            duration_ms: Math.round(item.duration),
+            ...(item.attrs ? { attrs: item.attrs } : {})
+        }))
+    };
+}
+
+/**
+ * 转换为 Chrome Trace Event 格式（完整事件 ph=X，时间单位微秒）
+ */
+function toTraceEvents(trace: Trace, duration: number) {
+    const tid = ++threadId;
+    const origin = trace.startedAt * 1000;
+    return [
+        { name: "thread_name", ph: "M", pid: process.pid, tid, args: { name: `${trace.name} ${trace.id}` } },
+        { name: trace.name, cat: "request", ph: "X", ts: origin, dur: Math.round(duration * 1000), pid: process.pid, tid, args: { trace_id: trace.id, ...trace.attrs } },
+        ...trace.spans.map(item => ({
+            name: item.name,
+            cat: "phase",
+            ph: "X",
+            ts: Math.round(origin + item.start * 1000),
+            dur: Math.round(item.duration * 1000),
+            pid: process.pid,
+            tid,
+            ...(item.attrs ? { args: item.attrs } : {})
+        }))
+    ];
+}
+
+/**
+ * 追加到当天的追踪文件。文件为 JSON 数组格式且不写结尾的 ]，
+ * chrome://tracing、Perfetto 等查看器均可直接打开
+ */
+function persist(trace: Trace, duration: number) {
+    const file = path.join(config.system.logDirPath, TRACE_DIR_NAME, `${util.getDateString()}.json`);
+    const events = toTraceEvents(trace, duration).map(event => JSON.stringify(event) + ",\n").join("");
+    writing = writing
+        .then(async () => {
+            await fs.ensureDir(path.dirname(file));
+            const exists = await fs.pathExists(file);
+            await fs.appendFile(file, exists ? events : "[\n" + events);
+        })
+        .catch(err => console.error("Trace write error:", err));
+    return writing;
+}
+
+/**
+ * 结束追踪：总耗时超过 traceSlowThreshold 的追踪按 traceSampleRate 采样写入追踪文件
+ */
+function end(trace: Trace) {
+    if (trace.ended) return;
+    trace.ended = true;
+    const duration = performance.now() - trace.started;
+    const threshold = config.system.traceSlowThreshold;
+    if (threshold <= 0 || duration < threshold) return;
+    if (Math.random() >= config.system.traceSampleRate) return;
+    persist(trace, duration);
+}
+
+export default {
+    start,
+    run,
+    current,
+    startSpan,
+    span,
+    serverTiming,
+    debugInfo,
+    end
+};
@@ -0,0 +1,296 @@
+import logger from "@/lib/logger.ts";
+import storage from "@/lib/storage.ts";
+
+const MINUTE = 60 * 1000;
+const HOUR = 60 * MINUTE;
+const DAY = 24 * HOUR;
+// 各精度的槽位宽度与保留槽位数：分钟保留 6 小时，小时保留 14 天，天保留 400 天
+const TIERS: Record<Resolution, { width: number; slots: number }> = {
+    minute: { width: MINUTE, slots: 6 * 60 },
+    hour: { width: HOUR, slots: 14 * 24 },
+    day: { width: DAY, slots: 400 }
+};
+// 单个槽位最多保留的维度组合，超出后计入 other
+const MAX_POINTS_PER_SLOT = 1000;
+// 快照写入间隔（分钟精度的数据较多，写入频率低于用量统计）
+const FLUSH_INTERVAL = 60 * 1000;
+// 自动选择精度时单次查询的最大时间桶数
+const MAX_BUCKETS = 1440;
+const OTHER = "other";
+
+export type Resolution = "minute" | "hour" | "day";
+export type Dimension = "type" | "model" | "channel" | "account";
+export const DIMENSIONS: Dimension[] = ["type", "model", "channel", "account"];
+
+export interface UsageEvent {
+    type: string;
+    model: string;
+    channel: string;
+    account: string;
+    promptTokens: number;
+    completionTokens: number;
+    /** 请求开始到记录用量的耗时（毫秒），未知时不计入延迟统计 */
+    latencyMs?: number;
+}
+
+export interface UsageQuery {
+    from?: number;
+    to?: number;
+    resolution?: Resolution;
+    groupBy?: Dimension[];
+    filter?: Partial<Record<Dimension, string>>;
+}
+
+interface Point {
+    dims: Record<Dimension, string>;
+    requests: number;
+    promptTokens: number;
+    completionTokens: number;
+    latencyCount: number;
+    latencySum: number;
+    latencyMax: number;
+}
+
+interface Slot {
+    period: number;
+    points: Map<string, Point>;
+}
+
+function createPoint(dims: Record<Dimension, string>): Point {
+    return { dims, requests: 0, promptTokens: 0, completionTokens: 0, latencyCount: 0, latencySum: 0, latencyMax: 0 };
+}
+
+function mergePoint(target: Point, source: Point) {
+    target.requests += source.requests;
+    target.promptTokens += source.promptTokens;
+    target.completionTokens += source.completionTokens;
+    target.latencyCount += source.latencyCount;
+    target.latencySum += source.latencySum;
+    target.latencyMax = Math.max(target.latencyMax, source.latencyMax);
+}
+
+function formatPoint(point: Point) {
+    return {
+        requests: point.requests,
+        prompt_tokens: point.promptTokens,
+        completion_tokens: point.completionTokens,
+        total_tokens: point.promptTokens + point.completionTokens,
+        avg_latency_ms: point.latencyCount ? Math.round(point.latencySum / point.latencyCount) : null,
+        max_latency_ms: point.latencyCount ? Math.round(point.latencyMax) : null
+    };
+}
+
+/**
+ * 单一精度的环形时间序列：槽位 = 时间序号 % 槽位数，每个槽位按维度组合预聚合
+ */
+class SeriesTier {
+
+    private slots: (Slot | null)[];
+
+    constructor(public readonly width: number, public readonly size: number) {
+        this.slots = new Array(size).fill(null);
+    }
+
+    private getSlot(period: number) {
+        const index = period % this.size;
+        let slot = this.slots[index];
+        if (!slot || slot.period !== period) {
+            slot = { period, points: new Map() };
+            this.slots[index] = slot;
+        }
+        return slot;
+    }
+
+    add(time: number, key: string, dims: Record<Dimension, string>, event: UsageEvent) {
+        const slot = this.getSlot(Math.floor(time / this.width));
+        let point = slot.points.get(key);
+        if (!point) {
+            if (slot.points.size >= MAX_POINTS_PER_SLOT) {
+                key = OTHER;
+                point = slot.points.get(OTHER);
+                dims = { type: OTHER, model: OTHER, channel: OTHER, account: OTHER };
+            }
+            if (!point) slot.points.set(key, point = createPoint(dims));
+        }
+        point.requests++;
+        point.promptTokens += event.promptTokens;
+        point.completionTokens += event.completionTokens;
+        if (event.latencyMs !== undefined && event.latencyMs >= 0) {
+            point.latencyCount++;
+            point.latencySum += event.latencyMs;
+            point.latencyMax = Math.max(point.latencyMax, event.latencyMs);
+        }
+    }
+
+    /**
+     * 时间范围 [from, to) 内仍在保留期的槽位
+     */
+    *range(from: number, to: number, now: number) {
+        const current = Math.floor(now / this.width);
+        const first = Math.max(Math.floor(from / this.width), current - this.size + 1);
+        const last = Math.min(Math.ceil(to / this.width) - 1, current);
+        for (let period = first; period <= last; period++) {
+            const slot = this.slots[period % this.size];
+            if (slot && slot.period === period) yield slot;
+        }
+    }
+
+    /**
+     * 回溯保留范围的起点
+     */
+    retentionStart(now: number) {
+        return (Math.floor(now / this.width) - this.size + 1) * this.width;
+    }
+
+    toJSON(now: number) {
+        return [...this.range(0, Infinity, now)].map(slot => [
+            slot.period,
+            [...slot.points.values()].map(point => [
+                ...DIMENSIONS.map(name => point.dims[name]),
+                point.requests, point.promptTokens, point.completionTokens,
+                point.latencyCount, point.latencySum, point.latencyMax
+            ])
+        ]);
+    }
+
+    load(rows: any[], now: number) {
+        const current = Math.floor(now / this.width);
+        for (const [period, points] of rows || []) {
+            if (!Number.isInteger(period) || period > current || current - period >= this.size) continue;
+            const slot = this.getSlot(period);
+            for (const row of points || []) {
+                const dims = Object.fromEntries(DIMENSIONS.map((name, i) => [name, String(row[i])])) as Record<Dimension, string>;
+                const [requests, promptTokens, completionTokens, latencyCount, latencySum, latencyMax] = row.slice(DIMENSIONS.length).map(Number);
+                slot.points.set(DIMENSIONS.map(name => dims[name]).join("\u0001"), {
+                    dims, requests, promptTokens, completionTokens, latencyCount, latencySum, latencyMax
+                });
+            }
+        }
+    }
+
+}
+
+/**
+ * 用量时间序列
+ *
+ * 每次记录同时写入分钟、小时、天三个精度（相当于写入时降采样），
+ * 查询按所选精度遍历范围内的预聚合槽位，不扫描原始请求。
+ */
+class UsageSeries {
+
+    private tiers = {
+        minute: new SeriesTier(TIERS.minute.width, TIERS.minute.slots),
+        hour: new SeriesTier(TIERS.hour.width, TIERS.hour.slots),
+        day: new SeriesTier(TIERS.day.width, TIERS.day.slots)
+    };
+    private dirty = false;
+    private saving: Promise<void> = Promise.resolve();
+
+    record(event: UsageEvent, time = Date.now()) {
+        const dims = {
+            type: event.type || "unknown",
+            model: event.model || "unknown",
+            channel: event.channel || "unknown",
+            account: event.account || "unknown"
+        };
+        const key = DIMENSIONS.map(name => dims[name]).join("\u0001");
+        for (const tier of Object.values(this.tiers)) tier.add(time, key, dims, event);
+        this.dirty = true;
+    }
+
+    /**
+     * 自动选择精度：保留期覆盖起始时间且时间桶数不超过上限的最细精度
+     */
+    private pickResolution(from: number, to: number, now: number): Resolution {
+        for (const name of ["minute", "hour"] as Resolution[]) {
+            const tier = this.tiers[name];
+            if (tier.retentionStart(now) <= from && (to - from) / tier.width <= MAX_BUCKETS) return name;
+        }
+        return "day";
+    }
+
+    /**
+     * 聚合查询
+     *
+     * @returns 按 groupBy 维度分组的时间序列（只包含有数据的时间桶）与各组合计
+     */
+    query(options: UsageQuery = {}) {
+        const now = Date.now();
+        const to = options.to ?? now;
+        const from = options.from ?? to - DAY;
+        const resolution = options.resolution || this.pickResolution(from, to, now);
+        const tier = this.tiers[resolution];
+        const groupBy = (options.groupBy || []).filter(name => DIMENSIONS.includes(name));
+        const filter = options.filter || {};
+        const filters = DIMENSIONS.filter(name => filter[name] !== undefined && filter[name] !== "");
+
+        const groups = new Map<string, { key: Record<string, string>; total: Point; points: Map<number, Point> }>();
+        for (const slot of tier.range(from, to, now)) {
+            const time = slot.period * tier.width;
+            for (const point of slot.points.values()) {
+                if (filters.some(name => point.dims[name] !== filter[name])) continue;
+                const groupKey = groupBy.map(name => point.dims[name]).join("\u0001");
+                let group = groups.get(groupKey);
+                if (!group) {
+                    const key = Object.fromEntries(groupBy.map(name => [name, point.dims[name]]));
+                    group = { key, total: createPoint(point.dims), points: new Map() };
+                    groups.set(groupKey, group);
+                }
+                mergePoint(group.total, point);
+                let bucket = group.points.get(time);
+                if (!bucket) group.points.set(time, bucket = createPoint(point.dims));
+                mergePoint(bucket, point);
+            }
+        }
+
+        return {
+            resolution,
+            from: Math.floor(from / tier.width) * tier.width,
+            to,
+            group_by: groupBy,
+            groups: [...groups.values()]
+                .sort((a, b) => b.total.requests - a.total.requests)
+                .map(group => ({
+                    key: group.key,
+                    total: formatPoint(group.total),
+                    points: [...group.points.entries()]
+                        .sort((a, b) => a[0] - b[0])
+                        .map(([time, point]) => ({ time, ...formatPoint(point) }))
+                }))
+        };
+    }
+
+    async load() {
+        try {
+            const stored = await (await storage.getStorage()).loadDocument("usage-series");
+            const now = Date.now();
+            if (stored) {
+                for (const name of Object.keys(this.tiers) as Resolution[])
+                    this.tiers[name].load(stored[name], now);
+            }
+        } catch (e) {
+            logger.error("加载用量时间序列失败:", e);
+        }
+        setInterval(() => this.flush(), FLUSH_INTERVAL).unref();
+    }
+
+    /**
+     * 写入快照（有变化时）
+     */
+    flush() {
+        if (!this.dirty) return this.saving;
+        this.dirty = false;
+        const now = Date.now();
+        const snapshot = Object.fromEntries(Object.entries(this.tiers).map(([name, tier]) => [name, tier.toJSON(now)]));
+        this.saving = this.saving
+            .then(async () => (await storage.getStorage()).saveDocument("usage-series", snapshot))
+            .catch(e => {
+                this.dirty = true;
+                logger.error("保存用量时间序列失败:", e);
+            });
+        return this.saving;
+    }
+
+}
+
+export default new UsageSeries();
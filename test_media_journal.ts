@@ -0,0 +1,135 @@
+/**
+ * 异步任务快照 + 日志的重放与压缩检查
+ *
+ * 运行：npm run test:journal
+ * 在临时目录中构造快照与日志，每个阶段在独立子进程中加载（模拟重启）并校验结果
+ */
+import os from "os";
+import path from "path";
+import assert from "assert";
+import { spawnSync } from "child_process";
+import fs from "fs-extra";
+
+const MEDIA_DIR = path.join("data", "media");
+const TASKS_FILE = path.join(MEDIA_DIR, "tasks.json");
+const JOURNAL_FILE = path.join(MEDIA_DIR, "tasks.journal.ndjson");
+
+// 子进程沿用主进程的时间基准，保证各阶段构造的时间一致
+const now = Number(process.argv[3]) || Date.now();
+const at = (offset: number) => new Date(now - offset).toISOString();
+
+function createTask(id: string, status: string, data: Record<string, any> = {}) {
+    return { id, type: "image", status, media: [], created_at: at(60000), ...data };
+}
+
+// 快照：A 已完成，B、E 运行中，C 为旧版本保存了 Authorization 的任务
+const SNAPSHOT = {
+    "task-a": createTask("task-a", "succeeded", { completed_at: at(30000), callback_url: "https://example.com/hook" }),
+    "task-b": createTask("task-b", "running", { started_at: at(50000) }),
+    "task-c": createTask("task-c", "queued", { auth: "Bearer 0123456789abcdef0123456789abcdef" }),
+    "task-e": createTask("task-e", "running", { pooled: true, started_at: at(40000) })
+};
+const RECOVERY_RECORD = { op: "patch", id: "task-e", data: { status: "queued", started_at: null } };
+// 日志：回调送达、删除 B、新增 D 后将其标记失败；最后一行模拟崩溃时写入不完整
+const JOURNAL = [
+    { op: "patch", id: "task-a", data: { callback_delivered_at: at(20000), callback_attempts: 1 } },
+    { op: "delete", id: "task-b" },
+    { op: "put", task: createTask("task-d", "queued", { pooled: true }) },
+    { op: "patch", id: "task-d", data: { status: "failed", error: "boom", completed_at: at(10000) } }
+].map(record => JSON.stringify(record) + "\n").join("") + '{"op":"patch","id":"task-d","data":{"status":"succ';
+
+async function load() {
+    const { default: mediaTaskManager } = await import("@/lib/media-task-manager.ts");
+    await mediaTaskManager.init();
+    return mediaTaskManager;
+}
+
+async function checkTasks(mediaTaskManager: any) {
+    const a = await mediaTaskManager.getTask("task-a");
+    assert.equal(a.status, "succeeded");
+    assert.equal(a.callback_delivered_at, at(20000));
+    assert.equal(await mediaTaskManager.getTask("task-b"), null);
+    const c = await mediaTaskManager.getTask("task-c");
+    assert.equal(c.status, "queued");
+    const d = await mediaTaskManager.getTask("task-d");
+    assert.equal(d.status, "failed");
+    assert.equal(d.error, "boom");
+    // 重启时中断的任务回到队列，开始时间被清除
+    const e = await mediaTaskManager.getTask("task-e");
+    assert.equal(e.status, "queued");
+    assert.equal(e.started_at, undefined);
+    const list = await mediaTaskManager.listTasks({ limit: 10 });
+    assert.deepEqual(list.data.map((task: any) => task.id).sort(), ["task-a", "task-c", "task-d", "task-e"]);
+    assert.deepEqual(await mediaTaskManager.getPendingCallbacks(), []);
+}
+
+const phases: Record<string, () => Promise<void>> = {
+    // 重放日志，中断的任务恢复为排队并记录到日志（不压缩，留给下一阶段重放）
+    async recover() {
+        const mediaTaskManager = await load();
+        await checkTasks(mediaTaskManager);
+        for (let i = 0; i < 50; i++) {
+            const lines = (await fs.readFile(JOURNAL_FILE, "utf8")).trim().split("\n").filter(Boolean);
+            if (lines.some(line => line === JSON.stringify(RECOVERY_RECORD))) return;
+            await new Promise(resolve => setTimeout(resolve, 20));
+        }
+        throw new Error("recovery patch not journaled");
+    },
+    // 快照 + 恢复日志重放后压缩进快照
+    async replay() {
+        const mediaTaskManager = await load();
+        await checkTasks(mediaTaskManager);
+        await mediaTaskManager.drain(0);
+        const snapshot = await fs.readJson(TASKS_FILE);
+        assert.deepEqual(Object.keys(snapshot).sort(), ["task-a", "task-c", "task-d", "task-e"]);
+        assert.ok(!("started_at" in snapshot["task-e"]));
+        assert.equal(await fs.readFile(JOURNAL_FILE, "utf8"), "");
+        // 旧记录中的凭据不写回磁盘
+        assert.ok(!("auth" in snapshot["task-c"]));
+        assert.ok(!(await fs.readFile(TASKS_FILE, "utf8")).includes("0123456789abcdef"));
+    },
+    // 只从压缩后的快照加载，再追加新日志
+    async compacted() {
+        const mediaTaskManager = await load();
+        await checkTasks(mediaTaskManager);
+        await mediaTaskManager.patchTask("task-c", { priority: 5 });
+        const lines = (await fs.readFile(JOURNAL_FILE, "utf8")).trim().split("\n");
+        assert.deepEqual(lines.map(line => JSON.parse(line)), [{ op: "patch", id: "task-c", data: { priority: 5 } }]);
+    },
+    // 快照 + 新日志再次重放
+    async reload() {
+        const mediaTaskManager = await load();
+        await checkTasks(mediaTaskManager);
+        assert.equal((await mediaTaskManager.getTask("task-c")).priority, 5);
+    }
+};
+
+const phase = process.argv[2];
+if (phase) {
+    phases[phase]()
+        .then(() => process.exit(0))
+        .catch(err => {
+            console.error(err);
+            process.exit(1);
+        });
+} else {
+    const dir = await fs.mkdtemp(path.join(os.tmpdir(), "media-journal-"));
+    await fs.copy("package.json", path.join(dir, "package.json"));
+    await fs.copy("configs", path.join(dir, "configs"));
+    await fs.ensureDir(path.join(dir, MEDIA_DIR));
+    await fs.writeJson(path.join(dir, TASKS_FILE), SNAPSHOT);
+    await fs.writeFile(path.join(dir, JOURNAL_FILE), JOURNAL);
+    let failed = false;
+    for (const name of Object.keys(phases)) {
+        const result = spawnSync(process.execPath, [process.argv[1], name, String(now)], { cwd: dir, encoding: "utf8" });
+        const passed = result.status === 0;
+        console.log(`${passed ? "PASS" : "FAIL"} ${name}`);
+        if (!passed) {
+            console.log(result.stdout, result.stderr);
+            failed = true;
+            break;
+        }
+    }
+    await fs.remove(dir);
+    process.exit(failed ? 1 : 0);
+}
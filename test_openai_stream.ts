@@ -0,0 +1,87 @@
+/**
+ * OpenAI 兼容渠道流式透传检查：尾部读取用量、剔除附加的用量事件、逐块计数，
+ * 覆盖事件被拆分到多个数据块、CRLF 分隔符与超过尾部缓冲的长流
+ *
+ * 运行：npm run test:openai-stream
+ */
+import assert from "assert";
+import { Readable } from "stream";
+import { pipeline } from "stream/promises";
+import tokenizer from "@/lib/tokenizer.ts";
+import { SSEPassThrough } from "@/api/controllers/openai-proxy.ts";
+
+const USAGE = { prompt_tokens: 12, completion_tokens: 34, total_tokens: 46 };
+const CONTENT = ["你好", "，这是", " a streamed", " answer.", "\n结束"];
+
+function createEvents(separator: string, options: { usage?: boolean; padding?: number } = {}) {
+    const events = CONTENT.map(content => `data: ${JSON.stringify({ choices: [{ index: 0, delta: { content } }], padding: "x".repeat(options.padding || 0) })}`);
+    if (options.usage) events.push(`data: ${JSON.stringify({ choices: [], usage: USAGE })}`);
+    events.push("data: [DONE]");
+    return events.map(event => event + separator).join("");
+}
+
+// 按固定字节数切分，边界会落在事件、"usage" 字段与多字节字符中间
+function split(text: string, size: number) {
+    const buffer = Buffer.from(text);
+    const chunks: Buffer[] = [];
+    for (let i = 0; i < buffer.length; i += size) chunks.push(buffer.subarray(i, i + size));
+    return chunks;
+}
+
+async function run(chunks: Buffer[], options: ConstructorParameters<typeof SSEPassThrough>[0] = {}) {
+    const stream = new SSEPassThrough(options);
+    const output: Buffer[] = [];
+    stream.on("data", chunk => output.push(chunk));
+    await pipeline(Readable.from(chunks), stream);
+    return { text: Buffer.concat(output).toString("utf8"), usage: stream.getUsage() };
+}
+
+let failed = 0;
+async function check(name: string, fn: () => Promise<void>) {
+    try {
+        await fn();
+        console.log(`PASS ${name}`);
+    } catch (err) {
+        failed++;
+        console.log(`FAIL ${name}: ${err?.message || err}`);
+    }
+}
+
+await tokenizer.init();
+for (const [label, separator] of [["LF", "\n\n"], ["CRLF", "\r\n\r\n"]]) {
+    for (const size of [1, 7, 64, 4096]) {
+        await check(`pass-through ${label} chunk=${size}`, async () => {
+            const input = createEvents(separator, { usage: true });
+            const { text, usage } = await run(split(input, size));
+            assert.equal(text, input);
+            assert.deepEqual(usage, USAGE);
+        });
+        await check(`drop usage ${label} chunk=${size}`, async () => {
+            const { text, usage } = await run(split(createEvents(separator, { usage: true }), size), { dropUsage: true });
+            assert.ok(!text.includes('"usage"'));
+            assert.ok(text.includes("data: [DONE]"));
+            assert.equal(text.split(/\r?\n\r?\n/).filter(Boolean).length, CONTENT.length + 1);
+            assert.deepEqual(usage, USAGE);
+        });
+        await check(`count ${label} chunk=${size}`, async () => {
+            const input = createEvents(separator);
+            const counter = tokenizer.createCounter();
+            const { text, usage } = await run(split(input, size), { counter });
+            assert.equal(text, input);
+            assert.equal(usage, null);
+            assert.equal(counter.finish(), tokenizer.count(CONTENT.join("")));
+        });
+    }
+}
+await check("pass-through long stream keeps usage in tail", async () => {
+    const input = createEvents("\n\n", { usage: true, padding: 8192 });
+    const { text, usage } = await run(split(input, 1000));
+    assert.equal(text, input);
+    assert.deepEqual(usage, USAGE);
+});
+await check("pass-through without usage", async () => {
+    const { usage } = await run(split(createEvents("\n\n"), 10));
+    assert.equal(usage, null);
+});
+
+process.exit(failed > 0 ? 1 : 0);
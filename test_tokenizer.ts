@@ -0,0 +1,43 @@
+/**
+ * 分词计数检查：与 tiktoken（cl100k_base）的结果对照，并校验流式增量计数与整体计数一致
+ *
+ * 运行：npm run test:tokenizer
+ */
+import assert from "assert";
+import tokenizer from "@/lib/tokenizer.ts";
+
+// 期望值由 tiktoken 0.14（cl100k_base）计算
+const CASES: [string, number][] = [
+    ["Hello, world! It's 2025.", 10],
+    ["豆包是字节跳动推出的大模型助手，可以回答问题、写作、翻译和编程。", 37],
+    ["```ts\nconst total = items.reduce((sum, item) => sum + item.price * 1.08, 0);\n```\n", 29],
+    ["  - 列表项 one\n  - 列表项 two：包含 mixed 中英文 content。\n\n", 24],
+    ["I've been there; they'll see.  Multiple   spaces\n\n\nnewlines 123456789", 20]
+];
+
+await tokenizer.init();
+let failed = 0;
+function check(name: string, fn: () => void) {
+    try {
+        fn();
+        console.log(`PASS ${name}`);
+    } catch (err) {
+        failed++;
+        console.log(`FAIL ${name}: ${err?.message || err}`);
+    }
+}
+
+check("empty", () => assert.equal(tokenizer.count(""), 0));
+CASES.forEach(([text, expected], index) => check(`tiktoken #${index + 1}`, () => assert.equal(tokenizer.count(text), expected)));
+
+// 分片边界落在单词、空白、多字节字符与超长片段中间
+const STREAM_TEXT = CASES.map(([text]) => text).join("") + "很长的一段没有标点的中文".repeat(30) + "  \n\n  end  ";
+for (let size = 1; size <= 9; size++) {
+    check(`streaming chunk=${size}`, () => {
+        const counter = tokenizer.createCounter();
+        for (let i = 0; i < STREAM_TEXT.length; i += size) counter.push(STREAM_TEXT.slice(i, i + size));
+        assert.equal(counter.finish(), tokenizer.count(STREAM_TEXT));
+    });
+}
+
+process.exit(failed > 0 ? 1 : 0);